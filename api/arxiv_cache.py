@@ -0,0 +1,385 @@
+"""
+arXiv search with a local SQLite FTS5 index of every paper the app has fetched.
+
+`arxiv_search(query)` answers, in order:
+
+1. arXiv IDs in the query from the local table; the missing ones are fetched in one `id_list`
+   request;
+2. a query seen in the last ARXIV_QUERY_TTL_SECONDS from the IDs it returned then;
+3. a local full-text match on title, authors and abstract, when at least ARXIV_LOCAL_MIN_RESULTS
+   papers fetched in the last ARXIV_QUERY_TTL_SECONDS contain every query term;
+4. the arXiv API. Its results are stored in the index, and if the call fails the best local
+   matches are returned instead.
+
+Every request to arxiv.org goes through one `ArxivRateLimiter`: a FIFO queue that sends at most
+one request per ARXIV_MIN_INTERVAL_SECONDS per process, as arXiv asks of API clients.
+PDF downloads for `ingest_arxiv_papers` are included.
+
+`ingest_arxiv_papers` downloads papers and passes them through `process_pdfs`, so they are added
+to a conversation as if the user had uploaded them.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from api.services import services
+
+
+load_dotenv()
+
+ARXIV_CACHE_DB = os.environ.get("ARXIV_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "arxiv_cache.sqlite3"))
+ARXIV_MIN_INTERVAL_SECONDS = float(os.environ.get("ARXIV_MIN_INTERVAL_SECONDS", 3))
+ARXIV_MAX_RESULTS = int(os.environ.get("ARXIV_MAX_RESULTS", 3))
+ARXIV_QUERY_TTL_SECONDS = float(os.environ.get("ARXIV_QUERY_TTL_SECONDS", 7 * 24 * 3600))
+ARXIV_LOCAL_MIN_RESULTS = int(os.environ.get("ARXIV_LOCAL_MIN_RESULTS", 3))
+ARXIV_ID_BATCH_SIZE = int(os.environ.get("ARXIV_ID_BATCH_SIZE", 100))
+ARXIV_TIMEOUT_SECONDS = float(os.environ.get("ARXIV_TIMEOUT_SECONDS", 30))
+ARXIV_MAX_INGEST_PAPERS = int(os.environ.get("ARXIV_MAX_INGEST_PAPERS", 5))
+# Same cap as ArxivAPIWrapper.doc_content_chars_max, so tool output does not grow
+ARXIV_MAX_OUTPUT_CHARS = int(os.environ.get("ARXIV_MAX_OUTPUT_CHARS", 4000))
+
+# New-style (2401.01234v2) and old-style (hep-th/9901001) identifiers
+ARXIV_ID_PATTERN = re.compile(r"(?<![\w.])(\d{4}\.\d{4,5}(?:v\d+)?|[a-z-]+(?:\.[A-Z]{2})?/\d{7}(?:v\d+)?)(?![\w])")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    authors TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    published TEXT,
+    updated TEXT,
+    categories TEXT,
+    pdf_url TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+    title, authors, summary, content='papers', content_rowid='rowid', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS papers_ai AFTER INSERT ON papers BEGIN
+    INSERT INTO papers_fts(rowid, title, authors, summary) VALUES (new.rowid, new.title, new.authors, new.summary);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_ad AFTER DELETE ON papers BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title, authors, summary) VALUES ('delete', old.rowid, old.title, old.authors, old.summary);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_au AFTER UPDATE ON papers BEGIN
+    INSERT INTO papers_fts(papers_fts, rowid, title, authors, summary) VALUES ('delete', old.rowid, old.title, old.authors, old.summary);
+    INSERT INTO papers_fts(rowid, title, authors, summary) VALUES (new.rowid, new.title, new.authors, new.summary);
+END;
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    ids TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class Paper:
+    id: str
+    title: str
+    authors: str
+    summary: str
+    published: str = ""
+    updated: str = ""
+    categories: str = ""
+    pdf_url: str = ""
+    fetched_at: float = 0.0
+
+    @classmethod
+    def from_result(cls, result) -> "Paper":
+        return cls(
+            id=base_id(result.get_short_id()),
+            title=" ".join(result.title.split()),
+            authors=", ".join(author.name for author in result.authors),
+            summary=" ".join(result.summary.split()),
+            published=result.published.date().isoformat() if result.published else "",
+            updated=result.updated.date().isoformat() if result.updated else "",
+            categories=" ".join(result.categories),
+            pdf_url=result.pdf_url or "",
+            fetched_at=time.time(),
+        )
+
+    def format(self) -> str:
+        # The fields and layout of the langchain arxiv tool, plus the ID for ingestion
+        return f"Published: {self.published}\narXiv ID: {self.id}\nTitle: {self.title}\nAuthors: {self.authors}\nSummary: {self.summary}"
+
+
+def base_id(arxiv_id: str) -> str:
+    return re.sub(r"v\d+$", "", arxiv_id)
+
+
+def pdf_file_name(arxiv_id: str) -> str:
+    return f"arxiv_{base_id(arxiv_id).replace('/', '_')}.pdf".lower()
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def fts_query(query: str, match_all: bool = True) -> Optional[str]:
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return None
+    return (" " if match_all else " OR ").join(f'"{term}"' for term in terms)
+
+
+class ArxivRateLimiter:
+    """Callers take turns in arrival order, at least `interval` seconds apart."""
+
+    def __init__(self, interval: float = ARXIV_MIN_INTERVAL_SECONDS):
+        self.interval = interval
+        self._condition = threading.Condition()
+        self._tickets = 0
+        self._serving = 0
+        self._last_request = 0.0
+
+    def __enter__(self):
+        with self._condition:
+            ticket = self._tickets
+            self._tickets += 1
+            self._condition.wait_for(lambda: self._serving == ticket)
+        time.sleep(max(0.0, self._last_request + self.interval - time.monotonic()))
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self._last_request = time.monotonic()
+            self._serving += 1
+            self._condition.notify_all()
+
+    @property
+    def queued(self) -> int:
+        return self._tickets - self._serving
+
+
+class ArxivIndex:
+    """The local papers table, its FTS5 index and the query cache."""
+
+    def __init__(self, path: str = ARXIV_CACHE_DB):
+        self.path = path
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.row_factory = sqlite3.Row
+            with connection:  # commits, or rolls back on error
+                yield connection
+        finally:
+            connection.close()
+
+    def put(self, papers: List[Paper]):
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO papers VALUES (:id, :title, :authors, :summary, :published, :updated, :categories, :pdf_url, :fetched_at) "
+                "ON CONFLICT(id) DO UPDATE SET title=excluded.title, authors=excluded.authors, summary=excluded.summary, "
+                "published=excluded.published, updated=excluded.updated, categories=excluded.categories, "
+                "pdf_url=excluded.pdf_url, fetched_at=excluded.fetched_at",
+                [asdict(paper) for paper in papers],
+            )
+
+    def get(self, ids: List[str]) -> Dict[str, Paper]:
+        ids = [base_id(arxiv_id) for arxiv_id in ids]
+        if not ids:
+            return {}
+        with self._connect() as connection:
+            rows = connection.execute(f"SELECT * FROM papers WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+        return {row["id"]: Paper(**dict(row)) for row in rows}
+
+    def search(self, query: str, limit: int, match_all: bool = True, max_age: Optional[float] = None) -> List[Paper]:
+        """Full-text matches, best first; with `max_age`, only papers fetched within that many seconds."""
+        match = fts_query(query, match_all)
+        if match is None:
+            return []
+        oldest = time.time() - max_age if max_age is not None else 0
+        with self._connect() as connection:
+            rows = connection.execute(
+                # Title matches count most, then authors, then the abstract
+                "SELECT papers.* FROM papers_fts JOIN papers ON papers.rowid = papers_fts.rowid "
+                "WHERE papers_fts MATCH ? AND papers.fetched_at >= ? ORDER BY bm25(papers_fts, 10.0, 5.0, 1.0) LIMIT ?",
+                (match, oldest, limit),
+            ).fetchall()
+        return [Paper(**dict(row)) for row in rows]
+
+    def get_query(self, query: str, max_age: float) -> Optional[List[str]]:
+        with self._connect() as connection:
+            row = connection.execute("SELECT ids, fetched_at FROM queries WHERE query = ?", (normalize_query(query),)).fetchone()
+        if row is None or time.time() - row["fetched_at"] > max_age:
+            return None
+        return json.loads(row["ids"])
+
+    def put_query(self, query: str, ids: List[str]):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+                (normalize_query(query), json.dumps([base_id(arxiv_id) for arxiv_id in ids]), time.time()),
+            )
+
+    def count(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+
+class ArxivSearch:
+    def __init__(self, index: ArxivIndex = None, limiter: ArxivRateLimiter = None, max_results: int = ARXIV_MAX_RESULTS):
+        self.index = index or ArxivIndex()
+        self.limiter = limiter or ArxivRateLimiter()
+        self.max_results = max_results
+        self.stats = Counter()
+        self._clients = {}
+
+    def client(self, page_size: int):
+        # The arxiv client asks for a full page even when fewer results are wanted, so size it per request
+        if page_size not in self._clients:
+            import arxiv
+            # Spacing between requests is the limiter's job
+            self._clients[page_size] = arxiv.Client(page_size=page_size, delay_seconds=0, num_retries=1)
+        return self._clients[page_size]
+
+    def _remote(self, query: str = "", id_list: List[str] = (), max_results: int = None) -> List[Paper]:
+        import arxiv
+
+        search = arxiv.Search(query=query, id_list=list(id_list), max_results=max_results)
+        with self.limiter:
+            self.stats["remote_requests"] += 1
+            papers = [Paper.from_result(result) for result in self.client(max_results).results(search)]
+        self.index.put(papers)
+        return papers
+
+    def lookup(self, ids: List[str]) -> List[Paper]:
+        """Papers by arXiv ID, in the order given; unknown IDs are fetched in batches."""
+        ids = list(dict.fromkeys(base_id(arxiv_id) for arxiv_id in ids))
+        found = self.index.get(ids)
+        self.stats["local_ids"] += len(found)
+        missing = [arxiv_id for arxiv_id in ids if arxiv_id not in found]
+        for start in range(0, len(missing), ARXIV_ID_BATCH_SIZE):
+            batch = missing[start:start + ARXIV_ID_BATCH_SIZE]
+            for paper in self._remote(id_list=batch, max_results=len(batch)):
+                found[base_id(paper.id)] = paper
+        return [found[arxiv_id] for arxiv_id in ids if arxiv_id in found]
+
+    def search(self, query: str) -> List[Paper]:
+        ids = ARXIV_ID_PATTERN.findall(query)
+        if ids:
+            return self.lookup(ids)
+
+        cached_ids = self.index.get_query(query, ARXIV_QUERY_TTL_SECONDS)
+        if cached_ids is not None:
+            papers = self.index.get(cached_ids)
+            if len(papers) == len(cached_ids):
+                self.stats["query_cache"] += 1
+                return [papers[arxiv_id] for arxiv_id in cached_ids]
+
+        # Same freshness bound as the query cache, so newer submissions are not hidden for good
+        local = self.index.search(query, self.max_results, max_age=ARXIV_QUERY_TTL_SECONDS)
+        if len(local) >= min(ARXIV_LOCAL_MIN_RESULTS, self.max_results):
+            self.stats["local_search"] += 1
+            return local
+
+        try:
+            papers = self._remote(query=query, max_results=self.max_results)
+        except Exception as e:
+            print(f"arXiv API failed, answering from the local index: {e}")
+            self.stats["remote_failures"] += 1
+            return self.index.search(query, self.max_results, match_all=False)
+        self.index.put_query(query, [paper.id for paper in papers])
+        return papers
+
+    def run(self, query: str) -> str:
+        try:
+            papers = self.search(query)
+        except Exception as e:
+            return f"Arxiv exception: {e}"
+        if not papers:
+            return "No good Arxiv Result was found"
+        return "\n\n".join(paper.format() for paper in papers)[:ARXIV_MAX_OUTPUT_CHARS]
+
+    def download_pdf(self, paper: Paper, directory: str) -> str:
+        url = paper.pdf_url or f"https://arxiv.org/pdf/{paper.id}"
+        path = os.path.join(directory, pdf_file_name(paper.id))
+        with self.limiter:
+            self.stats["pdf_downloads"] += 1
+            with httpx.stream("GET", url, timeout=ARXIV_TIMEOUT_SECONDS, follow_redirects=True) as response:
+                response.raise_for_status()
+                with open(path, "wb") as f:
+                    for chunk in response.iter_bytes():
+                        f.write(chunk)
+        return path
+
+
+services.register("arxiv_search", ArxivSearch)
+
+
+def get_arxiv_search() -> ArxivSearch:
+    return services.get("arxiv_search")
+
+
+async def ingest_arxiv_papers(ids: List[str], user_id: str, email: str, conversation_id: str, ingestion_mode: str = None) -> dict:
+    """
+    Download arXiv papers, index them into a conversation through `process_pdfs` and add them
+    to its file manifest.
+    Returns {"uploaded_files": {...}, "skipped": [ids already in the conversation or not found]}.
+    """
+    from starlette.datastructures import UploadFile
+    from api.qdrant_cloud_ops import process_pdfs, connect_to_qdrant, get_embedding_model, COLLECTION_NAME
+    from api.storage import get_storage, file_key
+    from api.tenancy import route_user
+    from api.redis_ops import update_conversation_files
+
+    if len(ids) > ARXIV_MAX_INGEST_PAPERS:
+        raise ValueError(f"At most {ARXIV_MAX_INGEST_PAPERS} papers can be added at once.")
+    search = await asyncio.to_thread(get_arxiv_search)
+    papers = await asyncio.to_thread(search.lookup, ids)
+    qclient_ = await asyncio.to_thread(connect_to_qdrant)
+    if qclient_ is None:
+        raise RuntimeError("Vector store unavailable.")
+
+    storage = get_storage()
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        try:
+            for paper in papers:
+                # Downloads count against the arXiv rate limit; skip papers the conversation already has
+                if await storage.exists(file_key(user_id, conversation_id, pdf_file_name(paper.id))):
+                    continue
+                path = await asyncio.to_thread(search.download_pdf, paper, directory)
+                files.append(UploadFile(file=open(path, "rb"), filename=os.path.basename(path), size=os.path.getsize(path)))
+            result = await process_pdfs(
+                files=files,
+                qclient_=qclient_,
+                collection_name=COLLECTION_NAME,
+                emb_model=get_embedding_model(),
+                user_id=user_id,
+                email=email,
+                conversation_id=conversation_id,
+                storage=storage,
+                ingestion_mode=ingestion_mode,
+                partition=await asyncio.to_thread(route_user, user_id, email),
+            )
+        finally:
+            for file in files:
+                file.file.close()
+
+    uploaded = result["uploaded_files"]
+    if uploaded:
+        await update_conversation_files(user_id=user_id, conversation_id=conversation_id, uploaded_files=uploaded)
+    skipped = [arxiv_id for arxiv_id in ids if pdf_file_name(arxiv_id) not in uploaded]
+    return {"uploaded_files": uploaded, "skipped": skipped}
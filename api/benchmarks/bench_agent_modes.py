@@ -0,0 +1,119 @@
+"""
+ReAct vs. ReWOO on the same research task, with simulated LLM and tool latency.
+
+Usage:
+    python -m api.benchmarks.bench_agent_modes --tools 3 --llm-ms 800 --tool-ms 600 --runs 5
+
+Both agents use one fake chat model that sleeps `--llm-ms` per call. The ReAct model asks for one
+tool per turn, like a model that searches, reads, then searches again, until it has called
+`--tools` tools. The ReWOO planner returns a plan with the same tool calls: all but the last are
+independent, and the last refers to #E1. Tools sleep `--tool-ms`. The report gives LLM calls, tool
+calls and end-to-end latency per mode.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import StructuredTool
+
+from api.benchmarks.bench_auth_db import _percentile
+from api.rewoo import ReWOOAgent
+
+
+class ScriptedChatModel(BaseChatModel):
+    latency_s: float = 0.5
+    tool_calls: int = 3
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError("async only")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency_s)
+        if isinstance(messages[0], SystemMessage) and "Agents Available" in messages[0].content:
+            message = AIMessage(content=self._plan())
+        else:
+            done = sum(isinstance(message, ToolMessage) for message in messages)
+            if kwargs.get("tools") and done < self.tool_calls:
+                message = AIMessage(content="", tool_calls=[{"name": "search", "args": {"query": f"q{done}"}, "id": f"call-{done}"}])
+            else:
+                message = AIMessage(content="final answer")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[tool.name for tool in tools], **kwargs)
+
+    def _plan(self) -> str:
+        lines = [f"Plan: search part {i}. #E{i} = Searcher[q{i}]" for i in range(1, self.tool_calls)]
+        lines.append(f"Plan: follow up on #E1. #E{self.tool_calls} = RagSearcher[details of #E1]")
+        return "\n".join(lines)
+
+
+def build_search_tool(latency_s, counter):
+    async def search(query: str) -> str:
+        """Search for `query`."""
+        counter["tool_calls"] += 1
+        await asyncio.sleep(latency_s)
+        return f"results for {query}"
+    return search
+
+
+async def run_react(args) -> dict:
+    from langgraph.prebuilt import create_react_agent
+
+    model = ScriptedChatModel(latency_s=args.llm_ms / 1000, tool_calls=args.tools)
+    counter = {"tool_calls": 0}
+    tool = StructuredTool.from_function(coroutine=build_search_tool(args.tool_ms / 1000, counter), name="search")
+    agent = create_react_agent(model, tools=[tool])
+
+    started = time.perf_counter()
+    await agent.ainvoke({"messages": [("user", "task")]})
+    return {"seconds": time.perf_counter() - started, "llm_calls": model.calls, "tool_calls": counter["tool_calls"]}
+
+
+async def run_rewoo(args) -> dict:
+    model = ScriptedChatModel(latency_s=args.llm_ms / 1000, tool_calls=args.tools)
+    counter = {"tool_calls": 0}
+    search = build_search_tool(args.tool_ms / 1000, counter)
+
+    async def tool(query, config):
+        return await search(query)
+
+    agent = ReWOOAgent(model, tools={"searcher": tool, "ragsearcher": tool})
+    result = await agent.ainvoke("task")
+    return {"seconds": result["seconds"], "llm_calls": model.calls, "tool_calls": counter["tool_calls"]}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tools", type=int, default=3, help="Tool calls the task needs.")
+    parser.add_argument("--llm-ms", type=float, default=800)
+    parser.add_argument("--tool-ms", type=float, default=600)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    report = {"tools": args.tools, "llm_ms": args.llm_ms, "tool_ms": args.tool_ms, "modes": []}
+    for mode, run in (("react", run_react), ("rewoo", run_rewoo)):
+        runs = [await run(args) for _ in range(args.runs)]
+        seconds = [r["seconds"] for r in runs]
+        report["modes"].append({
+            "mode": mode,
+            "llm_calls": runs[0]["llm_calls"],
+            "tool_calls": runs[0]["tool_calls"],
+            "p50_s": round(_percentile(seconds, 50), 3),
+            "max_s": round(max(seconds), 3),
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,309 @@
+"""
+End-to-end load test of the FastAPI app, served by uvicorn in-process with local stand-ins for
+Groq, the embedding API, Qdrant, Tavily/arXiv and Redis (see load_standins.py).
+
+Usage:
+    python -m api.benchmarks.bench_load --users 50 --uploads 20 --connections 50 --messages 3
+    python -m api.benchmarks.bench_load --scenario chat --connections 200 --llm-latency lognormal:400:1500
+    python -m api.benchmarks.bench_load --redis-url redis://localhost:6379/15   # a real, disposable Redis
+
+Scenarios (in this order; `auth` always runs, the others create their users' data through it):
+    auth     a burst of --users signups, then a burst of logins
+    upload   --uploads users create a conversation and upload a generated PDF of --pages pages
+    chat     --connections concurrent WebSocket chats (/api/llm_chat) sending --messages
+             questions each and waiting for each answer
+
+LLM, embedding and search latencies are drawn from seeded distributions (fixed:MS,
+uniform:LOW:HIGH or lognormal:MEDIAN:P95 in milliseconds). The model is not wrapped in the LLM
+gateway unless --gateway is given, so its rate limits don't hide the server's own throughput.
+
+The report gives, per phase, throughput, errors, latency percentiles and a histogram, and the
+event loop lag of the server (how late a 5 ms timer on the server's loop fires) during the phase.
+Chat phases also give the time to the first message of each answer. Everything the run creates
+lives in a temporary directory.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import tempfile
+import threading
+import time
+
+import fitz
+import httpx
+import uvicorn
+import websockets
+
+from api.benchmarks.bench_auth_db import _percentile
+from api.benchmarks.load_standins import ANSWER_PREFIX, LatencyDistribution, install_standins
+
+
+HISTOGRAM_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+PASSWORD = "Load@1234"
+
+
+class LoopLagMonitor:
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self.samples = []
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval_s))
+
+    def take(self) -> dict:
+        samples, self.samples = self.samples, []
+        return {
+            "p50_ms": round(_percentile(samples, 50) * 1000, 2),
+            "p99_ms": round(_percentile(samples, 99) * 1000, 2),
+            "max_ms": round(max(samples, default=0.0) * 1000, 2),
+        }
+
+
+def start_server(app, monitor: LoopLagMonitor):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", ws_max_queue=1024))
+
+    async def serve():
+        # The monitor shares the server's loop, so it sees every blocking call the app makes on it
+        lag = asyncio.create_task(monitor.run())
+        try:
+            await server.serve()
+        finally:
+            lag.cancel()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            httpx.get(f"{base_url}/api/health/live")
+            return server, thread, base_url
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError("The server did not start.")
+
+
+def histogram(latencies) -> dict:
+    counts = {f"<={bucket}ms": 0 for bucket in HISTOGRAM_BUCKETS_MS}
+    counts[f">{HISTOGRAM_BUCKETS_MS[-1]}ms"] = 0
+    for latency in latencies:
+        ms = latency * 1000
+        bucket = next((f"<={bucket}ms" for bucket in HISTOGRAM_BUCKETS_MS if ms <= bucket), f">{HISTOGRAM_BUCKETS_MS[-1]}ms")
+        counts[bucket] += 1
+    return counts
+
+
+def phase_report(name, latencies, errors, seconds, monitor, **extra) -> dict:
+    return {
+        "phase": name,
+        "ops": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "ops_per_sec": round(len(latencies) / seconds, 2) if seconds else 0.0,
+        "latency_ms": {f"p{q}": round(_percentile(latencies, q) * 1000, 2) for q in (50, 95, 99)},
+        "histogram": histogram(latencies),
+        "loop_lag": monitor.take(),
+        **extra,
+    }
+
+
+async def run_phase(name, operation, total, concurrency, monitor) -> dict:
+    """`operation(i)` raises on failure."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def run_one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await operation(i)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+            latencies.append(time.perf_counter() - started)
+
+    monitor.take()
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(i) for i in range(total)))
+    return phase_report(name, latencies, len(errors), time.perf_counter() - started, monitor, first_errors=errors[:3])
+
+
+def build_pdf(pages: int, label: str) -> bytes:
+    with fitz.open() as document:
+        for page_number in range(1, pages + 1):
+            page = document.new_page()
+            page.insert_text((72, 72), f"{page_number}. Section {page_number} of {label}", fontsize=16)
+            text = " ".join(f"Sentence {i} of page {page_number} in {label} about retrieval, agents and latency." for i in range(40))
+            page.insert_textbox(fitz.Rect(72, 100, 540, 770), text, fontsize=10)
+        return document.tobytes()
+
+
+async def auth_scenario(http, args, monitor, run_id):
+    emails = [f"load-{run_id}-{i}@example.com" for i in range(args.users)]
+    tokens = {}
+
+    async def signup(i):
+        response = await http.post("/api/signup", json={"name": f"load {i}", "email": emails[i], "password": PASSWORD})
+        response.raise_for_status()
+
+    async def login(i):
+        response = await http.post("/api/login", json={"email": emails[i], "password": PASSWORD})
+        response.raise_for_status()
+        tokens[i] = response.cookies["auth_token"]
+
+    phases = [
+        await run_phase("signup", signup, args.users, args.users, monitor),
+        await run_phase("login", login, args.users, args.users, monitor),
+    ]
+    return phases, [tokens[i] for i in sorted(tokens)]
+
+
+async def upload_scenario(http, args, monitor, tokens):
+    conversations = {}
+    pdfs = [build_pdf(args.pages, f"load paper {i}") for i in range(args.uploads)]
+
+    async def add_conversation(i):
+        response = await http.post("/api/add_conversation", cookies={"auth_token": tokens[i % len(tokens)]},
+                                   json={"conversation_name": f"load {i}", "conversation_description": "Papers about retrieval augmented generation"})
+        response.raise_for_status()
+        conversations[i] = response.json()["conversation_id"]
+
+    async def upload(i):
+        response = await http.post(f"/api/upload/{conversations[i]}", cookies={"auth_token": tokens[i % len(tokens)]},
+                                   files={"files": (f"load_paper_{i}.pdf", pdfs[i], "application/pdf")})
+        response.raise_for_status()
+
+    phases = [await run_phase("add_conversation", add_conversation, args.uploads, args.concurrency, monitor)]
+    if not conversations:
+        return phases + [{"phase": "upload", "skipped": "no conversation was created"}]
+    # Conversations that failed to be created are left out
+    created = sorted(conversations)
+    upload_phase = await run_phase("upload", lambda i: upload(created[i]), len(created), args.concurrency, monitor)
+    return phases + [{**upload_phase, "pages": args.pages, "pdf_bytes": len(pdfs[0])}]
+
+
+async def chat_scenario(base_url, args, monitor, tokens, mode):
+    ws_url = base_url.replace("http://", "ws://")
+    connect_latencies, turn_latencies, first_message_latencies = [], [], []
+    errors = []
+    received = 0
+
+    async def chat(connection):
+        nonlocal received
+        started = time.perf_counter()
+        url = f"{ws_url}/api/llm_chat/load-chat-{connection}?mode={mode}"
+        async with websockets.connect(url, extra_headers={"Cookie": f"auth_token={tokens[connection % len(tokens)]}"},
+                                      open_timeout=args.timeout, max_size=None) as websocket:
+            await asyncio.wait_for(websocket.recv(), args.timeout)  # greeting
+            connect_latencies.append(time.perf_counter() - started)
+            for turn in range(args.messages):
+                token = f"q-{connection}-{turn}"
+                started = time.perf_counter()
+                first = None
+                await websocket.send(f"What do recent papers say about {token}?")
+                while True:
+                    message = await asyncio.wait_for(websocket.recv(), args.timeout)
+                    received += 1
+                    first = first or time.perf_counter() - started
+                    if message.startswith(f"{ANSWER_PREFIX} {token}"):
+                        break
+                turn_latencies.append(time.perf_counter() - started)
+                first_message_latencies.append(first)
+
+    async def run_one(connection):
+        try:
+            await chat(connection)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    monitor.take()
+    started = time.perf_counter()
+    await asyncio.gather(*(run_one(connection) for connection in range(args.connections)))
+    seconds = time.perf_counter() - started
+    return [phase_report(
+        "chat", turn_latencies, len(errors), seconds, monitor,
+        mode=mode,
+        connections=args.connections,
+        messages_received_per_sec=round(received / seconds, 2) if seconds else 0.0,
+        connect_ms={f"p{q}": round(_percentile(connect_latencies, q) * 1000, 2) for q in (50, 99)},
+        first_message_ms={f"p{q}": round(_percentile(first_message_latencies, q) * 1000, 2) for q in (50, 95, 99)},
+        first_errors=errors[:3],
+    )]
+
+
+async def run(args, base_url) -> dict:
+    run_id = str(int(time.time()))
+    report = {"phases": []}
+    limits = httpx.Limits(max_connections=max(args.users, args.concurrency) + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as http:
+        phases, tokens = await auth_scenario(http, args, monitor, run_id)
+        report["phases"].extend(phases)
+        if not tokens:
+            report["aborted"] = "no user could log in"
+            return report
+        if "upload" in args.scenario:
+            report["phases"].extend(await upload_scenario(http, args, monitor, tokens))
+    if "chat" in args.scenario:
+        report["phases"].extend(await chat_scenario(base_url, args, monitor, tokens, args.mode))
+    return report
+
+
+monitor = LoopLagMonitor()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=["auth", "upload", "chat"], default=None)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=3, help="Questions per chat connection.")
+    parser.add_argument("--mode", default="react", choices=["react", "rewoo"], help="Agent of the chat websocket.")
+    parser.add_argument("--concurrency", type=int, default=25, help="Concurrent requests in the upload phases.")
+    parser.add_argument("--llm-latency", default="lognormal:300:900")
+    parser.add_argument("--embed-latency", default="lognormal:80:200")
+    parser.add_argument("--search-latency", default="lognormal:400:1200")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--gateway", action="store_true", help="Send LLM calls through the LLM gateway and its limits.")
+    parser.add_argument("--redis-url", default=None, help="A disposable Redis; in-memory if omitted.")
+    parser.add_argument("--database-url", default=None, help="A disposable database; SQLite in the run's directory if omitted.")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    args.scenario = args.scenario or ["auth", "upload", "chat"]
+
+    work_dir = tempfile.mkdtemp(prefix="bench-load-")
+    install_standins(
+        work_dir,
+        llm_latency=LatencyDistribution(args.llm_latency, args.seed),
+        embed_latency=LatencyDistribution(args.embed_latency, args.seed + 1),
+        search_latency=LatencyDistribution(args.search_latency, args.seed + 2),
+        redis_url=args.redis_url,
+        database_url=args.database_url,
+        gateway=args.gateway,
+    )
+
+    from api.index import app
+    server, thread, base_url = start_server(app, monitor)
+    try:
+        report = asyncio.run(run(args, base_url))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    report = {
+        "work_dir": work_dir,
+        "latencies": {"llm": args.llm_latency, "embedding": args.embed_latency, "search": args.search_latency},
+        "gateway": args.gateway,
+        **report,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Recall@k and query latency for different Qdrant collection settings on a synthetic corpus.
+
+Usage:
+    docker run -p 6333:6333 qdrant/qdrant
+    python -m api.benchmarks.bench_qdrant_tuning --url http://localhost:6333 \
+        --points 1000000 --queries 200 --top-k 10 \
+        --config baseline:none --config scalar:scalar --config scalar-disk:scalar:disk \
+        --config binary:binary --config scalar-m32:scalar::32:200 \
+        --hnsw-ef 64,128,256 --oversampling 1,2,4
+
+A config is `name:quantization[:disk][:m][:ef_construct]`. Each one gets its own `bench-<name>`
+collection (reused with --keep if it already holds the full corpus). The corpus is clustered
+unit vectors regenerated deterministically batch by batch, so ground truth is computed exactly
+with numpy without ever holding the whole corpus in memory. Every collection is queried with
+each hnsw_ef value and, for quantized ones, each oversampling factor (rescoring on).
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from api.collection_config import collection_params, search_params
+
+
+BATCH_SIZE = 10_000
+CLUSTERS = 1_000
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def cluster_centres(dim, seed):
+    return _normalize(np.random.default_rng(seed).standard_normal((CLUSTERS, dim)).astype(np.float32))
+
+
+def corpus_batch(batch_index, dim, seed, centres):
+    """Batch `batch_index` of the corpus; the same arguments always give the same vectors."""
+    rng = np.random.default_rng((seed, batch_index))
+    assignments = rng.integers(0, CLUSTERS, BATCH_SIZE)
+    noise = rng.standard_normal((BATCH_SIZE, dim)).astype(np.float32) * 0.05
+    return _normalize(centres[assignments] + noise)
+
+
+def iter_corpus(points, dim, seed):
+    centres = cluster_centres(dim, seed)
+    for batch_index in range((points + BATCH_SIZE - 1) // BATCH_SIZE):
+        vectors = corpus_batch(batch_index, dim, seed, centres)
+        start = batch_index * BATCH_SIZE
+        yield start, vectors[:points - start]
+
+
+def make_queries(count, dim, seed):
+    centres = cluster_centres(dim, seed)
+    rng = np.random.default_rng((seed, 1 << 30))
+    assignments = rng.integers(0, CLUSTERS, count)
+    return _normalize(centres[assignments] + rng.standard_normal((count, dim)).astype(np.float32) * 0.05)
+
+
+def exact_top_k(queries, points, dim, seed, top_k):
+    """Brute-force cosine top-k over the streamed corpus, keeping a running best-k per query."""
+    best_scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+
+    for start, vectors in iter_corpus(points, dim, seed):
+        scores = queries @ vectors.T
+        ids = np.broadcast_to(np.arange(start, start + len(vectors)), scores.shape)
+        all_scores = np.concatenate([best_scores, scores], axis=1)
+        all_ids = np.concatenate([best_ids, ids], axis=1)
+        keep = np.argpartition(-all_scores, top_k - 1, axis=1)[:, :top_k]
+        best_scores = np.take_along_axis(all_scores, keep, axis=1)
+        best_ids = np.take_along_axis(all_ids, keep, axis=1)
+
+    return [set(row.tolist()) for row in best_ids]
+
+
+def parse_config(spec):
+    fields = spec.split(":")
+    name, quantization = fields[0], fields[1] if len(fields) > 1 and fields[1] else "none"
+    on_disk = len(fields) > 2 and fields[2] == "disk"
+    m = int(fields[3]) if len(fields) > 3 and fields[3] else 16
+    ef_construct = int(fields[4]) if len(fields) > 4 and fields[4] else 100
+    return {"name": name, "quantization": quantization, "on_disk": on_disk, "m": m, "ef_construct": ef_construct}
+
+
+def wait_until_indexed(client, collection_name, poll_seconds=5):
+    while True:
+        info = client.get_collection(collection_name)
+        if info.status == models.CollectionStatus.GREEN:
+            return info
+        time.sleep(poll_seconds)
+
+
+def provision(client, config, points, dim, seed, keep):
+    collection_name = f"bench-{config['name']}"
+    if keep and client.collection_exists(collection_name):
+        if client.count(collection_name, exact=True).count == points:
+            print(f"Reusing '{collection_name}'.")
+            return collection_name, 0.0
+
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    client.create_collection(
+        collection_name=collection_name,
+        **collection_params(
+            dim,
+            quantization=config["quantization"],
+            vectors_on_disk=config["on_disk"],
+            hnsw_m=config["m"],
+            hnsw_ef_construct=config["ef_construct"],
+        ),
+    )
+
+    start = time.perf_counter()
+    for batch_start, vectors in iter_corpus(points, dim, seed):
+        client.upload_collection(
+            collection_name=collection_name,
+            vectors=vectors,
+            ids=range(batch_start, batch_start + len(vectors)),
+            batch_size=1_000,
+            parallel=4,
+            wait=True,
+        )
+        print(f"  {collection_name}: {batch_start + len(vectors)}/{points} uploaded", end="\r")
+    print()
+    wait_until_indexed(client, collection_name)
+    return collection_name, time.perf_counter() - start
+
+
+def run_queries(client, collection_name, queries, truth, top_k, params):
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = client.query_points(
+            collection_name=collection_name,
+            query=query.tolist(),
+            limit=top_k,
+            search_params=params,
+            with_payload=False,
+        )
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(expected & {point.id for point in result.points}) / top_k)
+
+    return {
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:6333")
+    parser.add_argument("--points", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--config", action="append", default=None)
+    parser.add_argument("--hnsw-ef", default="64,128,256")
+    parser.add_argument("--oversampling", default="1,2,4")
+    parser.add_argument("--keep", action="store_true", help="Reuse bench collections that already hold the full corpus.")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout.")
+    args = parser.parse_args()
+
+    configs = [parse_config(spec) for spec in (args.config or ["baseline:none", "scalar:scalar", "scalar-disk:scalar:disk", "binary:binary"])]
+    ef_values = [int(value) for value in args.hnsw_ef.split(",")]
+    oversampling_values = [float(value) for value in args.oversampling.split(",")]
+
+    client = QdrantClient(url=args.url, timeout=300)
+    queries = make_queries(args.queries, args.dim, args.seed)
+
+    print(f"Computing exact top-{args.top_k} for {args.queries} queries over {args.points} points...")
+    truth = exact_top_k(queries, args.points, args.dim, args.seed, args.top_k)
+
+    report = []
+    for config in configs:
+        collection_name, ingest_seconds = provision(client, config, args.points, args.dim, args.seed, args.keep)
+        for hnsw_ef in ef_values:
+            for oversampling in (oversampling_values if config["quantization"] != "none" else [None]):
+                params = search_params(hnsw_ef=hnsw_ef, oversampling=oversampling, rescore=True, exact=False, quantization=config["quantization"])
+                row = {**config, "hnsw_ef": hnsw_ef, "oversampling": oversampling, "ingest_s": round(ingest_seconds, 1)}
+                row.update(run_queries(client, collection_name, queries, truth, args.top_k, params))
+                print(json.dumps(row))
+                report.append(row)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
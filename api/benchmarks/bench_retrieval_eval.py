@@ -0,0 +1,409 @@
+"""
+Retrieval quality and latency on a fixed corpus: recall@k, MRR, p50/p95/p99 latency and stage
+timings for `/api/retrieve`, `QdrantRetriever` and the self-query retriever.
+
+Usage:
+    python -m api.benchmarks.bench_retrieval_eval --output eval.json
+    python -m api.benchmarks.bench_retrieval_eval --baseline eval.json          # compare against an earlier run
+    python -m api.benchmarks.bench_retrieval_eval --pdf-dir papers/ --queries labels.json --url http://localhost:6333
+
+The default corpus is generated: CORPUS_PAPERS below become one PDF per paper (one section per
+page, written with PyMuPDF from a fixed seed) and every section gets labeled queries built from
+its terms. `--pdf-dir`/`--queries` evaluate your own PDFs instead; the labels file is a list of
+{"query": ..., "pdf_id": "paper.pdf", "page": 3} (`page` optional).
+
+PDFs are ingested with `process_pdfs` (real extraction and chunking) into the flat backend in a
+temporary directory, or Qdrant at --url, for a `bench-user` whose points are removed afterwards.
+The embedding model is a hashing bag-of-words embedder, so scores follow term overlap and runs
+are reproducible; the self-query retriever gets a scripted LLM that returns the query unchanged
+with no filter.
+
+A query is a hit when a result is from the labeled PDF and its pages include the labeled page.
+Stage timings are per query: `embed` (embedding calls), `search` (vector store calls), `llm`
+(query construction, self-query only) and `parse`, the rest of the call (tenancy routing,
+building results, and for `/api/retrieve` the HTTP round trip).
+
+With --baseline, recall@k or MRR below the baseline, or a p95 latency more than
+--latency-tolerance slower, is reported as a regression and the exit status is 1.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import List
+
+import fitz
+import numpy as np
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from qdrant_client.http import models
+from starlette.datastructures import UploadFile
+
+from api import qdrant_cloud_ops
+from api.benchmarks.bench_auth_db import _percentile
+from api.qdrant_cloud_ops import EMBEDDING_DIM, get_vector_store, initialize_selfquery_retriever, process_pdfs
+from api.retrieval_payload import payload_fields
+from api.services import services
+from api.storage import LocalStorage
+from api.team_tools import QdrantRetriever
+from api.tenancy import get_tenancy
+
+
+USER = {"user_id": "bench-user", "email": "bench@example.com"}
+CONVERSATION_ID = "bench-eval"
+
+# pdf_id -> sections; one section per page, each with the terms its text (and its queries) are built from
+CORPUS_PAPERS = {
+    "sparse_attention.pdf": [
+        ("Introduction", "transformer attention quadratic sequence length memory bottleneck long documents"),
+        ("Sliding window attention", "sliding window local band dilated receptive field tokens neighbours"),
+        ("Global tokens", "global tokens classification summary routing sparse pattern bigbird"),
+        ("Experiments", "perplexity arxiv pg19 character level language modeling speedup"),
+    ],
+    "retrieval_augmented_generation.pdf": [
+        ("Introduction", "parametric memory knowledge intensive hallucination grounding retrieval"),
+        ("Dense retriever", "dual encoder passage embeddings inner product maximum search index"),
+        ("Generator", "seq2seq marginalize latent documents beam decoding answer generation"),
+        ("Open domain QA", "natural questions triviaqa exact match open domain question answering"),
+    ],
+    "graph_neural_networks.pdf": [
+        ("Message passing", "message passing neighbourhood aggregation node features edges graph"),
+        ("Oversmoothing", "oversmoothing depth residual connections dirichlet energy collapse"),
+        ("Molecules", "molecular property prediction atoms bonds chemistry qm9 regression"),
+        ("Scalability", "sampling minibatch subgraph clustergcn millions nodes training"),
+    ],
+    "diffusion_models.pdf": [
+        ("Forward process", "gaussian noise schedule forward diffusion markov chain variance"),
+        ("Denoising objective", "denoising score matching epsilon prediction unet reverse process"),
+        ("Guidance", "classifier free guidance conditioning text prompts guidance scale"),
+        ("Sampling speed", "ddim sampler fewer steps distillation fast sampling fid"),
+    ],
+    "federated_learning.pdf": [
+        ("Setting", "clients devices decentralized private data server aggregation rounds"),
+        ("FedAvg", "federated averaging local epochs weighted average communication efficiency"),
+        ("Heterogeneity", "non iid data heterogeneity client drift proximal term fedprox"),
+        ("Privacy", "differential privacy secure aggregation gradient leakage clipping noise"),
+    ],
+    "reinforcement_learning_robotics.pdf": [
+        ("Policy learning", "policy gradient actor critic reward robot manipulation control"),
+        ("Sim to real", "simulation domain randomization sim2real transfer physics dynamics"),
+        ("Sample efficiency", "off policy replay buffer sample efficiency soft actor critic entropy"),
+        ("Grasping", "grasping objects camera images success rate gripper picking"),
+    ],
+    "quantization.pdf": [
+        ("Background", "quantization low precision integer weights activations inference hardware"),
+        ("Post training", "post training calibration rounding outliers per channel scales"),
+        ("Quantization aware training", "quantization aware training straight through estimator fake quant"),
+        ("Large language models", "int4 int8 llm weights only gptq perplexity throughput"),
+    ],
+    "contrastive_learning.pdf": [
+        ("Objective", "contrastive loss positive pairs negatives infonce temperature similarity"),
+        ("Augmentations", "augmentations crops color jitter views invariance simclr"),
+        ("Momentum encoder", "momentum encoder queue dictionary moco key consistency"),
+        ("Linear evaluation", "linear probe imagenet frozen representation transfer accuracy"),
+    ],
+}
+FILLER = ("we the results show that our method in this section model approach paper work and with for a of to is "
+          "are on by as using which these from can our data proposed performance significantly").split()
+QUERIES_PER_SECTION = 2
+TERMS_PER_QUERY = 4
+
+
+def build_corpus(directory: str, seed: int):
+    """Write CORPUS_PAPERS as PDFs in `directory`. Returns the labeled queries."""
+    rng = np.random.default_rng(seed)
+    # Sentences and queries borrow terms from other sections, so sections compete for each query
+    all_terms = sorted({term for sections in CORPUS_PAPERS.values() for _, terms in sections for term in terms.split()})
+    labels = []
+    for pdf_id, sections in CORPUS_PAPERS.items():
+        with fitz.open() as document:
+            for page_number, (title, terms) in enumerate(sections, start=1):
+                terms = terms.split()
+                sentences = []
+                for _ in range(12):
+                    words = list(rng.choice(terms, size=3)) + list(rng.choice(all_terms, size=2)) + list(rng.choice(FILLER, size=8))
+                    rng.shuffle(words)
+                    sentences.append(" ".join(words).capitalize() + ".")
+                page = document.new_page()
+                page.insert_text((72, 72), f"{page_number}. {title}", fontsize=16)
+                page.insert_textbox(fitz.Rect(72, 100, 540, 770), " ".join(sentences), fontsize=11)
+                for _ in range(QUERIES_PER_SECTION):
+                    words = list(rng.choice(terms, size=TERMS_PER_QUERY - 2, replace=False)) + list(rng.choice(all_terms, size=2))
+                    labels.append({"query": " ".join(words), "pdf_id": pdf_id, "page": page_number})
+            document.save(os.path.join(directory, pdf_id))
+    return labels
+
+
+class HashingEmbeddings(Embeddings):
+    """Bag-of-words vectors: each term is hashed to a dimension and a sign, counts are log-scaled, the vector is L2-normalized."""
+
+    def __init__(self, dim: int, latency_s: float = 0.0):
+        self.dim = dim
+        self.latency_s = latency_s
+
+    def _vector(self, text: str) -> list:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        counts = defaultdict(int)
+        for term in re.findall(r"\w+", text.lower()):
+            counts[term] += 1
+        for term, count in counts.items():
+            digest = hashlib.blake2b(term.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += (1.0 if digest[4] & 1 else -1.0) * (1.0 + math.log(count))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts, task_type=None):
+        with stages.measure("embed"):
+            time.sleep(self.latency_s)
+            return [self._vector(text) for text in texts]
+
+    def embed_query(self, text, task_type=None):
+        return self.embed_documents([text])[0]
+
+
+class ScriptedQueryLLM(BaseChatModel):
+    """Answers the self-query prompt with the user's query unchanged and no filter."""
+
+    limit: int = 5
+    latency_s: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-query"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        with stages.measure("llm"):
+            time.sleep(self.latency_s)
+            prompt = messages[-1].content
+            # The prompt's examples use the same layout; the user's query is the last one
+            query = re.findall(r"User Query:\s*(.*?)\s*Structured Request:", prompt, re.DOTALL)[-1]
+            answer = json.dumps({"query": query, "filter": "NO_FILTER", "limit": self.limit})
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"```json\n{answer}\n```"))])
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    def reset(self):
+        self.seconds = defaultdict(float)
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - started
+
+    def wrap(self, function, stage: str):
+        def timed(*args, **kwargs):
+            with self.measure(stage):
+                return function(*args, **kwargs)
+        return timed
+
+
+stages = StageTimer()
+
+
+def build_client(url):
+    if url:
+        from qdrant_client import QdrantClient
+        return QdrantClient(url=url)
+    from api.flat_index import FlatIndexClient
+    # The app's vector store (used by the self-query retriever) skips collection validation on the flat backend
+    qdrant_cloud_ops.VECTOR_BACKEND = os.environ["VECTOR_BACKEND"] = "flat"
+    return FlatIndexClient(tempfile.mkdtemp(prefix="bench-eval-"))
+
+
+async def ingest(directory: str, client, embeddings, partition) -> int:
+    storage = LocalStorage(tempfile.mkdtemp(prefix="bench-eval-storage-"))
+    files = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(".pdf"):
+            files.append(UploadFile(open(os.path.join(directory, name), "rb"), filename=name))
+    try:
+        result = await process_pdfs(files, client, partition.collection_name, embeddings, USER["user_id"], USER["email"],
+                                    CONVERSATION_ID, storage, ingestion_mode="pymupdf", partition=partition)
+    finally:
+        for file in files:
+            file.file.close()
+    return sum(info["total_chunks"] for info in result["uploaded_files"].values())
+
+
+def is_hit(result: dict, label: dict) -> bool:
+    if result.get("pdf_id") != os.path.basename(label["pdf_id"]).lower():
+        return False
+    if label.get("page") is None:
+        return True
+    page_start = result.get("page_start")
+    page_end = result.get("page_end") or page_start
+    return page_start is not None and page_start <= label["page"] <= page_end
+
+
+def evaluate(name: str, run, labels: List[dict], top_k: int, repeat: int) -> dict:
+    """`run(query)` returns results as dicts with pdf_id, page_start and page_end, best first."""
+    run(labels[0]["query"])  # warm-up
+    latencies, stage_seconds = [], defaultdict(list)
+    hits, doc_hits, reciprocal_ranks = 0, 0, []
+    for label in labels:
+        for attempt in range(repeat):
+            stages.reset()
+            started = time.perf_counter()
+            results = run(label["query"])[:top_k]
+            total = time.perf_counter() - started
+            latencies.append(total)
+            for stage, seconds in stages.seconds.items():
+                stage_seconds[stage].append(seconds)
+            stage_seconds["parse"].append(total - sum(stages.seconds.values()))
+        rank = next((position for position, result in enumerate(results, start=1) if is_hit(result, label)), None)
+        hits += rank is not None
+        doc_hits += any(result.get("pdf_id") == os.path.basename(label["pdf_id"]).lower() for result in results)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+
+    return {
+        "retriever": name,
+        f"recall@{top_k}": round(hits / len(labels), 4),
+        f"doc_recall@{top_k}": round(doc_hits / len(labels), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "latency_ms": {f"p{q}": round(_percentile(latencies, q) * 1000, 3) for q in (50, 95, 99)},
+        "stage_ms_p50": {stage: round(_percentile(values, 50) * 1000, 3) for stage, values in sorted(stage_seconds.items())},
+    }
+
+
+def compare(report: dict, baseline: dict, latency_tolerance: float) -> List[str]:
+    regressions = []
+    before = {result["retriever"]: result for result in baseline.get("retrievers", [])}
+    for result in report["retrievers"]:
+        old = before.get(result["retriever"])
+        if old is None or "skipped" in old or "skipped" in result:
+            continue
+        for metric in (f"recall@{report['top_k']}", "mrr"):
+            if metric in old and result[metric] < old[metric]:
+                regressions.append(f"{result['retriever']}: {metric} {old[metric]} -> {result[metric]}")
+        old_p95, new_p95 = old["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        if new_p95 > old_p95 * (1 + latency_tolerance):
+            regressions.append(f"{result['retriever']}: p95 {old_p95}ms -> {new_p95}ms")
+        result["vs_baseline"] = {
+            key: round(result[key] - old[key], 4) for key in (f"recall@{report['top_k']}", "mrr") if key in old
+        }
+        result["vs_baseline"]["p95_ms"] = round(new_p95 - old_p95, 3)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Qdrant URL; the flat backend in a temporary directory if omitted.")
+    parser.add_argument("--pdf-dir", default=None, help="PDFs to ingest instead of the generated corpus (needs --queries).")
+    parser.add_argument("--queries", default=None, help="JSON list of labeled queries for --pdf-dir.")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query.")
+    parser.add_argument("--embed-ms", type=float, default=0, help="Simulated latency of one embedding call.")
+    parser.add_argument("--llm-ms", type=float, default=0, help="Simulated latency of the self-query LLM call.")
+    parser.add_argument("--text", default="full", choices=["full", "snippet", "none"], help="Text mode of /api/retrieve.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file.")
+    parser.add_argument("--baseline", default=None, help="A report from an earlier run to compare against.")
+    parser.add_argument("--latency-tolerance", type=float, default=0.2, help="Allowed p95 slowdown against the baseline (0.2 = 20%%).")
+    args = parser.parse_args()
+    if bool(args.pdf_dir) != bool(args.queries):
+        parser.error("--pdf-dir and --queries go together.")
+
+    if args.pdf_dir:
+        pdf_dir = args.pdf_dir
+        with open(args.queries) as f:
+            labels = json.load(f)
+    else:
+        pdf_dir = tempfile.mkdtemp(prefix="bench-eval-corpus-")
+        labels = build_corpus(pdf_dir, args.seed)
+
+    client = build_client(args.url)
+    embeddings = HashingEmbeddings(EMBEDDING_DIM, args.embed_ms / 1000)
+    services.register("qdrant", lambda: client)
+    services.register("embedding_model", lambda: embeddings)
+    partition = get_tenancy().route(USER["user_id"], USER["email"])
+    chunks = asyncio.run(ingest(pdf_dir, client, embeddings, partition))
+    client.query_points = stages.wrap(client.query_points, "search")
+
+    from api.index import app, get_authenticated_user
+    app.dependency_overrides[get_authenticated_user] = lambda: USER
+    http = TestClient(app)
+
+    def run_endpoint(query):
+        response = http.post("/api/retrieve", json={"query": query, "top_k": args.top_k, "text": args.text})
+        response.raise_for_status()
+        return response.json()["points"]
+
+    retriever = QdrantRetriever(client_=client, collection_name_=partition.collection_name, embedding_model_=embeddings,
+                                limit_=args.top_k, with_payload_=payload_fields())
+    config = {"configurable": {"user_id": USER["user_id"], "email": USER["email"]}}
+
+    def run_retriever(query):
+        return [document.metadata for document in retriever.invoke(query, config=config)]
+
+    def run_self_query(query):
+        results = []
+        for document in self_query.invoke(query):
+            page_start, _, page_end = (document["pages"] or "").partition("-")
+            results.append({"pdf_id": document["pdf_id"], "page_start": int(page_start) if page_start else None,
+                            "page_end": int(page_end) if page_end else None})
+        return results
+
+    retrievers = [
+        evaluate("/api/retrieve", run_endpoint, labels, args.top_k, args.repeat),
+        evaluate("QdrantRetriever", run_retriever, labels, args.top_k, args.repeat),
+    ]
+    # The self-query retriever searches the app's vector store, which has no tenant filter.
+    # Its query parser needs `lark`, which requirements.txt does not pin.
+    try:
+        self_query = initialize_selfquery_retriever(ScriptedQueryLLM(limit=args.top_k, latency_s=args.llm_ms / 1000), get_vector_store())
+        retrievers.append(evaluate("self_query", run_self_query, labels, args.top_k, args.repeat))
+    except ImportError as e:
+        retrievers.append({"retriever": "self_query", "skipped": str(e)})
+
+    report = {
+        "corpus": pdf_dir if args.pdf_dir else "generated",
+        "backend": "qdrant" if args.url else "flat",
+        "documents": len([name for name in os.listdir(pdf_dir) if name.lower().endswith(".pdf")]),
+        "chunks": chunks,
+        "queries": len(labels),
+        "top_k": args.top_k,
+        "repeat": args.repeat,
+        "embed_ms": args.embed_ms,
+        "llm_ms": args.llm_ms,
+        "retrievers": retrievers,
+    }
+
+    # Only the benchmark user's points; the collection is the app's
+    client.delete(
+        collection_name=partition.collection_name,
+        points_selector=models.FilterSelector(filter=partition.filter()),
+        shard_key_selector=partition.shard_key,
+    )
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.latency_tolerance)
+        report["regressions"] = regressions
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
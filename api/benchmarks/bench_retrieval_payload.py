@@ -0,0 +1,133 @@
+"""
+Bytes and encode time of `/api/retrieve` results: full payloads vs. projected fields, snippets
+and compact encodings.
+
+Usage:
+    python -m api.benchmarks.bench_retrieval_payload --points 2000 --queries 200 --top-k 10
+    python -m api.benchmarks.bench_retrieval_payload --url http://localhost:6333   # real Qdrant
+
+The corpus is chunk points shaped like `build_chunk_points` output (2,100-character texts and
+the full ingestion metadata) in a `bench-payload` collection, the flat backend by default.
+Per query, the report gives:
+
+- payload bytes returned by the vector store with `with_payload=True` (before) and with
+  `payload_fields()` for each text mode;
+- the size and encode time of the response body with FastAPI's JSON encoding, orjson and
+  MessagePack.
+"""
+import argparse
+import json
+import tempfile
+import time
+import uuid
+
+import msgpack
+import numpy as np
+import orjson
+from qdrant_client.http import models
+
+from api.benchmarks.bench_auth_db import _percentile
+from api.retrieval_payload import TEXT_MODES, payload_fields, point_to_result
+
+
+COLLECTION = "bench-payload"
+WORDS = "retrieval augmented generation transformer attention embedding corpus benchmark latency dataset model training evaluation".split()
+
+
+def chunk_payload(rng, index) -> dict:
+    text = " ".join(rng.choice(WORDS, size=300))[:2100]
+    return {
+        "metadata": {
+            "pdf_id": f"paper_{index // 40}.pdf",
+            "associated_user": "bench-user",
+            "associated_user_email": "bench@example.com",
+            "associated_conversation_id": str(uuid.UUID(int=index // 200)),
+            "tenant_id": "bench-user",
+            "content_hash": f"{index:064x}",
+            "ingestion_mode": "pymupdf",
+            "embedding_model": "models/text-embedding-004",
+            "chunker_version": "structured-v1",
+            "chunk_index": index % 40,
+            "page_start": index % 40 // 3 + 1,
+            "page_end": index % 40 // 3 + 1,
+            "section": "3.2 Retrieval-augmented generation",
+            "chunk_type": "paragraph",
+            "weight": 1.0,
+        },
+        "text": text,
+    }
+
+
+def build_client(url):
+    if url:
+        from qdrant_client import QdrantClient
+        return QdrantClient(url=url)
+    from api.flat_index import FlatIndexClient
+    return FlatIndexClient(tempfile.mkdtemp(prefix="bench-payload-"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Qdrant URL; the flat backend in a temporary directory if omitted.")
+    parser.add_argument("--points", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    client = build_client(args.url)
+    if client.collection_exists(COLLECTION):
+        client.delete_collection(COLLECTION)
+    client.create_collection(COLLECTION, vectors_config=models.VectorParams(size=args.dim, distance=models.Distance.COSINE))
+    vectors = rng.standard_normal((args.points, args.dim)).astype(np.float32)
+    for start in range(0, args.points, 500):
+        client.upsert(COLLECTION, points=[
+            models.PointStruct(id=str(uuid.UUID(int=i + 1)), vector=vectors[i].tolist(), payload=chunk_payload(rng, i))
+            for i in range(start, min(start + 500, args.points))
+        ])
+
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    query_text = "how does retrieval augmented generation affect latency"
+    selectors = {"with_payload=True": True, **{f"fields/{mode}": payload_fields(mode) for mode in TEXT_MODES}}
+    report = {"points": args.points, "queries": args.queries, "top_k": args.top_k, "payload_bytes_per_query": {}, "responses": []}
+
+    for name, with_payload in selectors.items():
+        sizes = []
+        for query in queries:
+            points = client.query_points(COLLECTION, query=query.tolist(), limit=args.top_k, with_payload=with_payload).points
+            sizes.append(sum(len(json.dumps(point.payload)) for point in points))
+        report["payload_bytes_per_query"][name] = int(np.mean(sizes))
+
+    points = client.query_points(COLLECTION, query=queries[0].tolist(), limit=args.top_k, with_payload=True).points
+    before = {"points": [
+        {"id": p.id, "score": p.score, "pdf_id": p.payload.get("pdf_id", "N/A"), "text": p.payload.get("text", "N/A")} for p in points
+    ]}
+    bodies = {"before": before, **{mode: {"points": [point_to_result(p, query_text, mode) for p in points]} for mode in TEXT_MODES}}
+    encoders = {
+        # What JSONResponse does
+        "json": lambda content: json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode(),
+        "orjson": orjson.dumps,
+        "msgpack": lambda content: msgpack.packb(content, use_bin_type=True),
+    }
+    for body_name, body in bodies.items():
+        for encoder_name, encode in encoders.items():
+            timings = []
+            for _ in range(200):
+                started = time.perf_counter()
+                encoded = encode(body)
+                timings.append(time.perf_counter() - started)
+            report["responses"].append({
+                "text": body_name,
+                "encoding": encoder_name,
+                "bytes": len(encoded),
+                "p50_encode_us": round(_percentile(timings, 50) * 1e6, 1),
+            })
+
+    client.delete_collection(COLLECTION)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Throughput of `/api/retrieve/batch` against the same queries sent one by one to `/api/retrieve`.
+
+Usage:
+    python -m api.benchmarks.bench_retrieve_batch --points 20000 --queries 64 --batch-size 8 --batch-size 64 --embed-ms 80
+    python -m api.benchmarks.bench_retrieve_batch --url http://localhost:6333   # real Qdrant
+
+The app runs in-process behind TestClient with authentication overridden. The "qdrant" and
+"embedding_model" services are replaced through the service registry: the vector store is the
+flat backend in a temporary directory (or Qdrant at --url, where --points points are added to
+the app's collection for a `bench-user` and removed afterwards), and the embedding model returns
+deterministic vectors after sleeping --embed-ms per call, like a round trip to the embedding
+API. Both endpoints must return the same points for every query.
+"""
+import argparse
+import hashlib
+import json
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import Embeddings
+from qdrant_client.http import models
+
+from api.qdrant_cloud_ops import EMBEDDING_DIM
+from api.services import services
+from api.tenancy import get_tenancy
+
+
+USER = {"user_id": "bench-user", "email": "bench@example.com"}
+
+
+class SimulatedEmbeddings(Embeddings):
+    def __init__(self, dim: int, latency_s: float):
+        self.dim = dim
+        self.latency_s = latency_s
+        self.calls = 0
+
+    def _vector(self, text: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist()
+
+    def embed_documents(self, texts, task_type=None):
+        self.calls += 1
+        time.sleep(self.latency_s)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text, task_type=None):
+        return self.embed_documents([text])[0]
+
+
+def build_store(url, points, dim, seed):
+    if url:
+        from qdrant_client import QdrantClient
+        client = QdrantClient(url=url)
+    else:
+        from api.flat_index import FlatIndexClient
+        client = FlatIndexClient(tempfile.mkdtemp(prefix="bench-batch-"))
+    services.register("qdrant", lambda: client)
+
+    # The tenancy strategy creates the app's collection (and its payload indexes) if needed
+    partition = get_tenancy().route(USER["user_id"], USER["email"])
+    rng = np.random.default_rng(seed)
+    for start in range(0, points, 1000):
+        count = min(1000, points - start)
+        client.upsert(partition.collection_name, points=[
+            models.PointStruct(
+                id=str(uuid.UUID(int=start + i + 1)),
+                vector=rng.standard_normal(dim).astype(np.float32).tolist(),
+                payload={
+                    "metadata": {"pdf_id": f"paper_{(start + i) // 40}.pdf", "associated_user": USER["user_id"], "tenant_id": USER["user_id"],
+                                 "associated_conversation_id": f"conv-{(start + i) % 4}", "chunk_index": (start + i) % 40},
+                    "text": f"chunk {start + i}",
+                },
+            )
+            for i in range(count)
+        ], shard_key_selector=partition.shard_key)
+    return client, partition
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Qdrant URL; the flat backend in a temporary directory if omitted.")
+    parser.add_argument("--points", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, action="append", default=None)
+    parser.add_argument("--embed-ms", type=float, default=80, help="Simulated latency of one embedding API call.")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    batch_sizes = args.batch_size or [8, 64]
+
+    client, partition = build_store(args.url, args.points, EMBEDDING_DIM, args.seed)
+    embeddings = SimulatedEmbeddings(EMBEDDING_DIM, args.embed_ms / 1000)
+    services.register("embedding_model", lambda: embeddings)
+
+    from api.index import app, get_authenticated_user
+    app.dependency_overrides[get_authenticated_user] = lambda: USER
+    http = TestClient(app)
+
+    queries = [
+        {"query": f"benchmark query {i}", "top_k": args.top_k, "text": "none", **({"conversation_id": f"conv-{i % 4}"} if i % 2 else {})}
+        for i in range(args.queries)
+    ]
+    report = {"points": args.points, "queries": args.queries, "embed_ms": args.embed_ms, "modes": []}
+
+    embeddings.calls = 0
+    started = time.perf_counter()
+    single = [http.post("/api/retrieve", json=query).json()["points"] for query in queries]
+    seconds = time.perf_counter() - started
+    report["modes"].append({"mode": "single", "requests": len(queries), "embedding_calls": embeddings.calls,
+                            "seconds": round(seconds, 3), "queries_per_s": round(len(queries) / seconds, 1)})
+
+    for batch_size in batch_sizes:
+        embeddings.calls = 0
+        started = time.perf_counter()
+        batched = []
+        for start in range(0, len(queries), batch_size):
+            response = http.post("/api/retrieve/batch", json={"queries": queries[start:start + batch_size]})
+            batched.extend(result["points"] for result in response.json()["results"])
+        seconds = time.perf_counter() - started
+        same = all([p["id"] for p in a] == [p["id"] for p in b] for a, b in zip(single, batched))
+        report["modes"].append({"mode": f"batch-{batch_size}", "requests": -(-len(queries) // batch_size), "embedding_calls": embeddings.calls,
+                                "seconds": round(seconds, 3), "queries_per_s": round(len(queries) / seconds, 1), "same_results": same})
+
+    # Only the benchmark user's points; the collection is the app's
+    client.delete(
+        collection_name=partition.collection_name,
+        points_selector=models.FilterSelector(filter=partition.filter()),
+        shard_key_selector=partition.shard_key,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
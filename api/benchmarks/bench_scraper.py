@@ -0,0 +1,128 @@
+"""
+Web scraping: the previous WebBaseLoader path vs. api/web_scraper.py, against the local stub in
+api/extras/web_stub.py (started in-process, no network needed).
+
+Usage:
+    python -m api.benchmarks.bench_scraper --pages 8 --delay-ms 200 --runs 3
+
+Modes:
+    webbaseloader  the previous `WebBaseLoader(urls).load()`, one blocking request after another
+    cold           WebScraper with an empty cache
+    fresh          the same URLs again within SCRAPER_CACHE_FRESH_SECONDS; served from disk
+    revalidate     the same URLs with freshness 0; every page comes back as 304 Not Modified
+
+The report gives latency, the size of the tool output in tokens, requests that reached the stub,
+and checks for the size limit, non-text content, redirects and boilerplate removal.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from api.benchmarks.bench_auth_db import _percentile
+from api.extras import web_stub
+from api.token_counter import str_token_counter
+from api.web_scraper import PageCache, WebScraper, format_pages
+
+
+def start_stub(delay_ms: float) -> str:
+    web_stub.DELAY_MS = delay_ms
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(web_stub.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{base_url}/stats")
+            return base_url
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError("The web stub did not start.")
+
+
+def webbaseloader(urls) -> str:
+    from langchain_community.document_loaders import WebBaseLoader
+
+    docs = WebBaseLoader(urls).load()
+    return "\n\n".join(f'<Document name="{doc.metadata.get("title", "")}">\n{doc.page_content}\n</Document>' for doc in docs)
+
+
+async def scrape(urls, cache_dir, fresh_seconds) -> str:
+    scraper = WebScraper(cache=PageCache(cache_dir), fresh_seconds=fresh_seconds)
+    try:
+        return format_pages(await scraper.scrape(urls))
+    finally:
+        await scraper.aclose()
+
+
+async def measure(run, runs) -> dict:
+    seconds, output, requests = [], "", 0
+    for _ in range(runs):
+        web_stub.stats.clear()
+        started = time.perf_counter()
+        output = await run()
+        seconds.append(time.perf_counter() - started)
+        requests = web_stub.stats["requests"]
+    return {
+        "p50_s": round(_percentile(seconds, 50), 3),
+        "max_s": round(max(seconds), 3),
+        "output_tokens": str_token_counter(output),
+        "stub_requests": requests,
+        "not_modified": web_stub.stats["not_modified"],
+    }
+
+
+async def checks(base_url, cache_dir) -> dict:
+    scraper = WebScraper(cache=PageCache(cache_dir), max_bytes=512 * 1024, fresh_seconds=0)
+    try:
+        large, binary, redirected, page = await scraper.scrape([f"{base_url}/large", f"{base_url}/binary", f"{base_url}/redirect/1", f"{base_url}/page/2"], max_tokens=40_000)
+    finally:
+        await scraper.aclose()
+    return {
+        "large_truncated_at_max_bytes": large.truncated,
+        "binary_rejected": bool(binary.error and "content type" in binary.error),
+        "redirect_followed": redirected.title == "Stub article 1",
+        "boilerplate_removed": "Related link" not in page.text and "tracking" not in page.text and "Paragraph 8" in page.text,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--delay-ms", type=float, default=200, help="Latency of every stub response.")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    base_url = start_stub(args.delay_ms)
+    urls = [f"{base_url}/page/{n}" for n in range(args.pages)]
+    report = {"pages": args.pages, "delay_ms": args.delay_ms, "modes": {}}
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        report["modes"]["webbaseloader"] = await measure(lambda: asyncio.to_thread(webbaseloader, urls), args.runs)
+
+        async def cold():
+            for path in glob.glob(os.path.join(cache_dir, "*.json")):
+                os.remove(path)
+            return await scrape(urls, cache_dir, fresh_seconds=300)
+
+        report["modes"]["cold"] = await measure(cold, args.runs)
+        report["modes"]["fresh"] = await measure(lambda: scrape(urls, cache_dir, fresh_seconds=300), args.runs)
+        report["modes"]["revalidate"] = await measure(lambda: scrape(urls, cache_dir, fresh_seconds=0), args.runs)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        report["checks"] = await checks(base_url, cache_dir)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+"""
+Worker startup cost: how long `import api.index` takes and which imports dominate it, plus how
+long the FastAPI lifespan takes until the app accepts requests.
+
+Usage:
+    python -m api.benchmarks.bench_startup --runs 5 --top 15
+    python -m api.benchmarks.bench_startup --module api.garbage_collector --no-lifespan
+
+Every run is a fresh interpreter (`python -X importtime`), so the numbers include what a new
+uvicorn/gunicorn worker pays. Run it with the same environment as the server (.env is loaded by
+the app itself). The lifespan step needs the database and Redis to be reachable; Qdrant and the
+LLM clients are only built in the background and are not waited for.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from api.benchmarks.bench_auth_db import _percentile
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LIFESPAN_SNIPPET = """
+import asyncio, json, time
+started = time.perf_counter()
+import {module} as target
+imported = time.perf_counter()
+
+async def run():
+    async with target.app.router.lifespan_context(target.app):
+        ready = time.perf_counter()
+    return ready
+
+ready = asyncio.run(run())
+print("__STARTUP__" + json.dumps({{"import_s": imported - started, "ready_s": ready - started}}))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """{module: cumulative microseconds} from `-X importtime` output."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative_us, module = line.split("|", 2)
+        name = module.strip()
+        cumulative[name] = max(cumulative.get(name, 0), int(cumulative_us))
+    return cumulative
+
+
+def measure_import(module: str) -> dict:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return {"wall_s": wall, "modules": parse_importtime(result.stderr)}
+
+
+def measure_lifespan(module: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", LIFESPAN_SNIPPET.format(module=module)],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("__STARTUP__"):
+            return json.loads(line[len("__STARTUP__"):])
+    raise RuntimeError(f"lifespan of {module} failed:\n{result.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="api.index")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest top-level imports to report (cumulative time).")
+    parser.add_argument("--no-lifespan", action="store_true", help="Only measure the import.")
+    args = parser.parse_args()
+
+    walls, totals, per_module = [], [], {}
+    for _ in range(args.runs):
+        run = measure_import(args.module)
+        walls.append(run["wall_s"])
+        totals.append(run["modules"].get(args.module, 0) / 1e6)
+        for name, us in run["modules"].items():
+            per_module.setdefault(name, []).append(us / 1e6)
+
+    # Report modules by median cumulative time, skipping the target itself and submodules of a listed package
+    ranked = sorted(per_module.items(), key=lambda item: -_percentile(item[1], 50))
+    top = []
+    for name, samples in ranked:
+        if name == args.module or any(name.startswith(parent + ".") for parent, _ in top):
+            continue
+        top.append((name, samples))
+        if len(top) == args.top:
+            break
+
+    report = {
+        "module": args.module,
+        "runs": args.runs,
+        "process_wall_p50_s": round(_percentile(walls, 50), 3),
+        "import_p50_s": round(_percentile(totals, 50), 3),
+        "import_max_s": round(max(totals), 3),
+        "top_imports": [{"module": name, "p50_s": round(_percentile(samples, 50), 3)} for name, samples in top],
+    }
+
+    if not args.no_lifespan:
+        startups = [measure_lifespan(args.module) for _ in range(args.runs)]
+        report["lifespan_ready_p50_s"] = round(_percentile([s["ready_s"] for s in startups], 50), 3)
+        report["lifespan_only_p50_s"] = round(_percentile([s["ready_s"] - s["import_s"] for s in startups], 50), 3)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
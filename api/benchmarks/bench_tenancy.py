@@ -0,0 +1,178 @@
+"""
+Compare the tenancy strategies in api/tenancy.py on a synthetic multi-tenant corpus.
+
+Usage:
+    docker run -p 6333:6333 qdrant/qdrant
+    QDRANT_URL=http://localhost:6333 python -m api.benchmarks.bench_tenancy \
+        --tenants 50 --users-per-tenant 4 --points 100000 --queries 500 \
+        --strategy payload --strategy payload-m0 --strategy shard_key --strategy collection
+
+Tenant sizes follow a Zipf-like distribution, so a few large organizations hold most of the
+points, as on a shared deployment. Every strategy gets its own `bench-tenancy-<strategy>`
+collection(s) and the same corpus. Queries are drawn per user and scored against the exact
+top-k within that user's vectors; latency is reported overall and for the largest and
+smallest tenants separately. `payload-m0` is the payload strategy with TENANCY_PER_TENANT_HNSW.
+
+The strategies build collections with the app's EMBEDDING_DIM and QDRANT_* settings.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from api import tenancy
+from api.qdrant_cloud_ops import EMBEDDING_DIM, URL, QDRANT_API_KEY
+from api.benchmarks.bench_qdrant_tuning import _percentile, _normalize, wait_until_indexed
+
+
+UPSERT_BATCH = 1_000
+
+
+def build_corpus(tenants, users_per_tenant, points, seed):
+    """Return [(tenant, user_id, email, vectors)] with tenant sizes ~ 1/rank."""
+    rng = np.random.default_rng(seed)
+    shares = 1 / np.arange(1, tenants + 1)
+    sizes = np.maximum(users_per_tenant, (shares / shares.sum() * points).astype(int))
+
+    corpus = []
+    for tenant_index, tenant_points in enumerate(sizes):
+        tenant = f"lab{tenant_index}.example.edu"
+        centre = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+        for user_index in range(users_per_tenant):
+            user_centre = centre + rng.standard_normal(EMBEDDING_DIM).astype(np.float32) * 0.5
+            count = int(tenant_points // users_per_tenant)
+            vectors = _normalize(user_centre + rng.standard_normal((count, EMBEDDING_DIM)).astype(np.float32) * 0.3)
+            corpus.append((tenant, f"{tenant_index}-{user_index}", f"user{user_index}@{tenant}", vectors))
+    return corpus
+
+
+def make_strategy(name, client):
+    base_collection = f"bench-tenancy-{name}"
+    if name == "payload":
+        return tenancy.PayloadTenancy(client, base_collection)
+    if name == "payload-m0":
+        tenancy.TENANCY_PER_TENANT_HNSW = True
+        try:
+            strategy = tenancy.PayloadTenancy(client, base_collection)
+            strategy.prepare()
+        finally:
+            tenancy.TENANCY_PER_TENANT_HNSW = False
+        return strategy
+    if name == "shard_key":
+        return tenancy.ShardKeyTenancy(client, base_collection, collection_name=base_collection)
+    if name == "collection":
+        return tenancy.CollectionTenancy(client, base_collection, dedicated_tenants={"*"})
+    raise ValueError(f"Unknown strategy '{name}'.")
+
+
+def drop_bench_collections(client, name):
+    prefix = f"bench-tenancy-{name}"
+    for collection in client.get_collections().collections:
+        if collection.name == prefix or collection.name.startswith(f"{prefix}--"):
+            client.delete_collection(collection.name)
+
+
+def ingest(strategy, corpus):
+    start = time.perf_counter()
+    collections = set()
+    next_id = 0
+    for tenant, user_id, email, vectors in corpus:
+        partition = strategy.route(user_id, email)
+        collections.add(partition.collection_name)
+        for batch_start in range(0, len(vectors), UPSERT_BATCH):
+            batch = vectors[batch_start:batch_start + UPSERT_BATCH]
+            strategy.client.upsert(
+                collection_name=partition.collection_name,
+                points=models.Batch(
+                    ids=list(range(next_id, next_id + len(batch))),
+                    vectors=batch.tolist(),
+                    payloads=[{"metadata": {"associated_user": user_id, "tenant_id": partition.tenant_id}}] * len(batch),
+                ),
+                shard_key_selector=partition.shard_key,
+            )
+            next_id += len(batch)
+    for collection_name in collections:
+        wait_until_indexed(strategy.client, collection_name)
+    return time.perf_counter() - start, len(collections)
+
+
+def run_queries(strategy, corpus, queries, top_k, seed):
+    rng = np.random.default_rng((seed, 1))
+    weights = np.array([len(vectors) for *_, vectors in corpus], dtype=float)
+    picks = rng.choice(len(corpus), size=queries, p=weights / weights.sum())
+
+    tenant_sizes = {}
+    for tenant, *_, vectors in corpus:
+        tenant_sizes[tenant] = tenant_sizes.get(tenant, 0) + len(vectors)
+    ranked = sorted(tenant_sizes, key=tenant_sizes.get, reverse=True)
+    large, small = set(ranked[:max(1, len(ranked) // 10)]), set(ranked[-max(1, len(ranked) // 2):])
+
+    latencies = {"all": [], "large_tenants": [], "small_tenants": []}
+    recalls = []
+    for pick in picks:
+        tenant, user_id, email, vectors = corpus[pick]
+        query = _normalize(vectors[rng.integers(len(vectors))][None, :] + rng.standard_normal((1, EMBEDDING_DIM)).astype(np.float32) * 0.1)[0]
+        partition = strategy.route(user_id, email)
+
+        start = time.perf_counter()
+        result = strategy.client.query_points(**partition.query_kwargs(), query=query.tolist(), limit=top_k, with_payload=False)
+        elapsed = time.perf_counter() - start
+
+        latencies["all"].append(elapsed)
+        if tenant in large:
+            latencies["large_tenants"].append(elapsed)
+        if tenant in small:
+            latencies["small_tenants"].append(elapsed)
+
+        exact = set(np.argsort(-(vectors @ query))[:top_k].tolist())
+        found = {int(point.id) for point in result.points}
+        offset = sum(len(v) for *_, v in corpus[:pick])
+        recalls.append(len(exact & {point_id - offset for point_id in found}) / min(top_k, len(vectors)))
+
+    report = {"recall_at_k": round(float(np.mean(recalls)), 4)}
+    for bucket, samples in latencies.items():
+        report[f"{bucket}_p50_ms"] = round(_percentile(samples, 50) * 1000, 2)
+        report[f"{bucket}_p99_ms"] = round(_percentile(samples, 99) * 1000, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=URL or "http://localhost:6333")
+    parser.add_argument("--tenants", type=int, default=50)
+    parser.add_argument("--users-per-tenant", type=int, default=4)
+    parser.add_argument("--points", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--strategy", action="append", default=None, choices=["payload", "payload-m0", "shard_key", "collection"])
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout.")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=args.url, api_key=QDRANT_API_KEY, timeout=300)
+    corpus = build_corpus(args.tenants, args.users_per_tenant, args.points, args.seed)
+    print(f"{sum(len(v) for *_, v in corpus)} points across {args.tenants} tenants / {len(corpus)} users.")
+
+    report = []
+    for name in args.strategy or ["payload", "payload-m0", "shard_key", "collection"]:
+        drop_bench_collections(client, name)
+        strategy = make_strategy(name, client)
+        strategy.prepare()
+        ingest_seconds, collections = ingest(strategy, corpus)
+        row = {"strategy": name, "collections": collections, "ingest_s": round(ingest_seconds, 1)}
+        row.update(run_queries(strategy, corpus, args.queries, args.top_k, args.seed))
+        print(json.dumps(row))
+        report.append(row)
+        drop_bench_collections(client, name)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
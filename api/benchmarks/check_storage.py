@@ -0,0 +1,293 @@
+"""
+Functional check of the S3 storage backend (api/storage.py) against the in-memory S3 stand-in
+(api/extras/s3_stub.py), or against a real S3-compatible store.
+
+Usage:
+    python -m api.benchmarks.check_storage
+    python -m api.benchmarks.check_storage --endpoint-url http://localhost:9000 --bucket aireas-check   # MinIO
+
+Needs boto3 (in requirements.txt). Without --endpoint-url the stand-in is served by uvicorn in-process with dummy
+credentials. Everything is written under a unique prefix in the bucket and removed at the end;
+the read-through cache lives in a temporary directory.
+
+Checks, in order:
+    put_file       small objects (PutObject) and one above the multipart threshold (multipart upload)
+    list           files under a conversation, across several listing pages, and list_dirs
+    read_through   a cold read downloads (ranged GETs for the large object), a warm one does not
+    range_reads    pdf_response serves Range requests (206) and conditional GETs (304) from the cache
+    eviction       the LRU drops the least recently used objects past its budget, reads bring them back
+    pinning        entries held by open_local() or a response still being sent survive eviction and deletes
+    delete         delete() and delete_prefix() report the bytes freed and remove the objects and cache files
+
+Prints a JSON report and exits 1 if any check fails.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from api.storage import LocalReadThroughCache, S3Storage
+
+
+def start_stub():
+    from api.extras import s3_stub
+
+    # Small pages so listings have to follow continuation tokens
+    s3_stub.PAGE_SIZE = 2
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(s3_stub.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            httpx.get(f"{url}/_stats")
+            return server, url
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError("The S3 stand-in did not start.")
+
+
+def payload(size: int, seed: int) -> bytes:
+    block = f"%PDF-1.4 object {seed} ".encode()
+    return (block * (size // len(block) + 1))[:size]
+
+
+class Check:
+    def __init__(self, storage: S3Storage, cache_dir: str, stub_url):
+        self.storage = storage
+        self.cache_dir = cache_dir
+        self.stub_url = stub_url
+        self.prefix = f"check-{uuid.uuid4().hex[:8]}"
+        self.conversation = f"{self.prefix}/conversation"
+        self.files = {}
+
+    def key(self, name: str) -> str:
+        return f"{self.conversation}/{name}"
+
+    def requests(self) -> dict:
+        """Requests the stand-in has seen so far (empty against a real store)."""
+        return httpx.get(f"{self.stub_url}/_stats").json() if self.stub_url else {}
+
+    def requests_since(self, before: dict, operation: str):
+        if not self.stub_url:
+            return None
+        return self.requests().get(operation, 0) - before.get(operation, 0)
+
+    def reset_cache(self, max_bytes: int):
+        self.storage.cache = LocalReadThroughCache(tempfile.mkdtemp(dir=self.cache_dir), max_bytes)
+
+    async def put(self, name: str, body: bytes) -> str:
+        staged = self.storage.staging_path(self.key(name))
+        with open(staged, "wb") as f:
+            f.write(body)
+        self.files[name] = body
+        return await self.storage.put_file(self.key(name), staged)
+
+    async def check_put_file(self, large_size: int):
+        before = self.requests()
+        for i in range(5):
+            path = await self.put(f"paper_{i}.pdf", payload(4096 + i, i))
+            assert open(path, "rb").read() == self.files[f"paper_{i}.pdf"], "put_file did not return the uploaded bytes"
+        await self.put("large.pdf", payload(large_size, 99))
+        assert await self.storage.exists(self.key("large.pdf"))
+        assert not await self.storage.exists(self.key("missing.pdf"))
+        multipart = self.requests_since(before, "upload_part")
+        if multipart is not None:
+            assert self.requests_since(before, "put_object") == 5, "small files should be single PutObject calls"
+            assert multipart >= 2, "the large file should be a multipart upload"
+        return {"objects": len(self.files), "multipart_parts": multipart}
+
+    async def check_list(self):
+        before = self.requests()
+        listed = await self.storage.list(self.conversation)
+        assert set(listed) == set(self.files), f"list returned {sorted(listed)}"
+        assert all(listed[name]["size_bytes"] == len(body) for name, body in self.files.items())
+        dirs = await self.storage.list_dirs(self.prefix)
+        assert dirs == ["conversation"], f"list_dirs returned {dirs}"
+        return {"files": len(listed), "list_requests": self.requests_since(before, "list_objects")}
+
+    async def check_read_through(self):
+        self.reset_cache(1 << 30)
+        before = self.requests()
+        for name, body in self.files.items():
+            path = await self.storage.local_path(self.key(name))
+            assert open(path, "rb").read() == body, f"cold read of {name} returned other bytes"
+        cold = self.requests_since(before, "get_object")
+        ranged = self.requests_since(before, "get_object_range")
+
+        before = self.requests()
+        for name in self.files:
+            await self.storage.local_path(self.key(name))
+        warm = self.requests_since(before, "get_object")
+        if warm is not None:
+            assert warm == 0, "warm reads should be served from the cache"
+            assert ranged >= 2, "the large object should be downloaded in ranges"
+        return {"cold_gets": cold, "ranged_gets": ranged, "warm_gets": warm}
+
+    async def check_range_reads(self):
+        app = FastAPI()
+
+        @app.get("/pdf/{name}")
+        async def view(name: str, request: Request):
+            return await self.storage.pdf_response(request, self.key(name), name)
+
+        body = self.files["large.pdf"]
+        with TestClient(app) as client:
+            partial = client.get("/pdf/large.pdf", headers={"Range": "bytes=100-1123"})
+            assert partial.status_code == 206, partial.status_code
+            assert partial.content == body[100:1124], "the range returned other bytes"
+            assert partial.headers["content-range"] == f"bytes 100-1123/{len(body)}"
+
+            full = client.get("/pdf/large.pdf")
+            assert full.status_code == 200 and full.content == body
+            not_modified = client.get("/pdf/large.pdf", headers={"If-None-Match": full.headers["etag"]})
+            assert not_modified.status_code == 304, not_modified.status_code
+        # Every response released its pin
+        assert not self.storage.cache._pins, f"pins left behind: {self.storage.cache._pins}"
+        return {"partial": partial.status_code, "conditional": not_modified.status_code}
+
+    async def check_eviction(self):
+        sizes = {name: len(self.files[name]) for name in ("paper_0.pdf", "paper_1.pdf", "paper_2.pdf")}
+        # Room for two of the three
+        self.reset_cache(sizes["paper_1.pdf"] + sizes["paper_2.pdf"])
+        cache = self.storage.cache
+        for name in sizes:
+            await self.storage.local_path(self.key(name))
+        assert cache.get(self.key("paper_0.pdf")) is None, "the least recently used entry should be evicted"
+        assert not os.path.exists(cache._path(self.key("paper_0.pdf"))), "evicted entries should be unlinked"
+        assert cache._total_bytes <= cache.max_bytes
+
+        before = self.requests()
+        path = await self.storage.local_path(self.key("paper_0.pdf"))
+        assert open(path, "rb").read() == self.files["paper_0.pdf"]
+        refetched = self.requests_since(before, "get_object")
+        assert refetched in (None, 1), "an evicted entry should be fetched again"
+        assert cache.get(self.key("paper_1.pdf")) is None, "reading it back should evict the next oldest"
+        return {"cached": sorted(name.rsplit("/", 1)[1] for name in cache._entries), "refetched": refetched}
+
+    async def check_pinning(self):
+        # A one-byte budget: anything not pinned is evicted as soon as it is added
+        self.reset_cache(1)
+        cache = self.storage.cache
+
+        # Held by a reader: more data goes through the cache, the pinned file stays
+        async with self.storage.open_local(self.key("paper_0.pdf")) as path:
+            for name in ("paper_1.pdf", "paper_2.pdf", "paper_3.pdf"):
+                await self.storage.local_path(self.key(name))
+            assert open(path, "rb").read() == self.files["paper_0.pdf"], "a pinned entry was evicted"
+        assert not os.path.exists(path), "the entry should be evicted once unpinned"
+
+        # Deleted while a reader holds it: the object goes, the local file waits for the reader
+        self.files["doomed.pdf"] = payload(2048, 7)
+        await self.put("doomed.pdf", self.files["doomed.pdf"])
+        async with self.storage.open_local(self.key("doomed.pdf")) as path:
+            await self.storage.delete(self.key("doomed.pdf"))
+            del self.files["doomed.pdf"]
+            assert os.path.exists(path), "a pinned entry was unlinked by delete()"
+            assert not await self.storage.exists(self.key("doomed.pdf"))
+        assert not os.path.exists(path), "the deleted entry should be unlinked after its last reader"
+
+        # A response still being streamed keeps its file
+        response = await self.storage.pdf_response(Request({"type": "http", "headers": [], "method": "GET"}), self.key("paper_4.pdf"), "paper_4.pdf")
+        for name in ("paper_1.pdf", "paper_2.pdf", "paper_3.pdf"):
+            await self.storage.local_path(self.key(name))
+        assert os.path.exists(response.path), "the file of an unsent response was evicted"
+        response.on_close()
+        assert not os.path.exists(response.path)
+        assert not cache._pins, f"pins left behind: {cache._pins}"
+        return {"pinned_survived": True}
+
+    async def check_delete(self):
+        self.reset_cache(1 << 30)
+        await self.storage.local_path(self.key("paper_0.pdf"))
+        freed = await self.storage.delete(self.key("paper_0.pdf"))
+        assert freed == len(self.files.pop("paper_0.pdf")), f"delete reported {freed} bytes"
+        assert not await self.storage.exists(self.key("paper_0.pdf"))
+        assert not os.path.exists(self.storage.cache._path(self.key("paper_0.pdf"))), "delete should drop the cached copy"
+        assert await self.storage.delete(self.key("paper_0.pdf")) == 0, "deleting a missing object frees nothing"
+
+        expected = sum(len(body) for body in self.files.values())
+        freed_prefix = await self.storage.delete_prefix(self.conversation)
+        assert freed_prefix == expected, f"delete_prefix reported {freed_prefix} of {expected} bytes"
+        assert await self.storage.list(self.conversation) == {}
+        self.files.clear()
+        return {"freed": freed, "freed_prefix": freed_prefix}
+
+    async def run(self, large_size: int) -> dict:
+        steps = [
+            ("put_file", lambda: self.check_put_file(large_size)),
+            ("list", self.check_list),
+            ("read_through", self.check_read_through),
+            ("range_reads", self.check_range_reads),
+            ("eviction", self.check_eviction),
+            ("pinning", self.check_pinning),
+            ("delete", self.check_delete),
+        ]
+        results = {}
+        try:
+            for name, step in steps:
+                try:
+                    results[name] = {"ok": True, **await step()}
+                except Exception as e:
+                    results[name] = {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc(limit=3)}
+                    break
+        finally:
+            if self.files:
+                await self.storage.delete_prefix(self.conversation)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint-url", default=None, help="S3-compatible endpoint; the in-process stand-in if omitted.")
+    parser.add_argument("--bucket", default="aireas-check")
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--part-kb", type=int, default=5 * 1024, help="Multipart threshold and part size; boto3 raises parts below 5 MB to 5 MB.")
+    args = parser.parse_args()
+
+    from boto3.s3.transfer import TransferConfig
+
+    server = None
+    stub_url = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        for variable in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            os.environ.setdefault(variable, "stub")
+        server, stub_url = start_stub()
+        endpoint_url = stub_url
+
+    cache_dir = tempfile.mkdtemp(prefix="check-storage-")
+    storage = S3Storage(args.bucket, "users_storage", LocalReadThroughCache(tempfile.mkdtemp(dir=cache_dir), 1 << 30),
+                        endpoint_url=endpoint_url, region=args.region)
+    part_size = args.part_kb * 1024
+    storage.transfer_config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size)
+    if stub_url:
+        storage.client.create_bucket(Bucket=args.bucket)
+
+    checks = Check(storage, cache_dir, stub_url)
+    results = asyncio.run(checks.run(large_size=part_size * 2 + 1234))
+    report = {"endpoint": args.endpoint_url or "stand-in", "checks": results, "passed": all(result["ok"] for result in results.values()) and len(results) == 7}
+    print(json.dumps(report, indent=2, default=str))
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    if server is not None:
+        server.should_exit = True
+    raise SystemExit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
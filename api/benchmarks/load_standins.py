@@ -0,0 +1,336 @@
+"""
+Local stand-ins for the services api/index.py calls, for load tests (see bench_load.py).
+
+- `LatencyDistribution`: seeded latency samples, e.g. "fixed:50", "uniform:20:80" or
+  "lognormal:400:1500" (median and p95 in milliseconds).
+- `LoadTestChatModel`: answers the prompts the app sends (ReWOO plan and solve, ReAct tool
+  loop, topic assignment) after sleeping a sampled latency.
+- `LoadTestEmbeddings`: deterministic vectors after a sampled latency, blocking like the
+  Google client.
+- `build_search_tool`: the Tavily and arXiv tools, returning canned results.
+- `MemoryRedis`: the subset of redis.asyncio.Redis that api/redis_ops.py uses, in memory.
+
+`install_standins` registers them through the service registry, with the flat vector backend,
+local storage and SQLite in `work_dir`, so the app runs without any network service.
+"""
+import asyncio
+import fnmatch
+import hashlib
+import json
+import math
+import os
+import re
+import secrets
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import StructuredTool
+from pydantic import ConfigDict
+from redis.exceptions import WatchError
+
+from api.services import services
+
+
+# The fake model's final answers echo the last token of this form in the prompt, so a client
+# can tell which question an answer belongs to
+QUERY_TOKEN = re.compile(r"\bq-\d+-\d+\b")
+ANSWER_PREFIX = "Answer for"
+
+
+class LatencyDistribution:
+    def __init__(self, spec: str, seed: int = 0):
+        kind, *params = spec.split(":")
+        params = [float(param) / 1000 for param in params]
+        if kind == "fixed" and len(params) == 1:
+            self._sample = lambda rng: params[0]
+        elif kind == "uniform" and len(params) == 2:
+            self._sample = lambda rng: rng.uniform(*params)
+        elif kind == "lognormal" and len(params) == 2:
+            median, p95 = params
+            sigma = math.log(p95 / median) / 1.645 if p95 > median else 0.0
+            self._sample = lambda rng: median * math.exp(sigma * rng.standard_normal())
+        else:
+            raise ValueError(f"Unknown latency distribution '{spec}' (fixed:MS, uniform:LOW:HIGH or lognormal:MEDIAN:P95).")
+        self.spec = spec
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            return self._sample(self._rng)
+
+
+def _last_token(text: str) -> str:
+    tokens = QUERY_TOKEN.findall(text)
+    return tokens[-1] if tokens else "query"
+
+
+class LoadTestChatModel(BaseChatModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    latency: LatencyDistribution
+    # Tool the ReAct loop calls once per question before answering
+    tool_name: str = "tavily_search_results_json"
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "load-test"
+
+    def _respond(self, messages, tools) -> AIMessage:
+        self.calls += 1
+        humans = [message for message in messages if isinstance(message, HumanMessage)]
+        prompt = str(humans[-1].content if humans else messages[-1].content)
+        token = _last_token(prompt)
+
+        if isinstance(messages[0], SystemMessage) and "Agents Available" in messages[0].content:
+            return AIMessage(content=(
+                f"Plan: Search the web and arXiv. #E1 = Searcher[{token}]\n"
+                f"Plan: Search the uploaded papers. #E2 = RagSearcher[{token}]\n"
+                "Plan: Combine the evidence. #E3 = ChatBot[Summarize #E1, #E2]"
+            ))
+        if "assign a relevant topic" in prompt:
+            return AIMessage(content="Machine Learning")
+
+        last_human = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=-1)
+        called = any(isinstance(message, ToolMessage) for message in messages[last_human + 1:])
+        if tools and self.tool_name in tools and not called:
+            call_id = f"call-{token}-{self.calls}"
+            arguments = {"query": token}
+            return AIMessage(
+                content="",
+                tool_calls=[{"name": self.tool_name, "args": arguments, "id": call_id}],
+                # The chat websocket reads tool calls in the provider's format
+                additional_kwargs={"tool_calls": [{"id": call_id, "type": "function",
+                                                   "function": {"name": self.tool_name, "arguments": json.dumps(arguments)}}]},
+            )
+        return AIMessage(content=f"{ANSWER_PREFIX} {token}.")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency.sample())
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency.sample())
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[tool.name for tool in tools], **kwargs)
+
+
+class LoadTestEmbeddings(Embeddings):
+    def __init__(self, dim: int, latency: LatencyDistribution):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+
+    def _vector(self, text: str) -> list:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32).tolist()
+
+    def embed_documents(self, texts, task_type=None):
+        self.calls += 1
+        time.sleep(self.latency.sample())
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text, task_type=None):
+        return self.embed_documents([text])[0]
+
+
+def build_search_tool(name: str, latency: LatencyDistribution) -> StructuredTool:
+    def search(query: str) -> str:
+        """Search for `query`."""
+        time.sleep(latency.sample())
+        return f"{name} results for {query}: nothing new."
+
+    async def asearch(query: str) -> str:
+        """Search for `query`."""
+        await asyncio.sleep(latency.sample())
+        return f"{name} results for {query}: nothing new."
+
+    return StructuredTool.from_function(
+        func=search,
+        coroutine=asearch,
+        name=name,
+        description=f"Stand-in for the {name} tool.",
+    )
+
+
+class MemoryPipeline:
+    """WATCH/MULTI/EXEC over MemoryRedis: EXEC fails with WatchError if a watched key was written since WATCH."""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._watched = {}
+        self._queued = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.reset()
+
+    async def reset(self):
+        self._watched = {}
+        self._queued = None
+
+    async def watch(self, *keys):
+        self._watched.update({key: self._redis._versions.get(key, 0) for key in keys})
+
+    async def unwatch(self):
+        self._watched = {}
+
+    def multi(self):
+        self._queued = []
+
+    def __getattr__(self, name):
+        command = getattr(self._redis, name)
+
+        def call(*args, **kwargs):
+            if self._queued is None:
+                return command(*args, **kwargs)
+            self._queued.append((command, args, kwargs))
+            return self
+
+        return call
+
+    async def execute(self):
+        queued, watched = self._queued or [], self._watched
+        await self.reset()
+        if any(self._redis._versions.get(key, 0) != version for key, version in watched.items()):
+            raise WatchError("Watched variable changed.")
+        return [await command(*args, **kwargs) for command, args, kwargs in queued]
+
+
+class MemoryRedis:
+    """In-process replacement for the Redis commands api/redis_ops.py uses."""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        # Bumped on every write, for WATCH
+        self._versions = {}
+
+    def _touch(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def pipeline(self):
+        return MemoryPipeline(self)
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    async def ping(self):
+        return True
+
+    async def get(self, key):
+        return self._live(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and self._live(key) is not None:
+            return None
+        self._data[key] = str(value)
+        self._touch(key)
+        self._expires.pop(key, None)
+        if ex:
+            self._expires[key] = time.monotonic() + ex
+        return True
+
+    async def delete(self, *keys):
+        removed = sum(self._live(key) is not None for key in keys)
+        for key in keys:
+            self._touch(key)
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return removed
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        values = dict(mapping or {})
+        if field is not None:
+            values[field] = value
+        hash_ = self._data.setdefault(key, {})
+        added = sum(name not in hash_ for name in values)
+        hash_.update({name: str(item) for name, item in values.items()})
+        self._touch(key)
+        return added
+
+    async def hget(self, key, field):
+        return (self._live(key) or {}).get(field)
+
+    async def hgetall(self, key):
+        return dict(self._live(key) or {})
+
+    async def hdel(self, key, *fields):
+        hash_ = self._live(key) or {}
+        self._touch(key)
+        return sum(hash_.pop(field, None) is not None for field in fields)
+
+    async def scan_iter(self, match="*", count=None):
+        for key in list(self._data):
+            if fnmatch.fnmatchcase(key, match) and self._live(key) is not None:
+                yield key
+
+    async def aclose(self):
+        pass
+
+
+def install_standins(work_dir: str, llm_latency: LatencyDistribution, embed_latency: LatencyDistribution,
+                     search_latency: LatencyDistribution, redis_url: Optional[str] = None, database_url: Optional[str] = None,
+                     gateway: bool = False) -> dict:
+    """
+    Point the app at the stand-ins: the services below, the flat vector backend, Redis
+    (MemoryRedis unless `redis_url`), the database (SQLite in `work_dir` unless `database_url`)
+    and local storage in `work_dir`. Without JWT_SECRET_KEY, tokens are signed with a throwaway
+    secret. With `gateway` the model is wrapped in the LLM gateway and its limits apply. Call
+    before the app starts.
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import sessionmaker
+
+    # The app's modules register the real factories on import; import them first so these replace them
+    import api.index
+    from api import qdrant_cloud_ops, redis_ops, sql_ops, storage
+    from api.flat_index import FlatIndexClient
+    from api.llm_chains import assign_chat_topic
+    from api.llm_gateway import gateway as llm_gateway
+    from api.qdrant_cloud_ops import EMBEDDING_DIM
+
+    os.makedirs(work_dir, exist_ok=True)
+    model = LoadTestChatModel(latency=llm_latency)
+    embeddings = LoadTestEmbeddings(EMBEDDING_DIM, embed_latency)
+    llm = llm_gateway.wrap(model) if gateway else model
+    client = FlatIndexClient(os.path.join(work_dir, "flat_index"))
+
+    # The client is a FlatIndexClient, so everything built on it (the langchain vector store) must know
+    qdrant_cloud_ops.VECTOR_BACKEND = os.environ["VECTOR_BACKEND"] = "flat"
+    services.register("qdrant", lambda: client)
+    services.register("embedding_model", lambda: embeddings)
+    services.register("llm", lambda: llm)
+    services.register("topic_chain", lambda: assign_chat_topic(llm=llm))
+    services.register("tavily_search_tool", lambda: build_search_tool("tavily_search_results_json", search_latency))
+    services.register("arxiv_search_tool", lambda: build_search_tool("arxiv", search_latency))
+
+    if redis_url:
+        import redis.asyncio as redis
+        redis_ops.redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
+    else:
+        redis_ops.redis_client = MemoryRedis()
+
+    if not sql_ops.JWT_SECRET_KEY:
+        # Signing (sql_ops) and verification (index) each read the secret at import
+        sql_ops.JWT_SECRET_KEY = api.index.SECRET_KEY = secrets.token_hex(32)
+    sql_ops.engine = sql_ops.build_engine(database_url or f"sqlite+aiosqlite:///{os.path.join(work_dir, 'users.db')}")
+    sql_ops.async_session = sessionmaker(sql_ops.engine, class_=AsyncSession, expire_on_commit=False)
+    storage._storage = storage.LocalStorage(os.path.join(work_dir, "users_storage"))
+
+    return {"model": model, "embeddings": embeddings, "qdrant": client}
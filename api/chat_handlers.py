@@ -1,25 +1,40 @@
-from langchain_groq import ChatGroq
 from dotenv import load_dotenv
 
-from langgraph.prebuilt import create_react_agent
-from api.team_tools import tavily_search_tool, arxiv_search_tool
-from api.qdrant_cloud_ops import initialize_selfquery_retriever, qdrant_vector_store
+from api.team_tools import get_tavily_search_tool, get_arxiv_search_tool, get_qdrant_retriever, arxiv_ingest_tool, repl_tool
 from api.token_counter import tiktoken_counter
 from langchain_core.messages import HumanMessage, BaseMessage, AIMessage, trim_messages
-from langgraph.prebuilt import InjectedStore
-from langgraph.store.base import BaseStore
+from api.services import services
+from api.llm_gateway import gateway
 
 
 
 
 load_dotenv()
 
-# chains.py
-from .llm_chains import assign_chat_topic
+CHAT_MODEL = 'llama-3.1-70b-versatile'
 
-llm = ChatGroq(model='llama-3.1-70b-versatile')
 
-assign_chat_topic_chain = assign_chat_topic(llm=llm)
+def _build_llm():
+    from langchain_groq import ChatGroq
+    # Every chain and the agent share this instance, so all Groq calls go through the gateway's limits
+    return gateway.wrap(ChatGroq(model=CHAT_MODEL))
+
+
+def get_llm():
+    return services.get("llm")
+
+
+def get_react_agent():
+    return services.get("react_agent")
+
+
+def get_rewoo_agent():
+    return services.get("rewoo_agent")
+
+
+def _build_rewoo_agent():
+    from api.rewoo import ReWOOAgent
+    return ReWOOAgent(get_llm())
 
 
 
@@ -31,10 +46,21 @@ trimmer = trim_messages(
     allow_partial=False,
 )
 
-qdrant_retriever = initialize_selfquery_retriever(llm, qdrant_vector_store=qdrant_vector_store)
-qdrant_retriever_tool = qdrant_retriever.as_tool(
-    name="retrieve_research_paper_texts",
-    description="Search and return information from the vector database containing texts of several research papers, and scholarly articles",
-)
-react_agent = create_react_agent(model=llm, checkpointer=MemorySaver(),tools=[qdrant_retriever_tool, arxiv_search_tool, tavily_search_tool], state_modifier="You are a helpful research assistant. Help user to the best of your abilities. Provide concise but accurate and up to point answers. As of now you have these tools in your arsenal: qdrant_retriever_tool (content retrieval from vector database), arxiv_search_tool (search research papers), tavily_search tool (internet search). If you do not know the answer, then simply say 'I don't know. If you need clarification on what exactly user wants, then ask the user again. If you know the answer to user's query then answer yourself, else you can also rely on tools you have.")
 
+def _build_react_agent():
+    from langgraph.prebuilt import create_react_agent
+    from langgraph.checkpoint.memory import MemorySaver
+
+    llm = get_llm()
+    # Routed through the tenancy layer with the user, email and conversation of the run config,
+    # so searches stay inside the caller's partition
+    qdrant_retriever_tool = get_qdrant_retriever().as_tool(
+        name="retrieve_research_paper_texts",
+        description="Search and return information from the vector database containing texts of several research papers, and scholarly articles",
+    )
+    return create_react_agent(model=llm, checkpointer=MemorySaver(),tools=[qdrant_retriever_tool, get_arxiv_search_tool(), arxiv_ingest_tool, get_tavily_search_tool(), repl_tool], state_modifier="You are a helpful research assistant. Help user to the best of your abilities. Provide concise but accurate and up to point answers. As of now you have these tools in your arsenal: qdrant_retriever_tool (content retrieval from vector database), arxiv_search_tool (search research papers), add_arxiv_papers (add arXiv papers to the conversation's documents), tavily_search tool (internet search), python_repl (run Python code, e.g. for calculations or charts; figures are shown to the user). If you do not know the answer, then simply say 'I don't know. If you need clarification on what exactly user wants, then ask the user again. If you know the answer to user's query then answer yourself, else you can also rely on tools you have.")
+
+
+services.register("llm", _build_llm)
+services.register("react_agent", _build_react_agent)
+services.register("rewoo_agent", _build_rewoo_agent)
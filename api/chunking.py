@@ -0,0 +1,265 @@
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import fitz
+
+from api.telemetry import span
+from api.token_counter import get_encoding
+
+
+# Bump whenever chunk boundaries or payload fields change so stored points can be told apart
+CHUNKER_VERSION = "structured-v1"
+
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 512))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 0))
+
+KNOWN_HEADINGS = {
+    "abstract", "introduction", "background", "related work", "method", "methods", "methodology",
+    "approach", "experiments", "experimental setup", "results", "evaluation", "discussion",
+    "conclusion", "conclusions", "limitations", "future work", "acknowledgements", "acknowledgments",
+    "references", "bibliography", "appendix",
+}
+
+NUMBERED_HEADING = re.compile(r"^((\d+(\.\d+)*)|([IVX]+)|([A-Z]))[.)]?\s+\S")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+PAGE_NUMBER = re.compile(r"^\s*(page\s*)?\d+(\s*(of|/)\s*\d+)?\s*$", re.IGNORECASE)
+BOLD_FLAG = 16
+
+
+@dataclass
+class Block:
+    text: str
+    page: int
+    size: float
+    bold: bool
+
+
+@dataclass
+class Chunk:
+    text: str
+    page_start: int
+    page_end: int
+    section: Optional[str]
+    token_count: int
+    chunk_type: str = "text"
+    weight: float = 1.0
+
+
+@dataclass
+class ChunkedDocument:
+    page_count: int
+    chunks: List[Chunk] = field(default_factory=list)
+
+
+class StructuredChunker:
+    """
+    Splits a PDF along its own structure: headings start a new chunk, paragraphs are packed
+    together up to `max_tokens` (counted with the project tokenizer), and only paragraphs that
+    are too long on their own are split further, by sentence and then by token window.
+
+    Every chunk records the 1-based page range it spans and the section it belongs to.
+    The instance holds no per-document state, so one chunker is shared by all requests.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS, heading_size_ratio: float = 1.15):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 4)
+        self.heading_size_ratio = heading_size_ratio
+
+    @property
+    def encoding(self):
+        # Resolved on first use; loading the BPE ranks can hit the network
+        return get_encoding()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+
+    def extract_blocks(self, pdf_document) -> List[Block]:
+        blocks = []
+        for page_number, page in enumerate(pdf_document, start=1):
+            for raw_block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+                lines = []
+                sizes = Counter()
+                bold_chars = 0
+                total_chars = 0
+
+                for line in raw_block.get("lines", []):
+                    line_text = "".join(span["text"] for span in line["spans"]).strip()
+                    if not line_text:
+                        continue
+                    for span in line["spans"]:
+                        n = len(span["text"].strip())
+                        sizes[round(span["size"], 1)] += n
+                        total_chars += n
+                        if span["flags"] & BOLD_FLAG:
+                            bold_chars += n
+                    lines.append(line_text)
+
+                if not lines:
+                    continue
+
+                # Re-join hyphenated line breaks, otherwise lines within a block are one paragraph
+                text = lines[0]
+                for line_text in lines[1:]:
+                    text = text[:-1] + line_text if text.endswith("-") else f"{text} {line_text}"
+
+                if PAGE_NUMBER.match(text):
+                    continue
+
+                blocks.append(Block(
+                    text=text,
+                    page=page_number,
+                    size=sizes.most_common(1)[0][0],
+                    bold=total_chars > 0 and bold_chars / total_chars > 0.8,
+                ))
+        return blocks
+
+    def is_heading(self, block: Block, body_size: float) -> bool:
+        text = block.text.strip()
+        if len(text) > 120 or len(text.split()) > 15 or text.endswith((".", ",", ";", ":")):
+            return False
+
+        bare = NUMBERED_HEADING.sub(lambda m: m.group(0)[-1], text).strip().lower()
+        if bare in KNOWN_HEADINGS or text.lower() in KNOWN_HEADINGS:
+            return True
+
+        if block.size >= body_size * self.heading_size_ratio:
+            return True
+
+        return block.bold and bool(NUMBERED_HEADING.match(text))
+
+    def split_long_text(self, text: str) -> List[str]:
+        """Split a paragraph that exceeds max_tokens, preferring sentence boundaries."""
+        pieces = []
+        current = []
+        current_tokens = 0
+
+        for sentence in SENTENCE_BOUNDARY.split(text):
+            sentence_tokens = self.count_tokens(sentence)
+
+            if sentence_tokens > self.max_tokens:
+                if current:
+                    pieces.append(" ".join(current))
+                    current, current_tokens = [], 0
+                tokens = self.encoding.encode_ordinary(sentence)
+                for start in range(0, len(tokens), self.max_tokens):
+                    pieces.append(self.encoding.decode(tokens[start:start + self.max_tokens]))
+                continue
+
+            if current and current_tokens + sentence_tokens > self.max_tokens:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+
+            current.append(sentence)
+            current_tokens += sentence_tokens
+
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+    def chunk_blocks(self, blocks: List[Block]) -> List[Chunk]:
+        if not blocks:
+            return []
+
+        size_weights = Counter()
+        for block in blocks:
+            size_weights[block.size] += len(block.text)
+        body_size = size_weights.most_common(1)[0][0]
+
+        chunks = []
+        section = None
+        parts = []  # (text, page)
+        parts_tokens = 0
+        carried = False  # parts holds nothing but overlap from the previous chunk
+        heading_only = False  # parts holds nothing but the section heading
+
+        def flush(carry_overlap: bool):
+            nonlocal parts, parts_tokens, carried
+            if not parts or carried:
+                # Never emit a chunk made only of overlap carried from the previous one
+                parts, parts_tokens, carried = [], 0, False
+                return
+            text = "\n\n".join(part for part, _ in parts)
+            pages = [page for _, page in parts]
+            chunks.append(Chunk(text=text, page_start=min(pages), page_end=max(pages), section=section, token_count=parts_tokens))
+
+            parts, parts_tokens = [], 0
+            if carry_overlap and self.overlap_tokens > 0:
+                tail = self.encoding.encode_ordinary(text)[-self.overlap_tokens:]
+                parts = [(self.encoding.decode(tail), pages[-1])]
+                parts_tokens = len(tail)
+                carried = True
+
+        for block in blocks:
+            if self.is_heading(block, body_size):
+                flush(carry_overlap=False)
+                section = block.text.strip()
+                parts = [(section, block.page)]
+                parts_tokens = self.count_tokens(section)
+                heading_only = True
+                continue
+
+            block_tokens = self.count_tokens(block.text)
+            pieces = [block.text] if block_tokens <= self.max_tokens else self.split_long_text(block.text)
+
+            for piece in pieces:
+                piece_tokens = block_tokens if len(pieces) == 1 else self.count_tokens(piece)
+                # A heading always stays with the text that follows it
+                if parts and not heading_only and parts_tokens + piece_tokens > self.max_tokens:
+                    flush(carry_overlap=True)
+                parts.append((piece, block.page))
+                parts_tokens += piece_tokens
+                carried = heading_only = False
+
+        flush(carry_overlap=False)
+
+        # A chunk holding nothing but a heading adds no retrievable content
+        return [chunk for chunk in chunks if chunk.text.strip() != (chunk.section or "")]
+
+    def chunk_section(self, section: Optional[str], paragraphs: List[Tuple[str, int]], chunk_type: str = "text", weight: float = 1.0) -> List[Chunk]:
+        """
+        Pack already-delimited (text, page) paragraphs of one section, e.g. from GROBID TEI,
+        into chunks of at most max_tokens. The section title leads the first chunk.
+        """
+        chunks = []
+        parts = [(section, paragraphs[0][1])] if section and paragraphs else []
+        parts_tokens = self.count_tokens(section) if parts else 0
+        heading_only = bool(parts)
+
+        def flush():
+            nonlocal parts, parts_tokens
+            if parts:
+                pages = [page for _, page in parts]
+                chunks.append(Chunk(
+                    text="\n\n".join(part for part, _ in parts), page_start=min(pages), page_end=max(pages),
+                    section=section, token_count=parts_tokens, chunk_type=chunk_type, weight=weight,
+                ))
+            parts, parts_tokens = [], 0
+
+        for text, page in paragraphs:
+            text_tokens = self.count_tokens(text)
+            pieces = [text] if text_tokens <= self.max_tokens else self.split_long_text(text)
+            for piece in pieces:
+                piece_tokens = text_tokens if len(pieces) == 1 else self.count_tokens(piece)
+                if parts and not heading_only and parts_tokens + piece_tokens > self.max_tokens:
+                    flush()
+                parts.append((piece, page))
+                parts_tokens += piece_tokens
+                heading_only = False
+
+        flush()
+        return chunks
+
+    def chunk_file(self, file_path) -> ChunkedDocument:
+        with fitz.open(file_path) as pdf_document:
+            with span("pdf.extract", pages=len(pdf_document)):
+                blocks = self.extract_blocks(pdf_document)
+            with span("pdf.chunk"):
+                chunks = self.chunk_blocks(blocks)
+            return ChunkedDocument(page_count=len(pdf_document), chunks=chunks)
+
+
+default_chunker = StructuredChunker()
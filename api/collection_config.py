@@ -0,0 +1,105 @@
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from qdrant_client.http import models
+
+
+load_dotenv()
+
+
+def _env_bool(name: str, default: str = "false") -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+def _env_optional_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# Index-time settings (applied when a collection is created, or by sync_collection_config)
+QDRANT_QUANTIZATION = os.environ.get("QDRANT_QUANTIZATION", "none").lower()  # none | scalar | binary
+QDRANT_QUANTIZATION_ALWAYS_RAM = _env_bool("QDRANT_QUANTIZATION_ALWAYS_RAM", "true")
+QDRANT_SCALAR_QUANTILE = float(os.environ.get("QDRANT_SCALAR_QUANTILE", 0.99))
+QDRANT_VECTORS_ON_DISK = _env_bool("QDRANT_VECTORS_ON_DISK")
+QDRANT_PAYLOAD_ON_DISK = _env_bool("QDRANT_PAYLOAD_ON_DISK")
+QDRANT_HNSW_M = int(os.environ.get("QDRANT_HNSW_M", 16))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.environ.get("QDRANT_HNSW_EF_CONSTRUCT", 100))
+QDRANT_HNSW_ON_DISK = _env_bool("QDRANT_HNSW_ON_DISK")
+
+# Query-time settings
+QDRANT_SEARCH_HNSW_EF = _env_optional_int("QDRANT_SEARCH_HNSW_EF")
+QDRANT_SEARCH_EXACT = _env_bool("QDRANT_SEARCH_EXACT")
+QDRANT_SEARCH_RESCORE = _env_bool("QDRANT_SEARCH_RESCORE", "true")
+QDRANT_SEARCH_OVERSAMPLING = float(os.environ.get("QDRANT_SEARCH_OVERSAMPLING", 2.0))
+
+
+def quantization_config(quantization: str = QDRANT_QUANTIZATION):
+    if quantization == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=QDRANT_SCALAR_QUANTILE,
+                always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM,
+            )
+        )
+    if quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=QDRANT_QUANTIZATION_ALWAYS_RAM))
+    if quantization == "none":
+        return None
+    raise ValueError(f"Unknown QDRANT_QUANTIZATION '{quantization}' (expected none, scalar or binary).")
+
+
+def hnsw_config(m: int = QDRANT_HNSW_M, ef_construct: int = QDRANT_HNSW_EF_CONSTRUCT, on_disk: bool = QDRANT_HNSW_ON_DISK):
+    return models.HnswConfigDiff(m=m, ef_construct=ef_construct, on_disk=on_disk)
+
+
+def collection_params(vector_size: int, quantization: str = QDRANT_QUANTIZATION, vectors_on_disk: bool = QDRANT_VECTORS_ON_DISK,
+                      hnsw_m: int = QDRANT_HNSW_M, hnsw_ef_construct: int = QDRANT_HNSW_EF_CONSTRUCT) -> dict:
+    """
+    Keyword arguments for `QdrantClient.create_collection`. With quantization enabled and
+    vectors on disk, the quantized copy stays in RAM for the HNSW walk and the full-precision
+    originals are only read from disk for rescoring.
+    """
+    return {
+        "vectors_config": models.VectorParams(size=vector_size, distance=models.Distance.COSINE, on_disk=vectors_on_disk),
+        "hnsw_config": hnsw_config(hnsw_m, hnsw_ef_construct),
+        "quantization_config": quantization_config(quantization),
+        "on_disk_payload": QDRANT_PAYLOAD_ON_DISK,
+    }
+
+
+def search_params(hnsw_ef: Optional[int] = None, oversampling: Optional[float] = None, rescore: Optional[bool] = None,
+                  exact: Optional[bool] = None, quantization: str = QDRANT_QUANTIZATION) -> Optional[models.SearchParams]:
+    """
+    Per-query search parameters. Arguments override the QDRANT_SEARCH_* defaults; returns None
+    when everything is at Qdrant's own defaults so requests stay unchanged.
+    """
+    hnsw_ef = hnsw_ef if hnsw_ef is not None else QDRANT_SEARCH_HNSW_EF
+    exact = exact if exact is not None else QDRANT_SEARCH_EXACT
+
+    quantization_params = None
+    if quantization != "none":
+        quantization_params = models.QuantizationSearchParams(
+            rescore=rescore if rescore is not None else QDRANT_SEARCH_RESCORE,
+            oversampling=oversampling if oversampling is not None else QDRANT_SEARCH_OVERSAMPLING,
+        )
+
+    if hnsw_ef is None and not exact and quantization_params is None:
+        return None
+    return models.SearchParams(hnsw_ef=hnsw_ef, exact=exact, quantization=quantization_params)
+
+
+def sync_collection_config(client, collection_name: str):
+    """
+    Push the configured HNSW, quantization and on-disk settings to an existing collection.
+    Qdrant rebuilds the affected segments in the background; searches keep working meanwhile.
+    """
+    quantization = quantization_config()
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": models.VectorParamsDiff(on_disk=QDRANT_VECTORS_ON_DISK)},
+        hnsw_config=hnsw_config(),
+        quantization_config=quantization if quantization is not None else models.Disabled.DISABLED,
+    )
+    print(f"Synced collection config for '{collection_name}' (quantization={QDRANT_QUANTIZATION}, vectors_on_disk={QDRANT_VECTORS_ON_DISK}).")
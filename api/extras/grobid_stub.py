@@ -0,0 +1,63 @@
+"""
+Minimal stand-in for a GROBID server, for local development and tests of the grobid
+ingestion mode without running the real service.
+
+    uvicorn api.extras.grobid_stub:app --port 8070
+    GROBID_URL=http://localhost:8070 INGESTION_MODE=grobid ...
+
+It answers /api/processFulltextDocument with a small TEI document built from PyMuPDF text
+blocks (first block as title, font-size headings as section heads, one <surface> per page).
+"""
+from xml.sax.saxutils import escape
+
+import fitz
+from fastapi import FastAPI, File, UploadFile
+from fastapi.responses import PlainTextResponse, Response
+
+from api.chunking import StructuredChunker
+
+
+app = FastAPI()
+chunker = StructuredChunker()
+
+
+def pdf_to_tei(pdf_bytes: bytes) -> str:
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        page_count = len(pdf_document)
+        blocks = chunker.extract_blocks(pdf_document)
+
+    if not blocks:
+        return '<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader/><text><body/></text></TEI>'
+
+    body_size = max(set(block.size for block in blocks), key=lambda size: sum(len(b.text) for b in blocks if b.size == size))
+    title, blocks = blocks[0], blocks[1:]
+
+    body = ["<div>"]
+    for block in blocks:
+        coords = f'{block.page},0,0,0,0'
+        if chunker.is_heading(block, body_size):
+            body.append(f'</div><div><head coords="{coords}">{escape(block.text)}</head>')
+        else:
+            body.append(f'<p coords="{coords}">{escape(block.text)}</p>')
+    body.append("</div>")
+
+    surfaces = "".join(f'<surface n="{n}"/>' for n in range(1, page_count + 1))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<TEI xmlns="http://www.tei-c.org/ns/1.0">'
+        f'<teiHeader><fileDesc><titleStmt><title level="a" type="main">{escape(title.text)}</title></titleStmt></fileDesc></teiHeader>'
+        f'<facsimile>{surfaces}</facsimile>'
+        f'<text><body>{"".join(body)}</body></text>'
+        '</TEI>'
+    )
+
+
+@app.get("/api/isalive")
+async def isalive():
+    return PlainTextResponse("true")
+
+
+@app.post("/api/processFulltextDocument")
+async def process_fulltext_document(input: UploadFile = File(...)):
+    tei = pdf_to_tei(await input.read())
+    return Response(content=tei, media_type="application/xml")
@@ -89,27 +89,29 @@ def extract_text_from_pdf(file_path) -> str:
 def strip_namespace(tag):
     return tag.split('}')[-1]  # Get everything after the '}' character
 
-# Function to convert XML elements to a nested string representation
+# Function to convert XML elements to a flat "tag: text" string representation
 def xml_to_string(element, indent=0):
-    result = ""
-    # Process child elements
-    for child in element:
-        child_tag = strip_namespace(child.tag)
-        child_string = xml_to_string(child, indent + 2)  # Recursively call for child elements
-        
-        # If the element has text, add it directly without the 'text' key
-        if child.text and child.text.strip():
-            result += ' ' * indent + f"{child_tag}: {child.text.strip()}\n"
-        
-        # If the child has sub-elements, include the constructed string
-        if child_string:
-            result += ' ' * indent + f"{child_tag}:\n{child_string}"
-
-    cleaned_result = result.replace('\n', ' ')
-    cleaned_string = ' '.join(cleaned_result.split())  # This removes extra spaces
-
-        
-    return cleaned_string
+    # Collect fragments in a list and join once; repeated string concatenation is quadratic on large TEI files
+    parts = []
+
+    def walk(node):
+        for child in node:
+            child_tag = strip_namespace(child.tag)
+
+            # If the element has text, add it directly without the 'text' key
+            if child.text and child.text.strip():
+                parts.append(f"{child_tag}: {child.text.strip()}")
+
+            # If the child has sub-elements with content, label them with the child's tag
+            marker = len(parts)
+            parts.append(f"{child_tag}:")
+            walk(child)
+            if len(parts) == marker + 1:
+                parts.pop()
+
+    walk(element)
+
+    return ' '.join(' '.join(parts).split())  # This removes extra spaces
 
 
 
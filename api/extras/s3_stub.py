@@ -0,0 +1,244 @@
+"""
+Minimal in-memory stand-in for an S3-compatible object store (MinIO, S3), for trying
+STORAGE_BACKEND=s3 and running api.benchmarks.check_storage without a real bucket.
+
+    uvicorn api.extras.s3_stub:app --port 9000
+    STORAGE_BACKEND=s3 S3_BUCKET=aireas S3_ENDPOINT_URL=http://localhost:9000 \
+        AWS_ACCESS_KEY_ID=stub AWS_SECRET_ACCESS_KEY=stub S3_REGION=us-east-1 ...
+
+Path-style requests only, no authentication. Supported operations: CreateBucket, PutObject,
+multipart uploads (create, upload part, complete, abort), GetObject with a single byte range,
+HeadObject, DeleteObject and ListObjectsV2 with prefix, delimiter and continuation tokens
+(pages of S3_STUB_PAGE_SIZE keys). Buckets are created on first write. Bodies sent with
+aws-chunked encoding (the default for recent boto3 releases) are decoded.
+
+GET /_stats returns per-operation request counters.
+"""
+import os
+import uuid
+import hashlib
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+
+app = FastAPI()
+stats = Counter()
+
+PAGE_SIZE = int(os.environ.get("S3_STUB_PAGE_SIZE", 1000))
+XML_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+buckets = {}  # bucket -> {key: {"body": bytes, "etag": str, "modified": datetime}}
+multipart_uploads = {}  # upload id -> {"bucket", "key", "parts": {number: bytes}}
+
+
+def xml_response(root: str, body: str, status_code: int = 200) -> Response:
+    return Response(
+        f'<?xml version="1.0" encoding="UTF-8"?><{root} xmlns="{XML_NAMESPACE}">{body}</{root}>',
+        status_code=status_code,
+        media_type="application/xml",
+    )
+
+
+def error(code: str, message: str, status_code: int, head: bool = False) -> Response:
+    if head:
+        # HEAD responses carry no body; the client maps the status code
+        return Response(status_code=status_code)
+    return Response(
+        f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>',
+        status_code=status_code,
+        media_type="application/xml",
+    )
+
+
+def decode_aws_chunked(body: bytes) -> bytes:
+    """Strip aws-chunked framing: `<hex size>[;chunk-signature=...]\\r\\n<data>\\r\\n`, ending with a zero-size chunk and trailers."""
+    data = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(data)
+        start = line_end + 2
+        data += body[start:start + size]
+        position = start + size + 2
+
+
+async def read_body(request: Request) -> bytes:
+    body = await request.body()
+    if "aws-chunked" in request.headers.get("content-encoding", "") or "x-amz-decoded-content-length" in request.headers:
+        body = decode_aws_chunked(body)
+    return body
+
+
+def etag_of(body: bytes) -> str:
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def object_headers(obj: dict) -> dict:
+    return {
+        "ETag": obj["etag"],
+        "Last-Modified": format_datetime(obj["modified"], usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Content-Type": obj["content_type"],
+    }
+
+
+def store(bucket: str, key: str, body: bytes, content_type: str, etag: str = None) -> dict:
+    obj = {
+        "body": body,
+        "etag": etag or etag_of(body),
+        "modified": datetime.now(timezone.utc).replace(microsecond=0),
+        "content_type": content_type or "application/octet-stream",
+    }
+    buckets.setdefault(bucket, {})[key] = obj
+    return obj
+
+
+def list_objects(bucket: str, request: Request) -> Response:
+    stats["list_objects"] += 1
+    params = request.query_params
+    prefix = params.get("prefix", "")
+    delimiter = params.get("delimiter", "")
+    token = params.get("continuation-token") or params.get("start-after") or ""
+    max_keys = min(int(params.get("max-keys", PAGE_SIZE)), PAGE_SIZE)
+
+    contents, common_prefixes, last = [], [], None
+    truncated = False
+    for key in sorted(buckets.get(bucket, {})):
+        if not key.startswith(prefix) or key <= token or (token.endswith(delimiter or "\0") and key.startswith(token)):
+            continue
+        rest = key[len(prefix):]
+        if delimiter and delimiter in rest:
+            common_prefix = prefix + rest[:rest.index(delimiter) + len(delimiter)]
+            if common_prefix in common_prefixes:
+                continue
+            entry = ("prefix", common_prefix)
+        else:
+            entry = ("key", key)
+        if len(contents) + len(common_prefixes) == max_keys:
+            truncated = True
+            break
+        if entry[0] == "prefix":
+            common_prefixes.append(entry[1])
+        else:
+            contents.append(entry[1])
+        last = entry[1]
+
+    objects = buckets.get(bucket, {})
+    body = [
+        f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><Delimiter>{escape(delimiter)}</Delimiter>",
+        f"<MaxKeys>{max_keys}</MaxKeys><KeyCount>{len(contents) + len(common_prefixes)}</KeyCount>",
+        f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>",
+    ]
+    if truncated:
+        body.append(f"<NextContinuationToken>{escape(last)}</NextContinuationToken>")
+    for key in contents:
+        obj = objects[key]
+        body.append(
+            f"<Contents><Key>{escape(key)}</Key><LastModified>{obj['modified'].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified>"
+            f"<ETag>{escape(obj['etag'])}</ETag><Size>{len(obj['body'])}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+        )
+    for common_prefix in common_prefixes:
+        body.append(f"<CommonPrefixes><Prefix>{escape(common_prefix)}</Prefix></CommonPrefixes>")
+    return xml_response("ListBucketResult", "".join(body))
+
+
+@app.get("/_stats")
+async def get_stats():
+    return dict(stats)
+
+
+@app.api_route("/{bucket}", methods=["GET", "PUT", "HEAD"])
+async def bucket_operation(bucket: str, request: Request):
+    if request.method == "PUT":
+        stats["create_bucket"] += 1
+        buckets.setdefault(bucket, {})
+        return Response(headers={"Location": f"/{bucket}"})
+    if request.method == "HEAD":
+        return Response(status_code=200 if bucket in buckets else 404)
+    return list_objects(bucket, request)
+
+
+@app.api_route("/{bucket}/{key:path}", methods=["GET", "PUT", "POST", "DELETE", "HEAD"])
+async def object_operation(bucket: str, key: str, request: Request):
+    params = request.query_params
+    method = request.method
+
+    if method == "POST" and "uploads" in params:
+        stats["create_multipart_upload"] += 1
+        upload_id = uuid.uuid4().hex
+        multipart_uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}, "content_type": request.headers.get("content-type")}
+        return xml_response(
+            "InitiateMultipartUploadResult",
+            f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>",
+        )
+
+    if "uploadId" in params:
+        upload = multipart_uploads.get(params["uploadId"])
+        if upload is None:
+            return error("NoSuchUpload", "The specified multipart upload does not exist.", 404)
+        if method == "PUT":
+            stats["upload_part"] += 1
+            part = await read_body(request)
+            upload["parts"][int(params["partNumber"])] = part
+            return Response(headers={"ETag": etag_of(part)})
+        if method == "DELETE":
+            stats["abort_multipart_upload"] += 1
+            del multipart_uploads[params["uploadId"]]
+            return Response(status_code=204)
+        if method == "POST":
+            stats["complete_multipart_upload"] += 1
+            requested = ElementTree.fromstring(await request.body())
+            numbers = [int(element.text) for element in requested.iter() if element.tag.endswith("PartNumber")]
+            if any(number not in upload["parts"] for number in numbers):
+                return error("InvalidPart", "One or more of the specified parts could not be found.", 400)
+            body = b"".join(upload["parts"][number] for number in numbers)
+            digest = hashlib.md5(b"".join(hashlib.md5(upload["parts"][number]).digest() for number in numbers)).hexdigest()
+            obj = store(bucket, key, body, upload["content_type"], etag=f'"{digest}-{len(numbers)}"')
+            del multipart_uploads[params["uploadId"]]
+            return xml_response(
+                "CompleteMultipartUploadResult",
+                f"<Location>/{escape(bucket)}/{escape(key)}</Location><Bucket>{escape(bucket)}</Bucket>"
+                f"<Key>{escape(key)}</Key><ETag>{escape(obj['etag'])}</ETag>",
+            )
+
+    if method == "PUT":
+        stats["put_object"] += 1
+        obj = store(bucket, key, await read_body(request), request.headers.get("content-type"))
+        return Response(headers={"ETag": obj["etag"]})
+
+    if method == "DELETE":
+        stats["delete_object"] += 1
+        buckets.get(bucket, {}).pop(key, None)
+        return Response(status_code=204)
+
+    obj = buckets.get(bucket, {}).get(key)
+    if method == "HEAD":
+        stats["head_object"] += 1
+        if obj is None:
+            return error("NoSuchKey", "", 404, head=True)
+        return Response(headers={**object_headers(obj), "Content-Length": str(len(obj["body"]))})
+
+    stats["get_object"] += 1
+    if obj is None:
+        return error("NoSuchKey", "The specified key does not exist.", 404)
+    headers = object_headers(obj)
+    size = len(obj["body"])
+    range_header = request.headers.get("range")
+    if not range_header:
+        return Response(obj["body"], headers=headers, media_type=obj["content_type"])
+
+    stats["get_object_range"] += 1
+    first, _, last = range_header.removeprefix("bytes=").partition("-")
+    start, end = (size - int(last), size - 1) if first == "" else (int(first), min(int(last or size - 1), size - 1))
+    if start >= size or start > end:
+        return error("InvalidRange", "The requested range is not satisfiable.", 416)
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(obj["body"][start:end + 1], status_code=206, headers=headers, media_type=obj["content_type"])
@@ -0,0 +1,96 @@
+"""
+Local stand-in for the web, for trying api/web_scraper.py and api.benchmarks.bench_scraper
+without network access.
+
+    uvicorn api.extras.web_stub:app --port 8090
+
+Routes:
+    /page/{n}    an article wrapped in navigation, scripts and a footer; sends an ETag and
+                 Last-Modified and answers conditional requests with 304
+    /plain/{n}   the same article as text/plain, without validators
+    /large       about 5 MB of paragraphs, for SCRAPER_MAX_BYTES
+    /binary      application/octet-stream
+    /redirect/{n} 302 to /page/{n}
+    /stats       request counters
+
+Every route sleeps WEB_STUB_DELAY_MS (or ?delay_ms=) first, like a slow remote host.
+"""
+import os
+import asyncio
+import hashlib
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, Response
+
+
+app = FastAPI()
+stats = Counter()
+
+DELAY_MS = float(os.environ.get("WEB_STUB_DELAY_MS", 100))
+LAST_MODIFIED = "Mon, 07 Oct 2024 12:00:00 GMT"
+SENTENCE = "Retrieval-augmented generation grounds a language model in documents fetched at query time. "
+
+
+def article(n: int) -> str:
+    paragraphs = "".join(f"<p>Paragraph {i} of article {n}. {SENTENCE * 4}</p>" for i in range(1, 9))
+    return f"<h1>Article {n}</h1>{paragraphs}"
+
+
+def html_page(n: int) -> str:
+    boilerplate = "".join(f'<li><a href="/page/{i}">Related link {i}</a></li>' for i in range(40))
+    return (
+        f"<html><head><title>Stub article {n}</title><style>body {{ color: #222 }}</style>"
+        f"<script>var tracking = '{'x' * 2000}';</script></head><body>"
+        f"<header><nav><ul>{boilerplate}</ul></nav></header>"
+        f"<div class='content'><article>{article(n)}</article></div>"
+        f"<aside>Subscribe to our newsletter</aside><footer>Copyright stub</footer></body></html>"
+    )
+
+
+async def delay(request: Request):
+    stats["requests"] += 1
+    await asyncio.sleep(float(request.query_params.get("delay_ms", DELAY_MS)) / 1000)
+
+
+@app.get("/page/{n}")
+async def page(n: int, request: Request):
+    await delay(request)
+    etag = f'"{hashlib.sha1(str(n).encode()).hexdigest()[:16]}"'
+    if request.headers.get("if-none-match") == etag:
+        stats["not_modified"] += 1
+        return Response(status_code=304, headers={"ETag": etag})
+    stats["full"] += 1
+    return HTMLResponse(html_page(n), headers={"ETag": etag, "Last-Modified": LAST_MODIFIED})
+
+
+@app.get("/plain/{n}")
+async def plain(n: int, request: Request):
+    await delay(request)
+    stats["full"] += 1
+    return PlainTextResponse(f"Article {n}\n{SENTENCE * 8}")
+
+
+@app.get("/large")
+async def large(request: Request):
+    await delay(request)
+    stats["full"] += 1
+    paragraphs = f"<p>{SENTENCE * 10}</p>" * 6000
+    return HTMLResponse(f"<html><head><title>Large</title></head><body><article>{paragraphs}</article></body></html>")
+
+
+@app.get("/binary")
+async def binary(request: Request):
+    await delay(request)
+    return Response(os.urandom(1024), media_type="application/octet-stream")
+
+
+@app.get("/redirect/{n}")
+async def redirect(n: int, request: Request):
+    await delay(request)
+    return RedirectResponse(f"/page/{n}", status_code=302)
+
+
+@app.get("/stats")
+async def get_stats():
+    return dict(stats)
@@ -0,0 +1,497 @@
+"""
+Embedded flat vector index with the subset of the QdrantClient API the app uses.
+
+Selected with VECTOR_BACKEND=flat (see api/qdrant_cloud_ops.py). Each collection is a directory
+under FLAT_INDEX_DIR holding an mmap'd float32 matrix of unit-normalised vectors plus a pickled
+state file (ids, payloads, tombstones, IVF lists). Searches are a vectorised matrix product over
+the rows that pass the filter, processed in blocks with a running top-k so memory stays bounded.
+
+With FLAT_INDEX_IVF_LISTS > 0 the vectors are clustered with spherical k-means once there are
+enough of them, and unfiltered (or loosely filtered) searches only scan the FLAT_INDEX_IVF_PROBES
+lists closest to the query. Filtered searches that leave fewer than FLAT_INDEX_EXACT_THRESHOLD
+candidates, e.g. one user's conversation, are always exact.
+
+Meant for development, integration tests and small single-node deployments; it has no
+sharding, quantization or replication, and those settings are accepted and ignored.
+"""
+import os
+import json
+import pickle
+import shutil
+import threading
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from qdrant_client.http import models
+
+from api.retrieval_payload import select_payload
+
+
+load_dotenv()
+
+FLAT_INDEX_DIR = os.environ.get("FLAT_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "flat_index"))
+FLAT_INDEX_IVF_LISTS = int(os.environ.get("FLAT_INDEX_IVF_LISTS", 0))
+FLAT_INDEX_IVF_PROBES = int(os.environ.get("FLAT_INDEX_IVF_PROBES", 8))
+FLAT_INDEX_EXACT_THRESHOLD = int(os.environ.get("FLAT_INDEX_EXACT_THRESHOLD", 20_000))
+
+SEARCH_BLOCK_ROWS = 65_536
+INITIAL_CAPACITY = 1_024
+KMEANS_ITERATIONS = 10
+# Rows per list needed before training is worthwhile (the usual IVF rule of thumb)
+MIN_ROWS_PER_LIST = 39
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_cosine(queries: np.ndarray, vectors: np.ndarray, rows: np.ndarray, k: int, block_rows: int = SEARCH_BLOCK_ROWS):
+    """
+    Batch cosine top-k of unit-normalised `queries` (q, d) against `vectors[rows]`.
+    Returns (scores, row_indices), both (q, min(k, len(rows))) and sorted best first.
+    """
+    k = min(k, len(rows))
+    if k == 0:
+        empty = np.empty((len(queries), 0))
+        return empty.astype(np.float32), empty.astype(np.int64)
+
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_rows = np.zeros((len(queries), k), dtype=np.int64)
+
+    for start in range(0, len(rows), block_rows):
+        block = rows[start:start + block_rows]
+        scores = queries @ vectors[block].T
+        all_scores = np.concatenate([best_scores, scores], axis=1)
+        all_rows = np.concatenate([best_rows, np.broadcast_to(block, scores.shape)], axis=1)
+        keep = np.argpartition(-all_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(all_scores, keep, axis=1)
+        best_rows = np.take_along_axis(all_rows, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+
+def _lookup(payload: dict, key: str):
+    value = payload
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _values(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class FlatCollection:
+    def __init__(self, path: str, dim: Optional[int] = None):
+        self.path = path
+        self.lock = threading.RLock()
+        self._columns = {}
+        state_path = os.path.join(path, "state.pkl")
+
+        if os.path.exists(state_path):
+            with open(state_path, "rb") as f:
+                state = pickle.load(f)
+        else:
+            os.makedirs(path, exist_ok=True)
+            state = {"dim": dim, "capacity": 0, "count": 0, "ids": [], "payloads": [], "alive": np.zeros(0, dtype=bool),
+                     "centroids": None, "assignments": np.zeros(0, dtype=np.int32), "trained_on": 0}
+        self.__dict__.update(state)
+        self.row_of = {point_id: row for row, point_id in enumerate(self.ids) if self.alive[row]}
+        self.vectors = self._open_vectors(self.capacity) if self.capacity else np.zeros((0, self.dim), dtype=np.float32)
+        if not os.path.exists(state_path):
+            self._save()
+
+    # Storage
+
+    def _open_vectors(self, capacity: int):
+        return np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _grow(self, needed: int):
+        if needed <= self.capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, self.capacity)
+        while capacity < needed:
+            capacity *= 2
+        vectors_path = os.path.join(self.path, "vectors.f32")
+        if self.capacity:
+            self.vectors.flush()
+            del self.vectors
+        with open(vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self.vectors = self._open_vectors(capacity)
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+        self.assignments = np.concatenate([self.assignments, np.full(capacity - len(self.assignments), -1, dtype=np.int32)])
+
+    def _save(self):
+        if self.capacity:
+            self.vectors.flush()
+        state = {key: getattr(self, key) for key in ("dim", "capacity", "count", "ids", "payloads", "alive", "centroids", "assignments", "trained_on")}
+        tmp_path = os.path.join(self.path, "state.pkl.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(self.path, "state.pkl"))
+
+    # Writes
+
+    def upsert(self, ids: list, vectors, payloads: list):
+        with self.lock:
+            vectors = normalize(vectors)
+            new_ids = [point_id for point_id in dict.fromkeys(ids) if point_id not in self.row_of]
+            self._grow(self.count + len(new_ids))
+
+            rows = []
+            for point_id, payload in zip(ids, payloads):
+                row = self.row_of.get(point_id)
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    self.ids.append(point_id)
+                    self.payloads.append(payload or {})
+                    self.row_of[point_id] = row
+                else:
+                    self.payloads[row] = payload or {}
+                self.alive[row] = True
+                rows.append(row)
+
+            rows = np.asarray(rows)
+            self.vectors[rows] = vectors
+            if self.centroids is not None:
+                self.assignments[rows] = np.argmax(vectors @ self.centroids.T, axis=1)
+            self._columns.clear()
+            self._maybe_train()
+            self._save()
+
+    def delete_rows(self, rows: np.ndarray) -> int:
+        with self.lock:
+            rows = rows[self.alive[rows]]
+            self.alive[rows] = False
+            for row in rows:
+                self.row_of.pop(self.ids[row], None)
+                self.payloads[row] = {}
+            self._columns.clear()
+            self._save()
+            return len(rows)
+
+    # IVF
+
+    def _maybe_train(self):
+        lists = FLAT_INDEX_IVF_LISTS
+        alive_rows = np.flatnonzero(self.alive[:self.count])
+        if not lists or len(alive_rows) < lists * MIN_ROWS_PER_LIST:
+            return
+        if self.centroids is not None and len(alive_rows) < 2 * self.trained_on:
+            return
+        self.train_ivf(lists, alive_rows)
+
+    def train_ivf(self, lists: int, rows: np.ndarray, seed: int = 0):
+        """Spherical k-means on a sample, then assign every row to its closest centroid."""
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[rng.choice(rows, size=min(len(rows), lists * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=lists, replace=False)]
+
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=lists) == 0
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = normalize(sums)
+
+        self.centroids = centroids
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            block = rows[start:start + SEARCH_BLOCK_ROWS]
+            self.assignments[block] = np.argmax(self.vectors[block] @ centroids.T, axis=1)
+        self.trained_on = len(rows)
+        print(f"Trained {lists} IVF lists on {len(rows)} vectors in '{os.path.basename(self.path)}'.")
+
+    # Filters
+
+    def _column(self, key: str):
+        if key not in self._columns:
+            values = np.empty(self.count, dtype=object)
+            values[:] = [_lookup(payload, key) for payload in self.payloads]
+            has_lists = any(isinstance(value, list) for value in values)
+            self._columns[key] = (values, has_lists)
+        return self._columns[key]
+
+    def _condition_mask(self, condition) -> np.ndarray:
+        if isinstance(condition, models.Filter):
+            return self.filter_mask(condition)
+        if isinstance(condition, models.HasIdCondition):
+            mask = np.zeros(self.count, dtype=bool)
+            mask[[self.row_of[point_id] for point_id in condition.has_id if point_id in self.row_of]] = True
+            return mask
+        if isinstance(condition, models.IsEmptyCondition):
+            values, _ = self._column(condition.is_empty.key)
+            return np.fromiter((not _values(value) for value in values), dtype=bool, count=self.count)
+        if isinstance(condition, models.IsNullCondition):
+            values, _ = self._column(condition.is_null.key)
+            return np.fromiter((value is None for value in values), dtype=bool, count=self.count)
+        if not isinstance(condition, models.FieldCondition):
+            raise NotImplementedError(f"Flat index does not support {type(condition).__name__} filters.")
+
+        values, has_lists = self._column(condition.key)
+        match = condition.match
+        if isinstance(match, models.MatchValue) and not has_lists:
+            return values == match.value
+        if isinstance(match, models.MatchValue):
+            test = lambda vs: match.value in vs
+        elif isinstance(match, models.MatchAny):
+            wanted = set(match.any)
+            test = lambda vs: bool(wanted.intersection(vs))
+        elif isinstance(match, models.MatchExcept):
+            excluded = set(match.except_)
+            test = lambda vs: not excluded.intersection(vs)
+        elif condition.range is not None:
+            bounds = condition.range
+            test = lambda vs: any(
+                (bounds.gt is None or v > bounds.gt) and (bounds.gte is None or v >= bounds.gte)
+                and (bounds.lt is None or v < bounds.lt) and (bounds.lte is None or v <= bounds.lte)
+                for v in vs if isinstance(v, (int, float))
+            )
+        else:
+            raise NotImplementedError(f"Flat index does not support this condition on '{condition.key}'.")
+        return np.fromiter((test(_values(value)) for value in values), dtype=bool, count=self.count)
+
+    def filter_mask(self, points_filter: Optional[models.Filter]) -> np.ndarray:
+        mask = self.alive[:self.count].copy()
+        if points_filter is None:
+            return mask
+        for condition in points_filter.must or []:
+            mask &= self._condition_mask(condition)
+        for condition in points_filter.must_not or []:
+            mask &= ~self._condition_mask(condition)
+        if points_filter.should:
+            any_mask = np.zeros(self.count, dtype=bool)
+            for condition in points_filter.should:
+                any_mask |= self._condition_mask(condition)
+            mask &= any_mask
+        return mask
+
+    # Reads
+
+    def search(self, queries, points_filter=None, limit=10, offset=0, score_threshold=None, exact=False, probes=None):
+        """Top `limit` (row, score) pairs per query for a (q, d) batch of queries sharing one filter."""
+        with self.lock:
+            queries = normalize(np.atleast_2d(queries))
+            rows = np.flatnonzero(self.filter_mask(points_filter))
+            k = limit + (offset or 0)
+
+            if not exact and self.centroids is not None and len(rows) > FLAT_INDEX_EXACT_THRESHOLD:
+                probes = min(probes or FLAT_INDEX_IVF_PROBES, len(self.centroids))
+                probed = np.argpartition(-(queries @ self.centroids.T), probes - 1, axis=1)[:, :probes]
+                results = []
+                for query, lists in zip(queries, probed):
+                    candidates = rows[np.isin(self.assignments[rows], lists)]
+                    scores, found = top_k_cosine(query[None, :], self.vectors, candidates, k)
+                    results.append((scores[0], found[0]))
+            else:
+                scores, found = top_k_cosine(queries, self.vectors, rows, k)
+                results = list(zip(scores, found))
+
+            hits = []
+            for scores, found in results:
+                pairs = [(int(row), float(score)) for row, score in zip(found, scores)][offset or 0:]
+                if score_threshold is not None:
+                    pairs = [(row, score) for row, score in pairs if score >= score_threshold]
+                hits.append(pairs)
+            return hits
+
+    def record(self, row: int, with_payload=True, with_vectors=False) -> models.Record:
+        return models.Record(
+            id=self.ids[row],
+            payload=select_payload(self.payloads[row], with_payload),
+            vector=self.vectors[row].tolist() if with_vectors else None,
+        )
+
+
+class FlatIndexClient:
+    """
+    Drop-in for the QdrantClient calls made by the app, the tenancy layer, the re-indexer and
+    the garbage collector. Collections live in `path`; aliases in `path`/aliases.json.
+    """
+
+    def __init__(self, path: str = FLAT_INDEX_DIR):
+        self.path = path
+        self.lock = threading.RLock()
+        self._collections = {}
+        os.makedirs(path, exist_ok=True)
+
+    # Collections and aliases
+
+    def _aliases(self) -> dict:
+        aliases_path = os.path.join(self.path, "aliases.json")
+        if not os.path.exists(aliases_path):
+            return {}
+        with open(aliases_path) as f:
+            return json.load(f)
+
+    def _save_aliases(self, aliases: dict):
+        tmp_path = os.path.join(self.path, "aliases.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(aliases, f)
+        os.replace(tmp_path, os.path.join(self.path, "aliases.json"))
+
+    def _names(self) -> List[str]:
+        return sorted(entry.name for entry in os.scandir(self.path) if entry.is_dir())
+
+    def _collection(self, collection_name: str) -> FlatCollection:
+        name = self._aliases().get(collection_name, collection_name)
+        with self.lock:
+            if name not in self._collections:
+                if not os.path.exists(os.path.join(self.path, name, "state.pkl")):
+                    raise ValueError(f"Collection {collection_name} not found")
+                self._collections[name] = FlatCollection(os.path.join(self.path, name))
+            return self._collections[name]
+
+    def get_collections(self):
+        return models.CollectionsResponse(collections=[models.CollectionDescription(name=name) for name in self._names()])
+
+    def collection_exists(self, collection_name: str) -> bool:
+        return collection_name in self._names()
+
+    def get_aliases(self):
+        return models.CollectionsAliasesResponse(aliases=[
+            models.AliasDescription(alias_name=alias, collection_name=name) for alias, name in self._aliases().items()
+        ])
+
+    def update_collection_aliases(self, change_aliases_operations, **kwargs):
+        with self.lock:
+            aliases = self._aliases()
+            for operation in change_aliases_operations:
+                if isinstance(operation, models.CreateAliasOperation):
+                    aliases[operation.create_alias.alias_name] = operation.create_alias.collection_name
+                elif isinstance(operation, models.DeleteAliasOperation):
+                    aliases.pop(operation.delete_alias.alias_name, None)
+                elif isinstance(operation, models.RenameAliasOperation):
+                    aliases[operation.rename_alias.new_alias_name] = aliases.pop(operation.rename_alias.old_alias_name)
+            self._save_aliases(aliases)
+        return True
+
+    def create_collection(self, collection_name: str, vectors_config: models.VectorParams, **kwargs):
+        with self.lock:
+            if self.collection_exists(collection_name):
+                raise ValueError(f"Collection {collection_name} already exists")
+            self._collections[collection_name] = FlatCollection(os.path.join(self.path, collection_name), dim=vectors_config.size)
+        return True
+
+    def delete_collection(self, collection_name: str, **kwargs):
+        with self.lock:
+            self._collections.pop(collection_name, None)
+            shutil.rmtree(os.path.join(self.path, collection_name), ignore_errors=True)
+        return True
+
+    def create_payload_index(self, *args, **kwargs):
+        # Filters are evaluated over cached payload columns; there is nothing to build
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    def update_collection(self, *args, **kwargs):
+        return True
+
+    def create_shard_key(self, *args, **kwargs):
+        raise NotImplementedError("The flat index has no sharding; use TENANCY_STRATEGY=payload or collection.")
+
+    # Points
+
+    def upsert(self, collection_name: str, points, **kwargs):
+        if isinstance(points, models.Batch):
+            ids, vectors, payloads = points.ids, points.vectors, points.payloads or [None] * len(points.ids)
+        else:
+            ids = [point.id for point in points]
+            vectors = [point.vector for point in points]
+            payloads = [point.payload for point in points]
+        if ids:
+            self._collection(collection_name).upsert(list(ids), vectors, list(payloads))
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    def delete(self, collection_name: str, points_selector, **kwargs):
+        collection = self._collection(collection_name)
+        with collection.lock:
+            if isinstance(points_selector, models.FilterSelector):
+                rows = np.flatnonzero(collection.filter_mask(points_selector.filter))
+            elif isinstance(points_selector, models.Filter):
+                rows = np.flatnonzero(collection.filter_mask(points_selector))
+            else:
+                point_ids = points_selector.points if isinstance(points_selector, models.PointIdsList) else points_selector
+                rows = np.asarray([collection.row_of[point_id] for point_id in point_ids if point_id in collection.row_of], dtype=np.int64)
+            collection.delete_rows(rows)
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    def count(self, collection_name: str, count_filter=None, **kwargs):
+        collection = self._collection(collection_name)
+        with collection.lock:
+            return models.CountResult(count=int(collection.filter_mask(count_filter).sum()))
+
+    def scroll(self, collection_name: str, scroll_filter=None, limit=10, offset=None, with_payload=True, with_vectors=False, **kwargs):
+        """Pages in insertion order; `offset` is the id of the first point of the next page, as in Qdrant."""
+        collection = self._collection(collection_name)
+        with collection.lock:
+            rows = np.flatnonzero(collection.filter_mask(scroll_filter))
+            if offset is not None:
+                start_row = collection.row_of.get(offset)
+                rows = rows[rows >= start_row] if start_row is not None else rows[:0]
+            page = rows[:limit]
+            next_offset = collection.ids[rows[limit]] if len(rows) > limit else None
+            return [collection.record(row, with_payload, with_vectors) for row in page], next_offset
+
+    def _query(self, collection, query, query_filter, search_params, limit, offset, with_payload, with_vectors, score_threshold):
+        if isinstance(query, models.NearestQuery):
+            query = query.nearest
+        exact = bool(search_params and search_params.exact)
+        hits = collection.search(np.asarray(query, dtype=np.float32), query_filter, limit, offset, score_threshold, exact=exact)[0]
+        return models.QueryResponse(points=[
+            models.ScoredPoint(
+                id=collection.ids[row], version=0, score=score,
+                payload=select_payload(collection.payloads[row], with_payload),
+                vector=collection.vectors[row].tolist() if with_vectors else None,
+            )
+            for row, score in hits
+        ])
+
+    def query_points(self, collection_name: str, query=None, query_filter=None, search_params=None, limit=10, offset=None,
+                     with_payload=True, with_vectors=False, score_threshold=None, **kwargs):
+        collection = self._collection(collection_name)
+        return self._query(collection, query, query_filter, search_params, limit, offset, with_payload, with_vectors, score_threshold)
+
+    def query_batch_points(self, collection_name: str, requests: List[models.QueryRequest], **kwargs):
+        """
+        Requests that share a filter, limit and offset are answered with a single matrix product.
+        """
+        collection = self._collection(collection_name)
+        responses = [None] * len(requests)
+        groups = {}
+        for index, request in enumerate(requests):
+            key = (request.filter.model_dump_json() if request.filter else None, request.limit or 10, request.offset or 0,
+                   bool(request.params and request.params.exact), request.score_threshold)
+            groups.setdefault(key, []).append(index)
+
+        for (_, limit, offset, exact, score_threshold), indexes in groups.items():
+            group = [requests[index] for index in indexes]
+            queries = np.asarray([r.query.nearest if isinstance(r.query, models.NearestQuery) else r.query for r in group], dtype=np.float32)
+            all_hits = collection.search(queries, group[0].filter, limit, offset, score_threshold, exact=exact)
+            for index, request, hits in zip(indexes, group, all_hits):
+                with_payload = True if request.with_payload is None else request.with_payload
+                responses[index] = models.QueryResponse(points=[
+                    models.ScoredPoint(
+                        id=collection.ids[row], version=0, score=score,
+                        payload=select_payload(collection.payloads[row], with_payload),
+                        vector=collection.vectors[row].tolist() if request.with_vector else None,
+                    )
+                    for row, score in hits
+                ])
+        return responses
+
+    def close(self, **kwargs):
+        for collection in self._collections.values():
+            with collection.lock:
+                collection._save()
@@ -0,0 +1,210 @@
+"""
+Deletion paths and a sweep that removes whatever the normal paths left behind.
+
+    python -m api.garbage_collector             # sweep and delete
+    python -m api.garbage_collector --dry-run   # report only
+
+`delete_file` / `delete_conversation_data` back the DELETE endpoints. They update the Redis
+manifest first, then remove the points, then the stored PDFs, so a failure part-way leaves
+only orphans that `collect_garbage` recognises on its next run:
+
+1. stored conversations without a Redis conversation are deleted from storage;
+2. every Redis manifest is reconciled with storage (see redis_ops.reconcile_conversation_files);
+3. points whose document is no longer in any manifest are deleted, in batches, from every
+   collection the tenancy strategy writes to.
+
+The manifests are read once up front, so Redis is checked again right before anything is
+deleted, and stored files or points written after the sweep started are never touched: those
+belong to uploads that are still in flight.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+from qdrant_client.http import models
+
+from api.qdrant_cloud_ops import connect_to_qdrant, EMBEDDING_DIM
+from api.reindex import scan_documents, document_filter
+from api.storage import get_storage, file_key
+from api.tenancy import get_tenancy, CONVERSATION_FIELD
+from api import redis_ops
+
+
+GC_DELETE_BATCH_SIZE = int(os.environ.get("GC_DELETE_BATCH_SIZE", 1000))
+
+# float32 vector per point; payload and index overhead come on top of this
+VECTOR_BYTES = EMBEDDING_DIM * 4
+
+
+def delete_points(client, collection_name, points_filter, shard_key=None, batch_size=GC_DELETE_BATCH_SIZE) -> int:
+    """
+    Delete every point matching `points_filter`, `batch_size` ids at a time, so a large
+    conversation never turns into one long blocking delete. Returns the number of points removed.
+    """
+    deleted = 0
+    while True:
+        points, _ = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=points_filter,
+            limit=batch_size,
+            with_payload=False,
+            with_vectors=False,
+            shard_key_selector=shard_key,
+        )
+        if not points:
+            return deleted
+        client.delete(
+            collection_name=collection_name,
+            points_selector=models.PointIdsList(points=[point.id for point in points]),
+            shard_key_selector=shard_key,
+            wait=True,
+        )
+        deleted += len(points)
+
+
+def _conversation_condition(conversation_id):
+    return models.FieldCondition(key=CONVERSATION_FIELD, match=models.MatchValue(value=conversation_id))
+
+
+async def delete_file(user_id, email, conversation_id, file_name, storage=None, client=None) -> dict:
+    storage = storage or get_storage()
+    client = client or connect_to_qdrant()
+
+    # Raises ValueError if the conversation does not exist
+    removed = await redis_ops.remove_conversation_file(user_id, conversation_id, file_name)
+
+    partition = get_tenancy().route(user_id, email)
+    points_filter = partition.filter(
+        _conversation_condition(conversation_id),
+        models.FieldCondition(key="metadata.pdf_id", match=models.MatchValue(value=file_name)),
+    )
+    points_deleted = await asyncio.to_thread(delete_points, client, partition.collection_name, points_filter, partition.shard_key)
+    bytes_freed = await storage.delete(file_key(user_id, conversation_id, file_name))
+
+    return {
+        "file_name": file_name,
+        "found": removed is not None or points_deleted > 0 or bytes_freed > 0,
+        "points_deleted": points_deleted,
+        "bytes_freed": bytes_freed,
+        "vector_bytes_freed": points_deleted * VECTOR_BYTES,
+    }
+
+
+async def delete_conversation_data(user_id, email, conversation_id, storage=None, client=None) -> dict:
+    storage = storage or get_storage()
+    client = client or connect_to_qdrant()
+
+    # Raises ValueError if the conversation does not exist
+    await redis_ops.fetch_conversation(user_id, conversation_id)
+    await redis_ops.delete_conversation(user_id, conversation_id)
+
+    partition = get_tenancy().route(user_id, email)
+    points_filter = partition.filter(_conversation_condition(conversation_id))
+    points_deleted = await asyncio.to_thread(delete_points, client, partition.collection_name, points_filter, partition.shard_key)
+    bytes_freed = await storage.delete_prefix(file_key(user_id, conversation_id))
+
+    return {
+        "conversation_id": conversation_id,
+        "points_deleted": points_deleted,
+        "bytes_freed": bytes_freed,
+        "vector_bytes_freed": points_deleted * VECTOR_BYTES,
+    }
+
+
+async def collect_garbage(client=None, storage=None, tenancy=None, dry_run=False) -> dict:
+    client = client or connect_to_qdrant()
+    storage = storage or get_storage()
+    tenancy = tenancy or get_tenancy()
+    started = time.perf_counter()
+    started_at = time.time()
+
+    report = {
+        "dry_run": dry_run,
+        "conversations_removed": 0,
+        "manifest_entries_removed": 0,
+        "manifest_entries_added": 0,
+        "documents_removed": 0,
+        "points_deleted": 0,
+        "bytes_freed": 0,
+    }
+
+    manifests = await redis_ops.fetch_all_conversation_manifests()
+
+    # 1. Stored conversations Redis no longer knows about
+    for user_id in await storage.list_dirs():
+        for conversation_id in await storage.list_dirs(user_id):
+            if conversation_id in manifests.get(user_id, {}):
+                continue
+            prefix = file_key(user_id, conversation_id)
+            stored = await storage.list(prefix)
+            if any(info["modified"].timestamp() >= started_at for info in stored.values()):
+                continue
+            if await redis_ops.conversation_exists(user_id, conversation_id):
+                continue
+            if dry_run:
+                report["bytes_freed"] += sum(info["size_bytes"] for info in stored.values())
+            else:
+                report["bytes_freed"] += await storage.delete_prefix(prefix)
+            report["conversations_removed"] += 1
+
+    # 2. Manifest entries vs. stored files
+    for user_id, conversations in manifests.items():
+        for conversation_id, files in conversations.items():
+            stored = await storage.list(file_key(user_id, conversation_id))
+            if dry_run:
+                removed = [name for name in files if name not in stored]
+                added = [name for name in stored if name not in files]
+            else:
+                result = await redis_ops.reconcile_conversation_files(user_id, conversation_id, storage, force=True)
+                removed, added = result.get("removed", []), result.get("added", [])
+            for name in removed:
+                files.pop(name, None)
+            for name in added:
+                files[name] = {"status": "unindexed"}
+            report["manifest_entries_removed"] += len(removed)
+            report["manifest_entries_added"] += len(added)
+
+    # 3. Points whose document is in no manifest. Stored files are always in the manifest after
+    # step 2, and documents indexed since the sweep started are skipped, so points of an upload
+    # that is still being indexed are kept.
+    for collection_name in tenancy.collections():
+        documents = await asyncio.to_thread(scan_documents, client, collection_name)
+        for doc in documents.values():
+            if doc["pdf_id"] in manifests.get(doc["user_id"], {}).get(doc["conversation_id"], {}):
+                continue
+            if doc["indexed_at"] >= started_at:
+                continue
+            if doc["pdf_id"] in await redis_ops.fetch_conversation_files(doc["user_id"], doc["conversation_id"]):
+                continue
+            if dry_run:
+                report["points_deleted"] += doc["points"]
+            else:
+                report["points_deleted"] += await asyncio.to_thread(delete_points, client, collection_name, document_filter(doc))
+            report["documents_removed"] += 1
+
+    report["vector_bytes_freed"] = report["points_deleted"] * VECTOR_BYTES
+    report["duration_s"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+async def run(dry_run=False):
+    await redis_ops.initialize_redis()
+    try:
+        report = await collect_garbage(dry_run=dry_run)
+    finally:
+        await redis_ops.close_redis_connection()
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be removed without deleting anything.")
+    args = parser.parse_args()
+    asyncio.run(run(dry_run=args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
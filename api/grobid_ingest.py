@@ -0,0 +1,211 @@
+import os
+import asyncio
+import xml.etree.ElementTree as ET
+
+import httpx
+from dotenv import load_dotenv
+
+from api.chunking import Chunk, ChunkedDocument, default_chunker
+
+
+load_dotenv()
+
+# "pymupdf" (layout heuristics, default) or "grobid" (TEI from a GROBID service)
+INGESTION_MODE = os.environ.get("INGESTION_MODE", "pymupdf").lower()
+INGESTION_MODES = ("pymupdf", "grobid")
+
+# Point GROBID_URL at api/extras/grobid_stub.py to run without a real GROBID server
+GROBID_URL = os.environ.get("GROBID_URL", "http://localhost:8070").rstrip("/")
+GROBID_MAX_CONCURRENCY = int(os.environ.get("GROBID_MAX_CONCURRENCY", 4))
+GROBID_TIMEOUT = float(os.environ.get("GROBID_TIMEOUT", 120))
+GROBID_MAX_RETRIES = int(os.environ.get("GROBID_MAX_RETRIES", 3))
+GROBID_CACHE_DIR = os.environ.get("GROBID_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "grobid_cache"))
+
+# Relative weight stored with each chunk so retrieval can favour abstracts over reference lists
+TEI_CHUNK_WEIGHTS = {
+    "title": 1.0,
+    "abstract": 1.3,
+    "section": 1.0,
+    "reference": 0.4,
+}
+
+TEI_NS = "{http://www.tei-c.org/ns/1.0}"
+
+# Recorded in point payloads alongside api.chunking.CHUNKER_VERSION
+GROBID_CHUNKER_VERSION = "grobid-tei-v1"
+
+_grobid_client = None
+_grobid_semaphore = None
+
+
+def get_grobid_client():
+    global _grobid_client, _grobid_semaphore
+    if _grobid_client is None:
+        _grobid_client = httpx.AsyncClient(
+            base_url=GROBID_URL,
+            timeout=GROBID_TIMEOUT,
+            limits=httpx.Limits(max_connections=GROBID_MAX_CONCURRENCY),
+        )
+        # GROBID answers 503 when its own pool is exhausted; don't queue more than it can take
+        _grobid_semaphore = asyncio.Semaphore(GROBID_MAX_CONCURRENCY)
+    return _grobid_client
+
+
+async def close_grobid_client():
+    global _grobid_client
+    if _grobid_client is not None:
+        await _grobid_client.aclose()
+        _grobid_client = None
+
+
+def tei_cache_path(content_hash: str) -> str:
+    return os.path.join(GROBID_CACHE_DIR, f"{content_hash}.tei.xml")
+
+
+async def fetch_tei(file_path: str, content_hash: str) -> str:
+    """
+    Return the path of the TEI for a PDF, calling GROBID only if this content hash has not
+    been processed before. The response is streamed straight into the cache file.
+    """
+    cached_path = tei_cache_path(content_hash)
+    if os.path.exists(cached_path):
+        return cached_path
+
+    os.makedirs(GROBID_CACHE_DIR, exist_ok=True)
+    client = get_grobid_client()
+    tmp_path = f"{cached_path}.part"
+
+    async with _grobid_semaphore:
+        for attempt in range(GROBID_MAX_RETRIES + 1):
+            with open(file_path, "rb") as pdf_file:
+                async with client.stream(
+                    "POST",
+                    "/api/processFulltextDocument",
+                    files={"input": (os.path.basename(file_path), pdf_file, "application/pdf")},
+                    data={
+                        "consolidateHeader": "1",
+                        "includeRawCitations": "1",
+                        "segmentSentences": "0",
+                        "teiCoordinates": ["head", "p", "s", "biblStruct"],
+                    },
+                ) as response:
+                    if response.status_code == 503 and attempt < GROBID_MAX_RETRIES:
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    if response.status_code != 200:
+                        body = (await response.aread()).decode(errors="ignore")[:500]
+                        raise RuntimeError(f"GROBID returned {response.status_code}: {body}")
+
+                    with open(tmp_path, "wb") as tei_file:
+                        async for data in response.aiter_bytes():
+                            tei_file.write(data)
+            break
+
+    os.replace(tmp_path, cached_path)
+    return cached_path
+
+
+def _local(tag: str) -> str:
+    return tag[len(TEI_NS):] if tag.startswith(TEI_NS) else tag.split("}")[-1]
+
+
+def _text(elem) -> str:
+    return " ".join("".join(elem.itertext()).split())
+
+
+def _page(elem, default: int) -> int:
+    """First page number found in a GROBID `coords` attribute ("page,x,y,w,h;...")."""
+    for node in elem.iter():
+        coords = node.get("coords")
+        if coords:
+            try:
+                return int(coords.split(",", 1)[0])
+            except ValueError:
+                break
+    return default
+
+
+def parse_tei(tei_path: str, chunker=default_chunker) -> ChunkedDocument:
+    """
+    Stream a GROBID TEI document with iterparse and turn it into title, abstract, section and
+    reference chunks. Elements are cleared as soon as they are consumed, so memory stays flat
+    even for long papers with large bibliographies.
+    """
+    title = None
+    abstract = []
+    sections = []  # (head, [(text, page)])
+    references = []
+    current_head = None
+    current_paragraphs = []
+    last_page = 1
+    surfaces = 0
+
+    stack = []
+    for event, elem in ET.iterparse(tei_path, events=("start", "end")):
+        tag = _local(elem.tag)
+
+        if event == "start":
+            stack.append(tag)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+
+        if tag == "title" and "titleStmt" in stack and title is None:
+            title = _text(elem) or None
+
+        elif tag == "p" and "abstract" in stack:
+            text = _text(elem)
+            if text:
+                abstract.append((text, _page(elem, 1)))
+            elem.clear()
+
+        elif tag == "head" and parent == "div" and "body" in stack:
+            current_head = _text(elem) or None
+            last_page = _page(elem, last_page)
+
+        elif tag == "p" and "body" in stack and "figure" not in stack:
+            text = _text(elem)
+            if text:
+                last_page = _page(elem, last_page)
+                current_paragraphs.append((text, last_page))
+            elem.clear()
+
+        elif tag == "div" and parent == "body":
+            if current_paragraphs:
+                sections.append((current_head, current_paragraphs))
+            current_head, current_paragraphs = None, []
+            elem.clear()
+
+        elif tag == "biblStruct" and "listBibl" in stack:
+            text = _text(elem)
+            if text:
+                references.append((text, _page(elem, last_page)))
+            elem.clear()
+
+        elif tag == "figure":
+            elem.clear()
+
+        elif tag == "surface" and parent == "facsimile":
+            # One <surface> per page when coordinates are requested
+            surfaces += 1
+
+    chunks = []
+    if title:
+        chunks.append(Chunk(
+            text=title, page_start=1, page_end=1, section="Title", token_count=chunker.count_tokens(title),
+            chunk_type="title", weight=TEI_CHUNK_WEIGHTS["title"],
+        ))
+    if abstract:
+        chunks.extend(chunker.chunk_section("Abstract", abstract, "abstract", TEI_CHUNK_WEIGHTS["abstract"]))
+    for head, paragraphs in sections:
+        chunks.extend(chunker.chunk_section(head, paragraphs, "section", TEI_CHUNK_WEIGHTS["section"]))
+    if references:
+        chunks.extend(chunker.chunk_section("References", references, "reference", TEI_CHUNK_WEIGHTS["reference"]))
+
+    return ChunkedDocument(page_count=surfaces or last_page, chunks=chunks)
+
+
+async def grobid_chunk_file(file_path: str, content_hash: str) -> ChunkedDocument:
+    tei_path = await fetch_tei(file_path, content_hash)
+    return await asyncio.to_thread(parse_tei, tei_path)
@@ -1,30 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Response, Request, Query, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Response, Request, Query, status, WebSocket, WebSocketDisconnect, BackgroundTasks
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel
+import msgpack
 from uuid import uuid4
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from qdrant_client import QdrantClient
+import asyncio
+from contextlib import asynccontextmanager
 
 from langchain_core.messages import HumanMessage, BaseMessage, AIMessage, ToolMessage
 
 from typing import List
 
-from api.qdrant_cloud_ops import process_pdfs, qclient_, EMBEDDING_MODEL
+from api.qdrant_cloud_ops import process_pdfs, connect_to_qdrant, get_embedding_model, embed_queries, COLLECTION_NAME
 
 # sql_ops imports
-from api.sql_ops import init_db, create_user, get_user_by_email, verify_password, generate_jwt_token, validate_password_strength, get_user_by_id
+from api.sql_ops import init_db, close_db, ping_db, create_user, get_user_by_email, averify_password, generate_jwt_token, validate_password_strength, get_user_by_id
 from fastapi.responses import JSONResponse
 from api.pydantic_models import *
 
-from api.chat_handlers import assign_chat_topic_chain, llm, react_agent
+from api.chat_handlers import get_react_agent, get_rewoo_agent
+from api.topic_assigner import topic_assigner, assign_topic_later, TOPIC_ASSIGNMENT_MODE, PENDING_TOPIC
 
 from fastapi.security import OAuth2PasswordBearer
 
@@ -43,24 +43,59 @@ import re
 import traceback
 
 
-from api.redis_ops import add_conversation, initialize_redis, close_redis_connection, fetch_user_conversations, fetch_conversation, update_conversation_files
+from api.redis_ops import add_conversation, initialize_redis, close_redis_connection, ping_redis, fetch_user_conversations, fetch_conversation, update_conversation_files, fetch_conversation_files, reconcile_conversation_files
 
 
-from fastapi.responses import FileResponse
+from api.storage import get_storage, file_key
+from api.grobid_ingest import INGESTION_MODES, close_grobid_client
+from api.web_scraper import close_web_scraper
+from api.arxiv_cache import ingest_arxiv_papers
+from api.collection_config import search_params
+from api.tenancy import get_tenancy, route_user
+from api.garbage_collector import delete_file, delete_conversation_data
+from api.vector_cache import search_conversation, CONVERSATION_FIELD
+from qdrant_client.http import models
+from api.retrieval_payload import apply_chunk_weights, payload_fields, point_to_result, search_limit
+from api.services import services
+from api.llm_gateway import gateway
+from api.telemetry import span, observe_request, tool_spans, render_metrics, shutdown_telemetry, enabled as telemetry_enabled
 
 load_dotenv()
 
 # Services
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
 ALGORITHM = "HS256"
-EMBEDDING_MODEL = EMBEDDING_MODEL
-COLLECTION_NAME = 'aireas-cloud'
-qdrant_client = qclient_
 APIS = os.path.join(os.getcwd(), 'api')
 
+# Default agent for /api/llm_chat: "react" (tool-calling loop) or "rewoo" (plan once, gather evidence in parallel, solve once)
+AGENT_MODE = os.environ.get('AGENT_MODE', 'react').lower()
+AGENT_MODES = ('react', 'rewoo')
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    print('\nStarted SQL db')
+    await initialize_redis()
+
+    # Qdrant, the embedding model and the LLMs are built on first use (see api/services.py);
+    # SERVICES_WARMUP ones are built in the background so startup does not wait on the network
+    warmup = asyncio.create_task(services.warm())
+    try:
+        yield
+    finally:
+        warmup.cancel()
+        await close_grobid_client()
+        await close_web_scraper()
+        await close_db()
+        await close_redis_connection()
+        await services.aclose()
+        gateway.close()
+        shutdown_telemetry()
+
 
 # Initialize FastAPI
-app = FastAPI(docs_url="/api/docs", openapi_url="/api/openapi.json", debug=True)
+app = FastAPI(docs_url="/api/docs", openapi_url="/api/openapi.json", debug=True, lifespan=lifespan)
 
 # Set up CORS
 app.add_middleware(
@@ -71,6 +106,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request spans and the request-duration histogram (see api/telemetry.py); not installed when both are off
+if telemetry_enabled():
+    app.middleware("http")(observe_request)
+
 
 
 
@@ -127,20 +166,65 @@ async def global_exception_handler(request: Request, exc: Exception):
 # app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 
-# Initialize the sql database at startup
-@app.on_event("startup")
-async def sql_startup_event():
-    await init_db()
-    print('\nStarted SQL db')
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_CHECK_TIMEOUT_SECONDS', 2))
+
+
+def require_qdrant():
+    client = connect_to_qdrant()
+    if client is None:
+        raise HTTPException(status_code=503, detail="Vector store unavailable.")
+    return client
+
+
+@app.get("/api/health/live")
+async def liveness():
+    """The worker is up and serving; says nothing about its dependencies."""
+    return {"status": "ok"}
 
-# Initialize the redis database at startup
-@app.on_event("startup")
-async def redis_startup_event():
-    await initialize_redis()
 
-@app.on_event("shutdown")
-async def redis_shutdown_event():
-    await close_redis_connection()
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage and request durations."""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (set METRICS_ENABLED and install prometheus_client).")
+    body, content_type = rendered
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/api/health/llm")
+async def llm_metrics():
+    """Per-model LLM gateway counters: queueing, rate-limit waits, latency and token usage."""
+    return gateway.metrics()
+
+
+@app.get("/api/health/ready")
+async def readiness():
+    """
+    Whether this worker can serve traffic: the database, Redis and Qdrant must answer within
+    HEALTH_CHECK_TIMEOUT_SECONDS. Responds 503 otherwise, and reports which lazily built
+    services exist so far.
+    """
+    async def check_qdrant():
+        client = await asyncio.to_thread(connect_to_qdrant)
+        if client is None:
+            raise RuntimeError("Qdrant is not reachable.")
+        await asyncio.to_thread(client.get_collections)
+
+    checks = {"database": ping_db, "redis": ping_redis, "qdrant": check_qdrant}
+    results = {}
+    for name, check in checks.items():
+        try:
+            await asyncio.wait_for(check(), timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+            results[name] = "ok"
+        except Exception as e:
+            results[name] = f"error: {type(e).__name__}: {e}"
+
+    ready = all(result == "ok" for result in results.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "unavailable", "checks": results, "services": services.status()},
+    )
 
 
 def get_authenticated_user(request: Request):
@@ -171,34 +255,33 @@ def get_authenticated_user(request: Request):
 
 
 @app.post("/api/upload/{conversation_id}")
-async def upload_files(conversation_id: str, files: List[UploadFile] = File(...), current_user: dict = Depends(get_authenticated_user)):
+async def upload_files(conversation_id: str, files: List[UploadFile] = File(...), ingestion_mode: str = Query(None), current_user: dict = Depends(get_authenticated_user)):
     """
     Upload and process PDF files for the current authenticated user.
+    `ingestion_mode` ("pymupdf" or "grobid") overrides the server default for this upload.
     """
     try:
+        if ingestion_mode is not None and ingestion_mode not in INGESTION_MODES:
+            raise HTTPException(status_code=400, detail=f"ingestion_mode must be one of {', '.join(INGESTION_MODES)}.")
+
         user_id = current_user.get("user_id")
         email = current_user.get("email")  # Assuming email is in the user dict
 
         if not user_id or not email:
             raise HTTPException(status_code=401, detail="User authentication failed.")
 
-        # Define the user's directory
-        user_storage_base = os.path.join(APIS, "users_storage")
-        user_dir = os.path.join(user_storage_base, user_id)
-        conversation_dir = os.path.join(user_dir, conversation_id)
-
-        os.makedirs(conversation_dir, exist_ok=True)
-
         # Process uploaded files
         result = await process_pdfs(
             files=files,
-            qclient_=qclient_,
-            collection_name="aireas-cloud",
-            emb_model=EMBEDDING_MODEL,
+            qclient_=await asyncio.to_thread(require_qdrant),
+            collection_name=COLLECTION_NAME,
+            emb_model=get_embedding_model(),
             user_id=user_id,
             email=email,
-            conversation_dir=conversation_dir,
-            conversation_id=conversation_id
+            conversation_id=conversation_id,
+            storage=get_storage(),
+            ingestion_mode=ingestion_mode,
+            partition=await asyncio.to_thread(route_user, user_id, email),
         )
 
         # Debugging: Print the result to inspect
@@ -225,10 +308,31 @@ async def upload_files(conversation_id: str, files: List[UploadFile] = File(...)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 
+@app.post("/api/upload_arxiv/{conversation_id}")
+async def upload_arxiv_papers(conversation_id: str, request: ArxivIngest, current_user: dict = Depends(get_authenticated_user)):
+    """
+    Add arXiv papers to a conversation by ID; they are downloaded and processed like uploaded PDFs.
+    """
+    if request.ingestion_mode is not None and request.ingestion_mode not in INGESTION_MODES:
+        raise HTTPException(status_code=400, detail=f"ingestion_mode must be one of {', '.join(INGESTION_MODES)}.")
+    try:
+        result = await ingest_arxiv_papers(request.arxiv_ids, current_user["user_id"], current_user.get("email"), conversation_id, request.ingestion_mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if not result["uploaded_files"]:
+        raise HTTPException(status_code=400, detail=f"No papers were added. Skipped: {', '.join(result['skipped'])}")
+    return {"message": "Papers added to the conversation.", "details": result["uploaded_files"], "skipped": result["skipped"]}
+
+
 @app.get("/api/get_uploaded_files/{conversation_id}")
-async def get_uploaded_files(conversation_id: str, current_user: dict = Depends(get_authenticated_user)):
+async def get_uploaded_files(conversation_id: str, background_tasks: BackgroundTasks, current_user: dict = Depends(get_authenticated_user)):
     """
     Retrieve uploaded files for a specific conversation and the current authenticated user.
+
+    Served from the Redis file manifest; syncing the manifest with disk happens in a
+    throttled background task after the response is sent.
     """
     try:
         # Retrieve user-specific details
@@ -236,26 +340,16 @@ async def get_uploaded_files(conversation_id: str, current_user: dict = Depends(
         if not user_id:
             raise HTTPException(status_code=401, detail="User authentication failed.")
 
-        # Define the conversation-specific directory
-        user_storage_base = os.path.join(APIS, "users_storage")
-        user_dir = os.path.join(user_storage_base, user_id)
-        conversation_dir = os.path.join(user_dir, conversation_id)
+        background_tasks.add_task(reconcile_conversation_files, user_id, conversation_id, get_storage())
 
-        # Check if the directory exists
-        if not os.path.exists(conversation_dir):
-            return JSONResponse(content={"files": [], "message": "No files found for this conversation."}, status_code=200)
-
-        # Retrieve all files within the conversation directory
-        files = [
-            file for file in os.listdir(conversation_dir) if os.path.isfile(os.path.join(conversation_dir, file))
-        ]
+        files = await fetch_conversation_files(user_id, conversation_id)
 
         if not files:
             return JSONResponse(content={"files": [], "message": "No files found for this conversation."}, status_code=200)
 
-        # Prepare a detailed response with file paths
+        # Prepare a detailed response with the manifest metadata
         file_details = [
-            {"file_name": file, "file_path": os.path.join(conversation_dir, file)} for file in files
+            {"file_name": file_name, **file_info} for file_name, file_info in sorted(files.items())
         ]
 
         return JSONResponse(content={"files": file_details, "message": "Files retrieved successfully."}, status_code=200)
@@ -268,34 +362,123 @@ async def get_uploaded_files(conversation_id: str, current_user: dict = Depends(
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 
+class MsgpackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def compact_response(request: Request, content) -> Response:
+    """MessagePack when the client accepts it, otherwise JSON encoded with orjson."""
+    if any(media_type in request.headers.get("accept", "") for media_type in MSGPACK_MEDIA_TYPES):
+        return MsgpackResponse(content)
+    return ORJSONResponse(content)
+
+
 @app.post('/api/retrieve')
-def retrieve(query_request: QueryRequest, current_user: dict = Depends(get_authenticated_user)):
-    """Retrieves relevant PDF information based on the query."""
+def retrieve(query_request: QueryRequest, request: Request, current_user: dict = Depends(get_authenticated_user)):
+    """
+    Retrieves relevant PDF information based on the query.
+
+    Only the payload fields a result needs are fetched. `text` selects the full chunk text, a
+    snippet around the query terms with match offsets, or none. Send `Accept: application/msgpack`
+    for a MessagePack response.
+    """
     try:
+        qdrant_client = require_qdrant()
+
         # Get the embeddings for the query
-        query_embeddings = EMBEDDING_MODEL.embed_query(query_request.query)
+        with span("embedding.embed_query"):
+            query_embeddings = get_embedding_model().embed_query(query_request.query)
+
+        # Query points from the user's partition only
+        partition = get_tenancy().route(current_user["user_id"], current_user.get("email"))
+        with span("qdrant.search", collection=partition.collection_name, limit=query_request.top_k):
+            if query_request.conversation_id:
+                # Small, hot scope: usually answered from the in-process vector cache
+                points = search_conversation(
+                    qdrant_client, partition, query_request.conversation_id, query_embeddings,
+                    limit=search_limit(query_request.top_k), with_payload=payload_fields(query_request.text), params=search_params(),
+                )
+            else:
+                points = qdrant_client.query_points(
+                    **partition.query_kwargs(),
+                    query=query_embeddings,
+                    with_payload=payload_fields(query_request.text),
+                    limit=search_limit(query_request.top_k),
+                    search_params=search_params(),
+                ).points
+            points = apply_chunk_weights(points, query_request.top_k)
+
+        results = [point_to_result(point, query_request.query, query_request.text) for point in points]
+        return compact_response(request, {"points": results})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+RETRIEVE_BATCH_MAX_QUERIES = int(os.environ.get('RETRIEVE_BATCH_MAX_QUERIES', 64))
+RETRIEVE_MAX_TOP_K = int(os.environ.get('RETRIEVE_MAX_TOP_K', 50))
+
+
+def batch_query_filter(partition, query: BatchQuery):
+    conditions = []
+    if query.conversation_id:
+        conditions.append(models.FieldCondition(key=CONVERSATION_FIELD, match=models.MatchValue(value=query.conversation_id)))
+    if query.pdf_ids:
+        conditions.append(models.FieldCondition(key="metadata.pdf_id", match=models.MatchAny(any=[os.path.basename(pdf_id).lower() for pdf_id in query.pdf_ids])))
+    return partition.filter(*conditions)
 
-        # Query points from Qdrant
-        search_result = qdrant_client.query_points(
-            collection_name=COLLECTION_NAME,
-            query=query_embeddings,
-            with_payload=True,
-            limit=query_request.top_k,
-        )
 
-        # Extracting necessary details
-        results = []
-        if hasattr(search_result, 'points'):
-            for point in search_result.points:  # Access the points attribute
-                results.append({
-                    "id": point.id,
-                    "score": point.score,
-                    "pdf_id": point.payload.get('pdf_id', 'N/A'),  # Use get to avoid KeyError
-                    "text": point.payload.get('text', 'N/A'),
-                })
+@app.post('/api/retrieve/batch')
+def retrieve_batch(batch: BatchQueryRequest, request: Request, current_user: dict = Depends(get_authenticated_user)):
+    """
+    Several retrievals in one request: the queries are embedded in one call and searched with one
+    query_batch_points call. Each query has its own top_k, conversation/document filter and
+    text mode (see /api/retrieve). Results come back in the order of `queries`.
+    """
+    if not batch.queries:
+        raise HTTPException(status_code=400, detail="No queries given.")
+    if len(batch.queries) > RETRIEVE_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {RETRIEVE_BATCH_MAX_QUERIES} queries per batch.")
+    if any(not 1 <= query.top_k <= RETRIEVE_MAX_TOP_K for query in batch.queries):
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {RETRIEVE_MAX_TOP_K}.")
+    try:
+        qdrant_client = require_qdrant()
+        with span("embedding.embed_queries", batch_size=len(batch.queries)):
+            vectors = embed_queries(get_embedding_model(), [query.query for query in batch.queries])
+
+        partition = get_tenancy().route(current_user["user_id"], current_user.get("email"))
+        with span("qdrant.search_batch", collection=partition.collection_name, batch_size=len(batch.queries)):
+            responses = qdrant_client.query_batch_points(
+                collection_name=partition.collection_name,
+                requests=[
+                    models.QueryRequest(
+                        query=vector,
+                        filter=batch_query_filter(partition, query),
+                        limit=search_limit(query.top_k),
+                        with_payload=payload_fields(query.text),
+                        params=search_params(),
+                        shard_key=partition.shard_key,
+                    )
+                    for query, vector in zip(batch.queries, vectors)
+                ],
+            )
 
-        return {"points": results}
+        results = [
+            {"query": query.query, "points": [point_to_result(point, query.query, query.text) for point in apply_chunk_weights(response.points, query.top_k)]}
+            for query, response in zip(batch.queries, responses)
+        ]
+        return compact_response(request, {"results": results})
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -339,7 +522,7 @@ async def signup(user: UserCreate):
 async def login(user: UserLogin, response: Response):
     try:
         db_user = await get_user_by_email(user.email.strip().lower())
-        if db_user is None or not verify_password(user.password, db_user.password):
+        if db_user is None or not await averify_password(user.password, db_user.password):
             raise HTTPException(status_code=401, detail="Invalid email or password.")
 
         token = generate_jwt_token(user_id=db_user.user_id, email=db_user.email)
@@ -384,9 +567,13 @@ async def logout(response: Response):
 
 
 @app.post('/api/add_conversation')
-async def add_conversation_route(request: AssignTopic, current_user: dict = Depends(get_authenticated_user)):
+async def add_conversation_route(request: AssignTopic, background_tasks: BackgroundTasks, current_user: dict = Depends(get_authenticated_user)):
     """
     API route to add a conversation.
+
+    The topic comes from the topic cache or the local classifier when they can tell, and from
+    the small topic model otherwise. With TOPIC_ASSIGNMENT_MODE=background the model runs after
+    the response and `topic_pending` tells the client to refetch the conversation.
     """
     try:
         
@@ -404,16 +591,23 @@ async def add_conversation_route(request: AssignTopic, current_user: dict = Depe
         if not name.strip() or not description.strip():
             raise HTTPException(status_code=400, detail="Both conversation_name and conversation_description are required.")
 
-        assigned_topic = assign_chat_topic_chain.invoke(description)
+        assigned_topic = await topic_assigner.local(description)
+        topic_pending = assigned_topic is None and TOPIC_ASSIGNMENT_MODE == "background"
+        if assigned_topic is None and not topic_pending:
+            assigned_topic = await topic_assigner.from_model(description)
 
         # Add conversation to Redis
-        result = await add_conversation(user_id, email, name, description, assigned_topic)
+        result = await add_conversation(user_id, email, name, description, assigned_topic or PENDING_TOPIC)
+
+        if topic_pending:
+            background_tasks.add_task(assign_topic_later, user_id, result["conversation_id"], description)
 
         # Return success message
         return {
             "message": "Conversation added successfully",
             "conversation_id": result["conversation_id"],
-            "assigned_topic": assigned_topic
+            "assigned_topic": assigned_topic or PENDING_TOPIC,
+            "topic_pending": topic_pending,
         }
 
     except HTTPException as e:
@@ -444,20 +638,45 @@ async def get_conversation(conversation_id: str,  current_user: str = Depends(ge
     return await fetch_conversation(user_id=user_id, conversation_id=conversation_id)
 
 
+@app.delete("/api/conversations/{conversation_id}")
+async def delete_conversation_route(conversation_id: str, current_user: dict = Depends(get_authenticated_user)):
+    """
+    Delete a conversation together with its stored PDFs and their vectors.
+    """
+    try:
+        report = await delete_conversation_data(current_user["user_id"], current_user.get("email"), conversation_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"message": "Conversation deleted.", **report}
+
+
+@app.delete("/api/conversations/{conversation_id}/files/{file_name}")
+async def delete_file_route(conversation_id: str, file_name: str, current_user: dict = Depends(get_authenticated_user)):
+    """
+    Delete one uploaded PDF from a conversation, including its vectors.
+    """
+    file_name = os.path.basename(file_name).lower()
+    try:
+        report = await delete_file(current_user["user_id"], current_user.get("email"), conversation_id, file_name)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not report["found"]:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"message": "File deleted.", **report}
+
+
 @app.get("/api/view_pdf/{conversation_id}/{file_name}")
-async def view_pdf(conversation_id: str, file_name: str, current_user: dict = Depends(get_authenticated_user)):
+async def view_pdf(conversation_id: str, file_name: str, request: Request, current_user: dict = Depends(get_authenticated_user)):
     user_id = current_user.get('user_id')
-    selected_file_path = os.path.join(APIS, 'users_storage', user_id, conversation_id, file_name)
+    file_name = os.path.basename(file_name)
+    storage = get_storage()
+    storage_key = file_key(user_id, conversation_id, file_name)
 
-    if not os.path.exists(selected_file_path):
+    if not await storage.exists(storage_key):
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Use FileResponse and specify headers for inline display
-    return FileResponse(
-        selected_file_path,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f'inline; filename="{file_name}"'}
-    )
+    # Range requests, ETag/Last-Modified and 304s for incremental PDF.js loading
+    return await storage.pdf_response(request, storage_key, file_name)
 
 
 async def get_authenticated_user_websocket(websocket: WebSocket):
@@ -486,44 +705,88 @@ async def get_authenticated_user_websocket(websocket: WebSocket):
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
+async def stream_rewoo(websocket: WebSocket, rewoo_agent, user_query: str, history: List[BaseMessage], config: dict):
+    try:
+        async for event in rewoo_agent.astream(user_query, history, config=config):
+            if event["type"] == "plan":
+                await websocket.send_text(f"Plan:\n{event['plan'].strip()}")
+            elif event["type"] == "step_start":
+                step = event["step"]
+                await websocket.send_text(f"Calling tool: {step.tool}\nTool arguments: {step.input}")
+            elif event["type"] == "step_done":
+                # Figures from python_repl steps, as in the ReAct loop below
+                artifact = event["result"].artifact
+                for image in (artifact.get("images", []) if isinstance(artifact, dict) else []):
+                    await websocket.send_text(f"data:image/png;base64,{image}")
+            elif event["type"] == "answer":
+                await websocket.send_text(event["answer"])
+                history.extend([HumanMessage(content=user_query), AIMessage(content=event["answer"])])
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        # A failed turn (planner or solver call, gateway limits) must not take the connection down
+        message = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        print(f"ReWOO turn failed: {message}")
+        await websocket.send_text(f"Sorry, I could not answer that ({message}). Please try again.")
+
+
 @app.websocket("/api/llm_chat/{conversation_id}")
-async def websocket_llm_chat(conversation_id: str, websocket: WebSocket, current_user: dict = Depends(get_authenticated_user_websocket)):
+async def websocket_llm_chat(conversation_id: str, websocket: WebSocket, mode: str = Query(None), current_user: dict = Depends(get_authenticated_user_websocket)):
+    """
+    Chat with the research agent. `mode` ("react" or "rewoo") overrides AGENT_MODE for this connection.
+    """
     user_id = current_user.get('user_id')
-    config = {"configurable": {'user_id': user_id ,"conversation_id": conversation_id}}
+    # The ReAct agent's checkpointer keeps each conversation's messages under its thread_id
+    config = {"configurable": {'user_id': user_id, 'email': current_user.get('email'), "conversation_id": conversation_id,
+                               "thread_id": f"{user_id}:{conversation_id}"},
+              # Tool calls of either agent are traced (see api/telemetry.py)
+              "callbacks": [tool_spans]}
+    mode = (mode or AGENT_MODE).lower()
     await websocket.accept()
     try:
+        if mode not in AGENT_MODES:
+            await websocket.send_text(f"Unknown agent mode '{mode}'; expected one of {', '.join(AGENT_MODES)}.")
+            await websocket.close(code=1008)
+            return
+
+        if mode == 'rewoo':
+            rewoo_agent = await asyncio.to_thread(get_rewoo_agent)
+            history = []
+        else:
+            react_agent = await asyncio.to_thread(get_react_agent)
         await websocket.send_text("Connected to LLM WebSocket! Start sending your queries.")
 
-        seen_tool_calls = set()
-
         while True:
             user_query = await websocket.receive_text()
 
-            query = {'messages': [HumanMessage(content=user_query)]}
-
-            async for event in react_agent.astream(query, stream_mode='values', config=config):
-                if 'messages' not in event:
+            # One trace per question: the LLM and tool spans of the turn nest under it
+            with span("chat.turn", mode=mode):
+                if mode == 'rewoo':
+                    # The ReWOO agent has no checkpointer; the connection keeps the conversation for the planner
+                    await stream_rewoo(websocket, rewoo_agent, user_query, history, config)
                     continue
 
-                for msg in event['messages']:
-                    if isinstance(msg, HumanMessage):
-                        continue
-
-                    elif isinstance(msg, AIMessage) and not msg.content:
-                        tool_calls = msg.additional_kwargs['tool_calls']
-
-                        for tool_call in tool_calls:
-                            tool_name = tool_call['function']['name']
-                            args = tool_call['function']['arguments']
-
-                            tool_call_id = (tool_name, str(args))
-                            if tool_call_id not in seen_tool_calls:
-                                seen_tool_calls.add(tool_call_id)
-                                await websocket.send_text(f"Calling tool: {tool_name}\nTool arguments: {args}")
-
-                    elif isinstance(msg, AIMessage):
-                        if msg.content:
-                            await websocket.send_text(msg.content)
+                query = {'messages': [HumanMessage(content=user_query)]}
+
+                # Each update holds only the messages one node just added, so earlier turns
+                # restored by the checkpointer are never sent again
+                async for update in react_agent.astream(query, stream_mode='updates', config=config):
+                    for node_update in update.values():
+                        for msg in (node_update or {}).get('messages', []):
+                            if isinstance(msg, AIMessage) and not msg.content:
+                                for tool_call in msg.additional_kwargs['tool_calls']:
+                                    tool_name = tool_call['function']['name']
+                                    args = tool_call['function']['arguments']
+                                    await websocket.send_text(f"Calling tool: {tool_name}\nTool arguments: {args}")
+
+                            elif isinstance(msg, ToolMessage):
+                                # Figures from the python_repl tool arrive as the message artifact, not in its content
+                                images = msg.artifact.get("images", []) if isinstance(msg.artifact, dict) else []
+                                for image in images:
+                                    await websocket.send_text(f"data:image/png;base64,{image}")
+
+                            elif isinstance(msg, AIMessage):
+                                await websocket.send_text(msg.content)
 
     except WebSocketDisconnect:
         print("WebSocket connection closed.")
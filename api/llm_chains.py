@@ -199,13 +199,13 @@ def get_plan_chain(llm):
 
 def assign_chat_topic(llm):
 
-    template = """
+    template = (
         "You are an expert in assigning concise topics to conversations. The user provides their focus area, "
         "and you assign a relevant topic in 5 words or less. "
         "Here is the user's input:\n\n"
-        f"{user_input}\n\n"
+        "{user_input}\n\n"
         "What is the best topic for this conversation? Provide only the topic without any extra text."
-    """
+    )
 
     prompt_template = ChatPromptTemplate.from_template(template=template)
 
@@ -0,0 +1,317 @@
+"""
+Single path for every chat-model call the app makes.
+
+`gateway.wrap(ChatGroq(...))` returns a chat model that behaves like the one it wraps (chains,
+`with_structured_output`, `bind_tools` and the ReAct agent all work unchanged) but sends each
+call through the gateway, which:
+
+- runs it asynchronously on the gateway's own event loop, so sync callers in worker threads and
+  async callers on the server loop share one set of limits;
+- allows at most `concurrency` calls per model in flight;
+- spends from per-model request and token buckets refilled at `rpm` / `tpm` per minute, so
+  bursts wait here instead of coming back as 429s from the provider;
+- coalesces identical prompts that are already in flight into one provider call;
+- records latency, queueing, rate-limit waits and token usage (see `metrics()`).
+
+Limits default to LLM_GATEWAY_CONCURRENCY / LLM_GATEWAY_RPM / LLM_GATEWAY_TPM and can be set per
+model with LLM_GATEWAY_LIMITS, e.g. '{"llama-3.1-8b-instant": {"rpm": 30, "tpm": 20000}}'.
+A limit of 0 disables that bucket. Set them to the quotas of your provider plan.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from pydantic import ConfigDict, Field
+
+from api.telemetry import span
+from api.token_counter import str_token_counter
+
+
+load_dotenv()
+
+LLM_GATEWAY_CONCURRENCY = int(os.environ.get("LLM_GATEWAY_CONCURRENCY", 4))
+LLM_GATEWAY_RPM = int(os.environ.get("LLM_GATEWAY_RPM", 30))
+LLM_GATEWAY_TPM = int(os.environ.get("LLM_GATEWAY_TPM", 6000))
+LLM_GATEWAY_LIMITS = json.loads(os.environ.get("LLM_GATEWAY_LIMITS", "{}"))
+LLM_GATEWAY_COALESCE = os.environ.get("LLM_GATEWAY_COALESCE", "true").lower() in ("1", "true", "yes")
+# Completion tokens reserved up front when the call sets no max_tokens; corrected from the actual usage afterwards
+LLM_GATEWAY_COMPLETION_ESTIMATE = int(os.environ.get("LLM_GATEWAY_COMPLETION_ESTIMATE", 256))
+
+LATENCY_WINDOW = 1000
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` units and refills `capacity` per minute. `acquire` waits (in FIFO
+    order) until enough units are available; a capacity of 0 means unlimited.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.available = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float) -> float:
+        """Take `amount` units, waiting if needed. Returns the seconds spent waiting."""
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) / self.rate)
+                self._refill()
+            self.available -= amount
+        return time.monotonic() - started
+
+    def adjust(self, amount: float):
+        """Charge (or refund, if negative) units after the fact; the balance may go below zero."""
+        if self.capacity:
+            self._refill()
+            self.available = min(self.capacity, self.available - amount)
+
+
+@dataclass
+class ModelLimits:
+    concurrency: int
+    rpm: int
+    tpm: int
+    semaphore: asyncio.Semaphore = None
+    requests: TokenBucket = None
+    tokens: TokenBucket = None
+
+    def __post_init__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.requests = TokenBucket(self.rpm)
+        self.tokens = TokenBucket(self.tpm)
+
+
+@dataclass
+class ModelMetrics:
+    requests: int = 0
+    coalesced: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    queued: int = 0
+    rate_limited_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(pct):
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] * 1000, 1)
+
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rate_limited_seconds": round(self.rate_limited_seconds, 2),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_p50_ms": percentile(50),
+            "latency_p99_ms": percentile(99),
+        }
+
+
+def model_name(llm: BaseChatModel) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def estimate_tokens(messages: List[BaseMessage], kwargs: dict, llm: BaseChatModel) -> int:
+    prompt = 0
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+        prompt += 4 + str_token_counter(content)
+    completion = kwargs.get("max_tokens") or getattr(llm, "max_tokens", None) or LLM_GATEWAY_COMPLETION_ESTIMATE
+    return prompt + completion
+
+
+def prompt_key(name: str, messages: List[BaseMessage], stop, kwargs: dict) -> str:
+    payload = json.dumps(
+        [name, [message.model_dump(exclude={"id"}) for message in messages], stop, kwargs],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def usage_of(result) -> tuple:
+    """(prompt_tokens, completion_tokens) reported by the provider, or (None, None)."""
+    generation = result.generations[0][0] if result.generations and result.generations[0] else None
+    usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (result.llm_output or {}).get("token_usage") or {}
+    if token_usage:
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+    return None, None
+
+
+class LLMGateway:
+    def __init__(self, coalesce: bool = LLM_GATEWAY_COALESCE):
+        self.coalesce = coalesce
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._limits: Dict[str, ModelLimits] = {}
+        self._metrics: Dict[str, ModelMetrics] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def wrap(self, llm: BaseChatModel) -> "GatewayChatModel":
+        return GatewayChatModel(inner=llm, gateway=self)
+
+    def _ensure_loop(self):
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True)
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop, self._thread = None, None
+            self._limits.clear()
+            self._in_flight.clear()
+
+    def limits_for(self, name: str) -> ModelLimits:
+        # Only ever called on the gateway loop, so the asyncio primitives all belong to it
+        if name not in self._limits:
+            overrides = LLM_GATEWAY_LIMITS.get(name, {})
+            self._limits[name] = ModelLimits(
+                concurrency=overrides.get("concurrency", LLM_GATEWAY_CONCURRENCY),
+                rpm=overrides.get("rpm", LLM_GATEWAY_RPM),
+                tpm=overrides.get("tpm", LLM_GATEWAY_TPM),
+            )
+        return self._limits[name]
+
+    def metrics(self) -> dict:
+        return {name: metrics.snapshot() for name, metrics in sorted(self._metrics.items())}
+
+    def generate(self, llm, messages, stop=None, **kwargs) -> ChatResult:
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Synchronous LLM call made from the gateway loop itself.")
+        future = asyncio.run_coroutine_threadsafe(self._call(llm, messages, stop, kwargs), self._ensure_loop())
+        return future.result()
+
+    async def agenerate(self, llm, messages, stop=None, **kwargs) -> ChatResult:
+        future = asyncio.run_coroutine_threadsafe(self._call(llm, messages, stop, kwargs), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    async def _call(self, llm, messages, stop, kwargs) -> ChatResult:
+        name = model_name(llm)
+        metrics = self._metrics.setdefault(name, ModelMetrics())
+        if not self.coalesce:
+            return await self._execute(name, metrics, llm, messages, stop, kwargs)
+
+        key = prompt_key(name, messages, stop, kwargs)
+        task = self._in_flight.get(key)
+        if task is not None:
+            metrics.coalesced += 1
+        else:
+            task = asyncio.get_running_loop().create_task(self._execute(name, metrics, llm, messages, stop, kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A caller that goes away must not cancel the call for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _execute(self, name, metrics, llm, messages, stop, kwargs) -> ChatResult:
+        limits = self.limits_for(name)
+        estimate = estimate_tokens(messages, kwargs, llm)
+
+        metrics.queued += 1
+        admitted = False
+        try:
+            async with limits.semaphore:
+                metrics.queued -= 1
+                admitted = True
+                metrics.rate_limited_seconds += await limits.requests.acquire(1)
+                metrics.rate_limited_seconds += await limits.tokens.acquire(estimate)
+
+                metrics.requests += 1
+                metrics.in_flight += 1
+                started = time.perf_counter()
+                try:
+                    result = await llm.agenerate([messages], stop=stop, **kwargs)
+                except Exception:
+                    metrics.errors += 1
+                    raise
+                finally:
+                    metrics.in_flight -= 1
+                    metrics.latencies.append(time.perf_counter() - started)
+        finally:
+            if not admitted:
+                metrics.queued -= 1
+
+        prompt_tokens, completion_tokens = usage_of(result)
+        if prompt_tokens is not None:
+            metrics.prompt_tokens += prompt_tokens
+            metrics.completion_tokens += completion_tokens
+            limits.tokens.adjust(prompt_tokens + completion_tokens - estimate)
+
+        return ChatResult(generations=result.generations[0], llm_output=result.llm_output)
+
+
+class GatewayChatModel(BaseChatModel):
+    """A chat model that delegates to `inner` through an LLMGateway."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: BaseChatModel
+    gateway: Any = Field(exclude=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gateway-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.inner._identifying_params
+
+    @property
+    def model_name(self) -> str:
+        return model_name(self.inner)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # The span is opened on the caller's side, so it nests under the caller's trace; it includes gateway queueing
+        with span("llm.call", model=self.model_name):
+            return self.gateway.generate(self.inner, messages, stop, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        with span("llm.call", model=self.model_name):
+            return await self.gateway.agenerate(self.inner, messages, stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the provider format the tools, then bind the result to this model so calls keep going through the gateway
+        return self.bind(**self.inner.bind_tools(tools, **kwargs).kwargs)
+
+
+gateway = LLMGateway()
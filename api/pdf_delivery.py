@@ -0,0 +1,195 @@
+import os
+import asyncio
+import hashlib
+import shutil
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+ETAG_CACHE_MAX_ENTRIES = int(os.environ.get("PDF_ETAG_CACHE_MAX_ENTRIES", 4096))
+PDF_CACHE_CONTROL = os.environ.get("PDF_CACHE_CONTROL", "private, no-cache")
+PDF_LINEARIZE = os.environ.get("PDF_LINEARIZE", "false").lower() in ("1", "true", "yes")
+
+# (path, st_mtime_ns, st_size) -> sha256 hex digest; a changed file gets a new key
+_content_hash_cache = OrderedDict()
+
+
+def _cache_key(path, stat_result):
+    return (os.path.abspath(path), stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def compute_content_hash(path) -> str:
+    """
+    SHA-256 of the file contents, read in fixed-size chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def remember_content_hash(path, content_hash: str, stat_result=None):
+    """
+    Record a hash that is already known (e.g. computed while the upload was streamed)
+    so the first download doesn't have to re-read the file.
+    """
+    stat_result = stat_result or os.stat(path)
+    _content_hash_cache[_cache_key(path, stat_result)] = content_hash
+    _content_hash_cache.move_to_end(_cache_key(path, stat_result))
+    while len(_content_hash_cache) > ETAG_CACHE_MAX_ENTRIES:
+        _content_hash_cache.popitem(last=False)
+
+
+async def get_content_hash(path, stat_result) -> str:
+    key = _cache_key(path, stat_result)
+    content_hash = _content_hash_cache.get(key)
+    if content_hash is None:
+        content_hash = await asyncio.to_thread(compute_content_hash, path)
+        remember_content_hash(path, content_hash, stat_result)
+    else:
+        _content_hash_cache.move_to_end(key)
+    return content_hash
+
+
+def is_not_modified(request: Request, etag: str, stat_result) -> bool:
+    """
+    Conditional GET evaluation (RFC 9110 13.2.2): If-None-Match wins over If-Modified-Since.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+
+    return False
+
+
+class PDFFileResponse(FileResponse):
+    """
+    FileResponse that honours If-Range against our content-hash ETag and, when the ASGI
+    server advertises the `http.response.zerocopysend` extension, hands the file descriptor
+    to the server so the body goes out through sendfile(2) instead of userspace reads.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, *args, content_hash: str, on_close=None, **kwargs):
+        self.content_hash = content_hash
+        self.on_close = on_close
+        self.zerocopy = False
+        super().__init__(*args, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        self.zerocopy = "http.response.zerocopysend" in (scope.get("extensions") or {})
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+    def _should_use_range(self, http_if_range: str, stat_result: os.stat_result) -> bool:
+        return http_if_range in (f'"{self.content_hash}"', formatdate(stat_result.st_mtime, usegmt=True))
+
+    async def _handle_simple(self, send, send_header_only: bool) -> None:
+        if send_header_only or not self.zerocopy:
+            return await super()._handle_simple(send, send_header_only)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        with open(self.path, "rb") as file:
+            await send({"type": "http.response.zerocopysend", "file": file, "more_body": False})
+
+    async def _handle_single_range(self, send, start: int, end: int, file_size: int, send_header_only: bool) -> None:
+        if send_header_only or not self.zerocopy:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        with open(self.path, "rb") as file:
+            await send({"type": "http.response.zerocopysend", "file": file, "offset": start, "count": end - start, "more_body": False})
+
+
+async def pdf_response(request: Request, file_path: str, file_name: str, on_close=None) -> Response:
+    """
+    Serve a stored PDF with a strong ETag, Last-Modified, conditional GET (304) and
+    byte-range support so PDF.js can fetch pages incrementally. `on_close` is called once
+    the file is no longer needed: after the body was sent, or right away for a 304.
+    """
+    stat_result = await asyncio.to_thread(os.stat, file_path)
+    content_hash = await get_content_hash(file_path, stat_result)
+    etag = f'"{content_hash}"'
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": PDF_CACHE_CONTROL,
+    }
+
+    if is_not_modified(request, etag, stat_result):
+        if on_close is not None:
+            on_close()
+        return Response(status_code=304, headers=headers)
+
+    return PDFFileResponse(
+        file_path,
+        media_type="application/pdf",
+        headers=headers,
+        filename=file_name,
+        stat_result=stat_result,
+        content_disposition_type="inline",
+        content_hash=content_hash,
+        on_close=on_close,
+    )
+
+
+async def linearize_pdf(file_path) -> bool:
+    """
+    Rewrite the PDF in linearized ("fast web view") form with qpdf so the first page can
+    render before the whole file has arrived. Enabled with PDF_LINEARIZE=true; a no-op when
+    qpdf isn't installed or the file is already linearized.
+    """
+    if not PDF_LINEARIZE:
+        return False
+
+    qpdf = shutil.which("qpdf")
+    if qpdf is None:
+        print("PDF_LINEARIZE is set but qpdf was not found on PATH; skipping linearization.")
+        return False
+
+    check = await asyncio.create_subprocess_exec(
+        qpdf, "--is-linearized", file_path,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    if await check.wait() == 0:
+        return False
+
+    tmp_path = f"{file_path}.linearized.tmp"
+    proc = await asyncio.create_subprocess_exec(
+        qpdf, "--linearize", file_path, tmp_path,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+
+    # qpdf exits with 3 for warnings but still writes a usable file
+    if proc.returncode not in (0, 3) or not os.path.exists(tmp_path):
+        print(f"Linearization failed for {file_path}: {stderr.decode(errors='ignore').strip()}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    os.replace(tmp_path, file_path)
+    return True
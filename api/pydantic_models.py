@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel, EmailStr
 
 class UserCreate(BaseModel):
@@ -12,10 +14,22 @@ class UserLogin(BaseModel):
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 2
+    conversation_id: str | None = None  # restrict the search to this conversation's documents
+    text: Literal["full", "snippet", "none"] = "full"  # chunk text, a highlighted snippet of it, or no text
 
 class AssignTopic(BaseModel):
     query: str
 
+class BatchQuery(BaseModel):
+    query: str
+    top_k: int = 2
+    conversation_id: str | None = None
+    pdf_ids: list[str] | None = None  # restrict the search to these documents
+    text: Literal["full", "snippet", "none"] = "full"
+
+class BatchQueryRequest(BaseModel):
+    queries: list[BatchQuery]
+
 class UserInDB(BaseModel):
     user_id: str
     user_name: str
@@ -31,4 +45,7 @@ class TokenData(BaseModel):
 
 class AssignTopic(BaseModel):
     conversation_name: str
-    conversation_description: str
\ No newline at end of file
+    conversation_description: str
+class ArxivIngest(BaseModel):
+    arxiv_ids: list[str]
+    ingestion_mode: str | None = None
@@ -1,15 +1,9 @@
 from qdrant_client import QdrantClient
 import os
 from dotenv import load_dotenv
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from uuid import uuid4
 import fitz
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from qdrant_client.http import models
-from langchain_qdrant import QdrantVectorStore
-from langchain.chains.query_constructor.base import AttributeInfo
-from langchain.retrievers.self_query.base import SelfQueryRetriever
-from langchain_groq import ChatGroq
 from typing import Dict, List, TypedDict
 from langchain_core.documents import Document
 from pydantic import BaseModel
@@ -17,7 +11,17 @@ import shutil
 import aiofiles
 from qdrant_client.http.models import UpdateStatus
 from datetime import datetime
-import aiofiles
+import asyncio
+import hashlib
+import inspect
+from api.pdf_delivery import linearize_pdf, compute_content_hash, remember_content_hash
+from api.storage import file_key
+from api.chunking import default_chunker, CHUNKER_VERSION
+from api.grobid_ingest import grobid_chunk_file, INGESTION_MODE, GROBID_CHUNKER_VERSION
+from api.collection_config import collection_params, sync_collection_config
+from api.flat_index import FlatIndexClient
+from api.services import services
+from api.telemetry import span
 
 
 
@@ -26,118 +30,255 @@ load_dotenv()
 
 
 
-llm_for_retrievel = ChatGroq(model='llama-3.1-70b-versatile')
-
-EMBEDDING_MODEL = GoogleGenerativeAIEmbeddings(model='models/text-embedding-004')
+# Recorded in every point's payload; changing either means existing points need re-indexing (see api/reindex.py)
+EMBEDDING_MODEL_NAME = os.environ.get('EMBEDDING_MODEL', 'models/text-embedding-004')
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', 768))
 QDRANT_API_KEY = os.environ.get('QDRANT_API_KEY')
 URL = os.environ.get('QDRANT_URL')
 
+# "cloud" (QDRANT_URL / QDRANT_API_KEY, any Qdrant server), "local" (embedded qdrant-client storage
+# in QDRANT_LOCAL_PATH) or "flat" (NumPy/mmap index in FLAT_INDEX_DIR, see api/flat_index.py)
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'cloud').lower()
+QDRANT_LOCAL_PATH = os.environ.get('QDRANT_LOCAL_PATH', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'qdrant_storage', 'embedded'))
+
+# Name the app reads and writes through; after a re-index this is an alias to a versioned collection
+COLLECTION_NAME = os.environ.get('QDRANT_COLLECTION', 'aireas-cloud')
+
+# Re-apply QDRANT_QUANTIZATION / HNSW / on-disk settings to an existing collection at startup
+QDRANT_SYNC_CONFIG = os.environ.get('QDRANT_SYNC_CONFIG', 'false').lower() in ('1', 'true', 'yes')
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_MB', 100)) * 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+
+
+def ensure_collection(client, collection_name, **overrides):
+    """
+    Create `collection_name` with the configured vector, HNSW and quantization params (see
+    api/collection_config.py) and payload indexes unless a collection or alias with that name
+    already exists. `overrides` replace individual create_collection arguments (the tenancy
+    strategies use this for sharding and HNSW settings). Returns True if it was created.
+    """
+    existing_collections = [collection.name for collection in client.get_collections().collections]
+    existing_aliases = [alias.alias_name for alias in client.get_aliases().aliases]
+    if collection_name in existing_collections or collection_name in existing_aliases:
+        return False
+
+    client.create_collection(
+        collection_name=collection_name,
+        **{**collection_params(EMBEDDING_DIM), **overrides},
+    )
+    print(f"Collection '{collection_name}' created successfully.\n")
+
+    for field_name in ("user_id", "conversation_id", "metadata.embedding_model", "metadata.chunker_version"):
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
+
+    print("\nIndexes created on 'user_id', 'conversation_id' and the payload version fields.\n")
+    return True
+
+
+def build_qdrant_client(backend=VECTOR_BACKEND):
+    if backend == 'cloud':
+        return QdrantClient(url=URL, api_key=QDRANT_API_KEY)
+    if backend == 'local':
+        return QdrantClient(path=QDRANT_LOCAL_PATH)
+    if backend == 'flat':
+        return FlatIndexClient()
+    raise RuntimeError(f"Unknown VECTOR_BACKEND '{backend}' (expected 'cloud', 'local' or 'flat').")
+
+
+def _build_qdrant():
+    client = build_qdrant_client()
+    print(f'\nStarted Qdrant client ({VECTOR_BACKEND} backend).')
+
+    try:
+        if not ensure_collection(client, COLLECTION_NAME):
+            print(f"Collection '{COLLECTION_NAME}' already exists.")
+            if QDRANT_SYNC_CONFIG:
+                sync_collection_config(client, COLLECTION_NAME)
+    except Exception:
+        client.close()
+        raise
+    return client
+
+
+def _build_embedding_model():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME)
+
+
+def _build_vector_store():
+    from langchain_qdrant import QdrantVectorStore
+
+    # Shares the app's client so every backend works; the flat index has no collection info to validate against
+    return QdrantVectorStore(
+        client=services.get("qdrant"),
+        collection_name=COLLECTION_NAME,
+        embedding=services.get("embedding_model"),
+        content_payload_key="text",
+        metadata_payload_key="metadata",
+        validate_collection_config=VECTOR_BACKEND != 'flat',
+    )
+
 
+services.register("qdrant", _build_qdrant, close=lambda client: client.close())
+services.register("embedding_model", _build_embedding_model)
+services.register("vector_store", _build_vector_store)
 
-_qdrant_client = None
 
 def connect_to_qdrant():
-    global _qdrant_client
-    if _qdrant_client is None:
-        try:
-            _qdrant_client = QdrantClient(url=URL, api_key=QDRANT_API_KEY)
-            print('\nStarted Qdrant client.')
-
-            existing_collections = _qdrant_client.get_collections().collections
-            if "aireas-cloud" not in [collection.name for collection in existing_collections]:
-                _qdrant_client.create_collection(
-                    collection_name="aireas-cloud",
-                    vectors_config=models.VectorParams(size=768, distance=models.Distance.COSINE),
-                )
-                print("Collection 'aireas-cloud' created successfully.\n")
-
-                _qdrant_client.create_payload_index(
-                    collection_name="aireas-cloud",
-                    field_name="user_id",
-                    field_schema=models.PayloadSchemaType.KEYWORD,
-                )
-
-                _qdrant_client.create_payload_index(
-                    collection_name="aireas-cloud",
-                    field_name="conversation_id",
-                    field_schema=models.PayloadSchemaType.KEYWORD,
-                )
-
-                print("\nIndex created on 'user_id' and 'conversation_id' fields for efficient filtering.\n")
-            else:
-                print("Collection 'aireas-cloud' already exists.")
+    """The worker's shared Qdrant client, connected on first use. None if the connection fails (retried on the next call)."""
+    try:
+        return services.get("qdrant")
+    except Exception as e:
+        print(f"Connection error: {e}")
+        return None
 
-        except Exception as e:
-            print(f"Connection error: {e}")
-            _qdrant_client = None
-    return _qdrant_client
+
+def get_embedding_model():
+    return services.get("embedding_model")
+
+
+def embed_queries(emb_model, queries: List[str]) -> List[List[float]]:
+    """
+    Embed several search queries in one call. `embed_documents` batches, but the Google model
+    would embed them as documents unless told they are queries, as `embed_query` does.
+    """
+    if "task_type" in inspect.signature(emb_model.embed_documents).parameters:
+        return emb_model.embed_documents(queries, task_type="RETRIEVAL_QUERY")
+    return emb_model.embed_documents(queries)
+
+
+def get_vector_store():
+    return services.get("vector_store")
+
+
+async def chunk_pdf(file_path, content_hash, ingestion_mode):
+    """
+    Chunk a stored PDF with the selected ingestion mode. Returns (ChunkedDocument, chunker_version).
+    """
+    if ingestion_mode == "grobid":
+        with span("pdf.grobid"):
+            return await grobid_chunk_file(file_path, content_hash), GROBID_CHUNKER_VERSION
+    # Layout analysis is CPU bound, keep it off the event loop
+    return await asyncio.to_thread(default_chunker.chunk_file, file_path), CHUNKER_VERSION
+
+
+def build_chunk_points(chunks, embeddings, metadata: dict) -> List[models.PointStruct]:
+    """
+    One point per chunk. `metadata` holds the document-level fields shared by every chunk.
+    """
+    return [
+        models.PointStruct(
+            id=str(uuid4()),
+            payload={
+                "metadata": {
+                    **metadata,
+                    "chunk_index": index,
+                    "page_start": chunk.page_start,
+                    "page_end": chunk.page_end,
+                    "section": chunk.section,
+                    "chunk_type": chunk.chunk_type,
+                    "weight": chunk.weight,
+                },
+                "text": chunk.text,
+            },
+            vector=embedding,
+        )
+        for index, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+    ]
 
 
-async def process_pdfs(files, qclient_, collection_name, emb_model, user_id, email, conversation_dir, conversation_id):
+async def process_pdfs(files, qclient_, collection_name, emb_model, user_id, email, conversation_id, storage, ingestion_mode=None, partition=None):
     """
     Process uploaded PDF files, extract text, generate embeddings, and upsert them into Qdrant.
+
+    Files are stored through `storage` (see api/storage.py) under "{user_id}/{conversation_id}/{file_name}".
+    `ingestion_mode` is "pymupdf" or "grobid" and defaults to INGESTION_MODE.
+    `partition` (see api/tenancy.py) overrides `collection_name` and adds the tenant's shard key.
     """
     uploaded_files_info = {}
     errors = []
-
-    # Ensure the conversation directory exists
-    os.makedirs(conversation_dir, exist_ok=True)
+    ingestion_mode = ingestion_mode or INGESTION_MODE
+    shard_key = None
+    tenant_id = user_id
+    if partition is not None:
+        collection_name, shard_key, tenant_id = partition.collection_name, partition.shard_key, partition.tenant_id
 
     for file in files:
-        filename_lower = file.filename.lower()
-        file_path = os.path.join(conversation_dir, filename_lower)  # Save in the conversation directory
+        filename_lower = os.path.basename(file.filename).lower()
+        storage_key = file_key(user_id, conversation_id, filename_lower)
+        staged_path = None
 
         try:
-            # Check if the file already exists in the specified path
-            if os.path.exists(file_path):
+            # Check if the file already exists in storage
+            if await storage.exists(storage_key):
                 print(f"File {filename_lower} already exists. Skipping vectorization.")
                 continue
 
-            # Save the file to the specified path
-            content = await file.read()
-            async with aiofiles.open(file_path, "wb") as f:
-                await f.write(content)
-            print(f"PDF saved to: {file_path}")
+            # Stream the upload to local staging; rejects non-PDFs and oversized files before they are fully read
+            staged_path = storage.staging_path(storage_key)
+            with span("upload.save", file=filename_lower) as save_span:
+                saved = await save_upload_stream(file, staged_path)
+                if save_span is not None:
+                    save_span.set_attribute("size_bytes", saved["size_bytes"])
+            content_hash = saved["content_hash"]
+
+            # Optional fast-web-view rewrite so the viewer can render page one early
+            if await linearize_pdf(staged_path):
+                content_hash = await asyncio.to_thread(compute_content_hash, staged_path)
+
+            # Publish to the storage backend; returns a local copy to extract from
+            with span("storage.put"):
+                file_path = await storage.put_file(storage_key, staged_path)
+            remember_content_hash(file_path, content_hash)
+            print(f"PDF saved to: {storage_key}")
         except Exception as e:
             error_message = f"Failed to save {filename_lower}: {str(e)}"
             print(error_message)
+            if staged_path and os.path.exists(staged_path):
+                os.remove(staged_path)
             errors.append({"file": filename_lower, "error": error_message})
             continue
 
+        upsert_attempted = False
         try:
-            # Extract text from the PDF
-            pdf_text = extract_text_from_pdf(file_path)
-            if not pdf_text.strip():
+            # Extract and chunk along headings/paragraphs/pages
+            async with storage.open_local(storage_key) as file_path:
+                chunked, chunker_version = await chunk_pdf(file_path, content_hash, ingestion_mode)
+            if not chunked.chunks:
                 raise ValueError("The PDF is empty or text could not be extracted.")
 
-            # Split text into chunks
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=2100, chunk_overlap=210)
-            text_chunks = text_splitter.split_text(pdf_text)
+            text_chunks = [chunk.text for chunk in chunked.chunks]
 
             # Generate embeddings for the chunks
-            embeddings = emb_model.embed_documents(text_chunks)
+            with span("embedding.embed_documents", batch_size=len(text_chunks)):
+                embeddings = emb_model.embed_documents(text_chunks)
 
             # Prepare points for Qdrant
             pdf_id = filename_lower
-            points = [
-                models.PointStruct(
-                    id=str(uuid4()),
-                    payload={
-                        "metadata": {
-                            "pdf_id": pdf_id,
-                            "associated_user": user_id,
-                            "associated_user_email": email,
-                            "associated_conversation_id": conversation_id
-                        },
-                        "text": chunk,
-                    },
-                    vector=embedding,
-                )
-                for chunk, embedding in zip(text_chunks, embeddings)
-            ]
+            points = build_chunk_points(chunked.chunks, embeddings, {
+                "pdf_id": pdf_id,
+                "associated_user": user_id,
+                "associated_user_email": email,
+                "associated_conversation_id": conversation_id,
+                "tenant_id": tenant_id,
+                "content_hash": content_hash,
+                "ingestion_mode": ingestion_mode,
+                "embedding_model": EMBEDDING_MODEL_NAME,
+                "chunker_version": chunker_version,
+                # Lets the garbage collector leave documents indexed during a sweep alone
+                "indexed_at": datetime.now().timestamp(),
+            })
 
             # Upsert points into Qdrant
-            upsert_response = qclient_.upsert(collection_name=collection_name, points=points)
+            upsert_attempted = True
+            with span("qdrant.upsert", collection=collection_name, points=len(points)):
+                upsert_response = qclient_.upsert(collection_name=collection_name, points=points, shard_key_selector=shard_key)
 
             if upsert_response.status != UpdateStatus.COMPLETED:
                 raise RuntimeError(f"Upsert failed for {filename_lower}. Response: {upsert_response}")
@@ -145,8 +286,21 @@ async def process_pdfs(files, qclient_, collection_name, emb_model, user_id, ema
         except Exception as e:
             error_message = f"Error processing {filename_lower}: {str(e)}"
             print(error_message)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if upsert_attempted:
+                # Don't leave a partial document behind in the index
+                try:
+                    qclient_.delete(
+                        collection_name=collection_name,
+                        points_selector=models.FilterSelector(filter=models.Filter(must=[
+                            models.FieldCondition(key="metadata.associated_user", match=models.MatchValue(value=user_id)),
+                            models.FieldCondition(key="metadata.associated_conversation_id", match=models.MatchValue(value=conversation_id)),
+                            models.FieldCondition(key="metadata.pdf_id", match=models.MatchValue(value=filename_lower)),
+                        ])),
+                        shard_key_selector=shard_key,
+                    )
+                except Exception as cleanup_error:
+                    print(f"Could not remove points for {filename_lower}: {cleanup_error}")
+            await storage.delete(storage_key)
             errors.append({"file": filename_lower, "error": error_message})
             continue
 
@@ -157,7 +311,10 @@ async def process_pdfs(files, qclient_, collection_name, emb_model, user_id, ema
             "file_name": filename_lower,
             "total_chunks": len(text_chunks),
             "upsert_response": upsert_response,
-            "file_path": file_path,
+            "file_path": storage_key,
+            "size_bytes": saved["size_bytes"],
+            "page_count": chunked.page_count,
+            "content_hash": content_hash,
             "timestamp": timestamp,
         }
 
@@ -168,27 +325,54 @@ async def process_pdfs(files, qclient_, collection_name, emb_model, user_id, ema
     return {"uploaded_files": uploaded_files_info}
 
     
-def extract_text_from_pdf(file_path) -> str:
-    pdf_document = fitz.open(file_path)
-    text = ""
-    for page in pdf_document:
-        text += page.get_text()
-    pdf_document.close()
-    return text
+async def save_upload_stream(file, file_path) -> dict:
+    """
+    Write an UploadFile to `file_path` in UPLOAD_CHUNK_SIZE pieces, hashing as it goes.
 
+    The PDF header is checked on the first chunk and the size limit on every chunk, so a bad
+    or oversized upload is rejected without ever being held in memory. The data lands in a
+    `.part` file that is renamed into place only once the stream completes.
+    """
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
 
-qclient_ = connect_to_qdrant()
+    digest = hashlib.sha256()
+    size_bytes = 0
+    tmp_path = f"{file_path}.part"
 
-if qclient_:
-    qdrant_vector_store = QdrantVectorStore.from_existing_collection(
-    collection_name="aireas-cloud",
-    embedding=EMBEDDING_MODEL,
-    api_key=QDRANT_API_KEY,
-    url=URL,
-    # prefer_grpc=True,
-    content_payload_key="text",
-    metadata_payload_key="metadata"
-)
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                # The PDF spec allows the header anywhere in the first 1024 bytes
+                if size_bytes == 0 and PDF_MAGIC not in chunk[:1024]:
+                    raise ValueError("File is not a PDF.")
+
+                size_bytes += len(chunk)
+                if size_bytes > MAX_UPLOAD_BYTES:
+                    raise ValueError(f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.")
+
+                digest.update(chunk)
+                await f.write(chunk)
+
+        if size_bytes == 0:
+            raise ValueError("File is empty.")
+
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {"size_bytes": size_bytes, "content_hash": digest.hexdigest()}
+
+
+def extract_pdf_pages(file_path) -> List[str]:
+    # MuPDF reads pages lazily from the file on disk, so the upload is never loaded into a second buffer
+    with fitz.open(file_path) as pdf_document:
+        return [page.get_text() for page in pdf_document]
+
+
+def extract_text_from_pdf(file_path) -> str:
+    return "".join(extract_pdf_pages(file_path))
 
 
 def parse_documents(documents: List[Document]) -> List[Dict[str, str]]:
@@ -196,7 +380,12 @@ def parse_documents(documents: List[Document]) -> List[Dict[str, str]]:
     for doc in documents:
         pdf_id = doc.metadata.get('pdf_id', 'Unknown')
         page_content = doc.page_content
-        parsed_output.append({'pdf_id': pdf_id, 'page_content': page_content})
+        parsed_output.append({
+            'pdf_id': pdf_id,
+            'pages': f"{doc.metadata.get('page_start')}-{doc.metadata.get('page_end')}" if doc.metadata.get('page_start') else None,
+            'section': doc.metadata.get('section'),
+            'page_content': page_content,
+        })
     return parsed_output
 
 def initialize_selfquery_retriever(llm, qdrant_vector_store):
@@ -210,6 +399,9 @@ def initialize_selfquery_retriever(llm, qdrant_vector_store):
     Returns:
         SelfQueryRetriever: Configured retriever instance.
     """
+    from langchain.chains.query_constructor.base import AttributeInfo
+    from langchain.retrievers.self_query.base import SelfQueryRetriever
+
     metadata_field_info = [
         AttributeInfo(
             name="pdf_id",
@@ -232,5 +424,5 @@ def initialize_selfquery_retriever(llm, qdrant_vector_store):
     return retriever 
 
 
-# qdrant_retriever = initialize_selfquery_retriever(llm=llm_for_retrievel, qdrant_vector_store=qdrant_vector_store)
+# qdrant_retriever = initialize_selfquery_retriever(llm=get_llm(), qdrant_vector_store=get_vector_store())
 
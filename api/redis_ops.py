@@ -2,7 +2,11 @@ import uuid
 from datetime import datetime
 import redis.asyncio as redis
 import json
+import os
+from redis.exceptions import WatchError
 from typing_extensions import List
+from api.vector_cache import vector_cache
+from api.telemetry import traced
 
 redis_client = None  # Global Redis client for shared use
 
@@ -29,7 +33,44 @@ async def close_redis_connection():
         print("Redis connection closed.")
 
 
+async def ping_redis():
+    if not redis_client:
+        raise RuntimeError("Redis connection is not initialized.")
+    await redis_client.ping()
+
+
+MANIFEST_WRITE_RETRIES = 20
 
+
+async def _modify_conversation(user_id: str, conversation_id: str, modify) -> bool:
+    """
+    Apply `modify(conversation_data)` to a conversation's stored JSON and write it back in a
+    WATCH/MULTI transaction, starting over if another writer changed the user's conversations in
+    between. `modify` may return False to skip the write. Returns False if the conversation does
+    not exist.
+    """
+    user_conversations_key = f"user:{user_id}:conversations"
+    async with redis_client.pipeline() as pipe:
+        for _ in range(MANIFEST_WRITE_RETRIES):
+            try:
+                await pipe.watch(user_conversations_key)
+                conversation_json = await pipe.hget(user_conversations_key, conversation_id)
+                if conversation_json is None:
+                    return False
+                conversation_data = json.loads(conversation_json)
+                if modify(conversation_data) is False:
+                    return True
+                pipe.multi()
+                pipe.hset(user_conversations_key, conversation_id, json.dumps(conversation_data))
+                await pipe.execute()
+                return True
+            except WatchError:
+                continue
+    raise RuntimeError(f"Conversation {conversation_id} kept changing; gave up after {MANIFEST_WRITE_RETRIES} attempts.")
+
+
+
+@traced("redis.add_conversation")
 async def add_conversation(user_id: str, email: str, name: str, description: str, topic: str):
     """
     Add a conversation to the Redis database with the specified structure.
@@ -61,6 +102,7 @@ async def add_conversation(user_id: str, email: str, name: str, description: str
     }
 
 
+@traced("redis.fetch_user_conversations")
 async def fetch_user_conversations(user_id: str) -> list:
     user_conversations_key = f"user:{user_id}:conversations"
     conversations_data = await redis_client.hgetall(user_conversations_key)
@@ -85,6 +127,7 @@ async def fetch_user_conversations(user_id: str) -> list:
     return conversations
 
 
+@traced("redis.fetch_conversation")
 async def fetch_conversation(user_id: str, conversation_id: str) -> dict:
     user_conversations_key = f"user:{user_id}:conversations"
     conversation_json = await redis_client.hget(user_conversations_key, conversation_id)
@@ -107,21 +150,13 @@ async def fetch_conversation(user_id: str, conversation_id: str) -> dict:
         raise ValueError(f"Error decoding conversation data: {str(e)}")
 
 
+@traced("redis.update_conversation_files")
 async def update_conversation_files(user_id: str, conversation_id: str, uploaded_files):
     """
     Update the conversation files for a specific user and conversation ID.
     If a file with the same name already exists, replace its information with the new data.
     """
-    user_conversations_key = f"user:{user_id}:conversations"
-
-    # Fetch the existing conversation data from Redis
-    conversation_json = await redis_client.hget(user_conversations_key, conversation_id)
-    if not conversation_json:
-        raise ValueError(f"Conversation with ID {conversation_id} not found for user {user_id}.")
-
-    try:
-        conversation_data = json.loads(conversation_json)
-
+    def add_files(conversation_data):
         # Load existing files data or initialize as empty
         files_data = json.loads(conversation_data.get("files", "{}"))
 
@@ -133,15 +168,169 @@ async def update_conversation_files(user_id: str, conversation_id: str, uploaded
             files_data[file_name] = {
                 "file_path": file_path,
                 "upload_timestamp": file_info["timestamp"],  # Ensure the key is 'timestamp'
+                "size_bytes": file_info.get("size_bytes"),
+                "page_count": file_info.get("page_count"),
+                "total_chunks": file_info.get("total_chunks"),
+                "content_hash": file_info.get("content_hash"),
+                "status": file_info.get("status", "indexed"),
             }
 
         # Update the conversation data with the new files
         conversation_data["files"] = json.dumps(files_data)
 
-        # Save the updated conversation data back to Redis
-        await redis_client.hset(user_conversations_key, conversation_id, json.dumps(conversation_data))
-
+    try:
+        found = await _modify_conversation(user_id, conversation_id, add_files)
     except json.JSONDecodeError as e:
         raise ValueError(f"Error decoding conversation data: {str(e)}")
+    if not found:
+        raise ValueError(f"Conversation with ID {conversation_id} not found for user {user_id}.")
+    vector_cache.invalidate(user_id, conversation_id)
 
     return {"message": "Conversation files updated successfully."}
+
+
+@traced("redis.update_conversation_topic")
+async def update_conversation_topic(user_id: str, conversation_id: str, topic: str):
+    def set_topic(conversation_data):
+        conversation_data["topic"] = topic
+
+    if not await _modify_conversation(user_id, conversation_id, set_topic):
+        raise ValueError(f"Conversation with ID {conversation_id} not found for user {user_id}.")
+
+
+@traced("redis.get_cached_topic")
+async def get_cached_topic(key: str):
+    return await redis_client.get(key)
+
+
+@traced("redis.cache_topic")
+async def cache_topic(key: str, topic: str, ttl_seconds: int):
+    await redis_client.set(key, topic, ex=ttl_seconds)
+
+
+RECONCILE_INTERVAL_SECONDS = int(os.environ.get("FILE_RECONCILE_INTERVAL_SECONDS", 300))
+
+
+@traced("redis.conversation_exists")
+async def conversation_exists(user_id: str, conversation_id: str) -> bool:
+    return bool(await redis_client.hexists(f"user:{user_id}:conversations", conversation_id))
+
+
+@traced("redis.fetch_conversation_files")
+async def fetch_conversation_files(user_id: str, conversation_id: str) -> dict:
+    """
+    Return the file manifest recorded by `update_conversation_files` as {file_name: info}.
+    """
+    user_conversations_key = f"user:{user_id}:conversations"
+    conversation_json = await redis_client.hget(user_conversations_key, conversation_id)
+    if conversation_json is None:
+        return {}
+
+    try:
+        conversation_data = json.loads(conversation_json)
+        return json.loads(conversation_data.get("files", "{}"))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Error decoding conversation data: {str(e)}")
+
+
+@traced("redis.reconcile_conversation_files")
+async def reconcile_conversation_files(user_id: str, conversation_id: str, storage, force: bool = False):
+    """
+    Bring the Redis file manifest in line with what is actually in storage: entries whose file
+    is gone are dropped, and stored files without an entry are added with status "unindexed".
+
+    Runs at most once per FILE_RECONCILE_INTERVAL_SECONDS per conversation unless `force` is set,
+    so it can be scheduled from read endpoints without turning every request into a listing.
+    """
+    if not force:
+        lock_key = f"reconcile:{user_id}:{conversation_id}"
+        if not await redis_client.set(lock_key, "1", nx=True, ex=RECONCILE_INTERVAL_SECONDS):
+            return {"reconciled": False}
+
+    # Storage is listed outside the transaction, so only entries that were already in the manifest
+    # before the listing started, and are unchanged since, may be dropped for being absent from it:
+    # an upload that lands meanwhile must not be mistaken for a deleted file
+    before = await fetch_conversation_files(user_id, conversation_id)
+    stored = await storage.list(f"{user_id}/{conversation_id}")
+    result = {"reconciled": True, "added": [], "removed": []}
+
+    def reconcile(conversation_data):
+        files_data = json.loads(conversation_data.get("files", "{}"))
+        removed = [name for name, info in files_data.items() if name not in stored and before.get(name) == info]
+        added = [name for name in stored if name not in files_data]
+        result.update(added=added, removed=removed)
+        if not removed and not added:
+            return False
+
+        for name in removed:
+            del files_data[name]
+
+        for name in added:
+            files_data[name] = {
+                "file_path": f"{user_id}/{conversation_id}/{name}",
+                "upload_timestamp": stored[name]["modified"].strftime('%Y-%m-%d %H:%M:%S'),
+                "size_bytes": stored[name]["size_bytes"],
+                "page_count": None,
+                "total_chunks": None,
+                "content_hash": None,
+                "status": "unindexed",
+            }
+
+        conversation_data["files"] = json.dumps(files_data)
+
+    if not await _modify_conversation(user_id, conversation_id, reconcile):
+        return {"reconciled": False}
+    if result["added"] or result["removed"]:
+        vector_cache.invalidate(user_id, conversation_id)
+    return result
+
+
+@traced("redis.remove_conversation_file")
+async def remove_conversation_file(user_id: str, conversation_id: str, file_name: str):
+    """
+    Drop one file from a conversation's manifest. Returns the removed entry, or None if it was not listed.
+    """
+    removed = None
+
+    def remove_file(conversation_data):
+        nonlocal removed
+        files_data = json.loads(conversation_data.get("files", "{}"))
+        removed = files_data.pop(file_name, None)
+        if removed is None:
+            return False
+        conversation_data["files"] = json.dumps(files_data)
+
+    if not await _modify_conversation(user_id, conversation_id, remove_file):
+        raise ValueError(f"Conversation with ID {conversation_id} not found for user {user_id}.")
+    vector_cache.invalidate(user_id, conversation_id)
+    return removed
+
+
+@traced("redis.delete_conversation")
+async def delete_conversation(user_id: str, conversation_id: str) -> bool:
+    """
+    Remove a conversation and its reconcile throttle key. Returns False if it did not exist.
+    """
+    removed = await redis_client.hdel(f"user:{user_id}:conversations", conversation_id)
+    await redis_client.delete(f"reconcile:{user_id}:{conversation_id}")
+    vector_cache.invalidate(user_id, conversation_id)
+    return bool(removed)
+
+
+@traced("redis.fetch_all_conversation_manifests")
+async def fetch_all_conversation_manifests() -> dict:
+    """
+    Every conversation's file manifest as {user_id: {conversation_id: {file_name: info}}}.
+    Walks the `user:*:conversations` hashes with SCAN so it never blocks Redis.
+    """
+    manifests = {}
+    async for conversations_key in redis_client.scan_iter(match="user:*:conversations", count=500):
+        user_id = conversations_key.split(":")[1]
+        conversations = await redis_client.hgetall(conversations_key)
+        for conversation_id, conversation_json in conversations.items():
+            try:
+                files_data = json.loads(json.loads(conversation_json).get("files", "{}"))
+            except json.JSONDecodeError:
+                files_data = {}
+            manifests.setdefault(user_id, {})[conversation_id] = files_data
+    return manifests
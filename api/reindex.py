@@ -0,0 +1,299 @@
+"""
+Resumable re-indexer for when the embedding model or chunker changes.
+
+    python -m api.reindex                 # build the new collection and swap the alias
+    python -m api.reindex --no-swap       # build only
+    python -m api.reindex --drop-legacy   # first run against a pre-alias 'aireas-cloud' collection
+
+Every point records `embedding_model` and `chunker_version` in its metadata. The re-indexer
+scrolls the live collection, groups points by document, and rebuilds each document into a
+versioned target collection: documents already at the current versions have their points
+copied as-is, stale ones are re-chunked from the stored PDF and re-embedded in batches.
+Progress is checkpointed per document, so an interrupted run picks up where it stopped.
+When every document is done, the COLLECTION_NAME alias is moved to the target in a single
+atomic alias update; the previous collection is kept for rollback.
+
+Every collection the tenancy strategy writes to (see api/tenancy.py) is rebuilt the same way,
+each behind an alias of its own name. Targets get the strategy's collection setup (sharding,
+HNSW overrides, tenant indexes), and each document is routed to its partition so its shard key
+and tenant id carry over.
+"""
+import os
+import re
+import json
+import asyncio
+import hashlib
+import argparse
+from datetime import datetime
+
+from qdrant_client.http import models
+
+from api.qdrant_cloud_ops import (
+    chunk_pdf, build_chunk_points,
+    get_embedding_model, COLLECTION_NAME, EMBEDDING_MODEL_NAME,
+)
+from api.chunking import CHUNKER_VERSION
+from api.grobid_ingest import GROBID_CHUNKER_VERSION
+from api.pdf_delivery import compute_content_hash
+from api.storage import get_storage, file_key
+from api.tenancy import get_tenancy
+
+
+REINDEX_BATCH_SIZE = int(os.environ.get("REINDEX_BATCH_SIZE", 64))
+REINDEX_CHECKPOINT_DIR = os.environ.get("REINDEX_CHECKPOINT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reindex_checkpoints"))
+SCROLL_PAGE_SIZE = 256
+
+
+def expected_chunker_version(ingestion_mode) -> str:
+    return GROBID_CHUNKER_VERSION if ingestion_mode == "grobid" else CHUNKER_VERSION
+
+
+def target_collection_name(collection_name: str = COLLECTION_NAME) -> str:
+    versions = f"{EMBEDDING_MODEL_NAME}|{CHUNKER_VERSION}|{GROBID_CHUNKER_VERSION}"
+    model_slug = re.sub(r"[^a-z0-9]+", "-", EMBEDDING_MODEL_NAME.split("/")[-1].lower()).strip("-")
+    return f"{collection_name}--{model_slug}--{hashlib.sha1(versions.encode()).hexdigest()[:8]}"
+
+
+def resolve_alias(client, name: str):
+    """Collection the alias `name` points to, or None if `name` is not an alias."""
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == name:
+            return alias.collection_name
+    return None
+
+
+def document_filter(doc: dict) -> models.Filter:
+    return models.Filter(must=[
+        models.FieldCondition(key="metadata.associated_user", match=models.MatchValue(value=doc["user_id"])),
+        models.FieldCondition(key="metadata.associated_conversation_id", match=models.MatchValue(value=doc["conversation_id"])),
+        models.FieldCondition(key="metadata.pdf_id", match=models.MatchValue(value=doc["pdf_id"])),
+    ])
+
+
+def scan_documents(client, collection_name: str) -> dict:
+    """
+    Scroll the whole collection (payload metadata only, no vectors) and group points by document.
+    """
+    documents = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=["metadata"],
+            with_vectors=False,
+        )
+        for point in points:
+            metadata = (point.payload or {}).get("metadata", {})
+            if not metadata.get("pdf_id"):
+                continue
+            doc_key = f"{metadata.get('associated_user')}/{metadata.get('associated_conversation_id')}/{metadata['pdf_id']}"
+            doc = documents.setdefault(doc_key, {
+                "user_id": metadata.get("associated_user"),
+                "conversation_id": metadata.get("associated_conversation_id"),
+                "pdf_id": metadata["pdf_id"],
+                "email": metadata.get("associated_user_email"),
+                "ingestion_mode": metadata.get("ingestion_mode") or "pymupdf",
+                "content_hash": metadata.get("content_hash"),
+                "current": True,
+                "points": 0,
+                "indexed_at": 0,
+            })
+            doc["points"] += 1
+            doc["indexed_at"] = max(doc["indexed_at"], metadata.get("indexed_at") or 0)
+            if (
+                metadata.get("embedding_model") != EMBEDDING_MODEL_NAME
+                or metadata.get("chunker_version") != expected_chunker_version(doc["ingestion_mode"])
+            ):
+                doc["current"] = False
+        if offset is None:
+            return documents
+
+
+def load_checkpoint(path: str, source: str, target: str, restart: bool = False) -> dict:
+    if not restart and os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("source") == source and checkpoint.get("target") == target:
+            return checkpoint
+    return {"source": source, "target": target, "done": [], "missing": [], "copied_points": 0, "embedded_points": 0}
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def with_tenant(payload: dict, partition) -> dict:
+    return {**payload, "metadata": {**payload.get("metadata", {}), "tenant_id": partition.tenant_id}}
+
+
+def copy_document(client, source: str, target: str, doc: dict, partition, batch_size: int) -> int:
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source,
+            scroll_filter=document_filter(doc),
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+            shard_key_selector=partition.shard_key,
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[models.PointStruct(id=point.id, vector=point.vector, payload=with_tenant(point.payload or {}, partition)) for point in points],
+                shard_key_selector=partition.shard_key,
+            )
+            copied += len(points)
+        if offset is None:
+            return copied
+
+
+async def reembed_document(client, target: str, doc: dict, partition, storage, emb_model, batch_size: int) -> int:
+    async with storage.open_local(file_key(doc["user_id"], doc["conversation_id"], doc["pdf_id"])) as file_path:
+        content_hash = doc["content_hash"] or await asyncio.to_thread(compute_content_hash, file_path)
+        chunked, chunker_version = await chunk_pdf(file_path, content_hash, doc["ingestion_mode"])
+    if not chunked.chunks:
+        return 0
+
+    embeddings = []
+    for start in range(0, len(chunked.chunks), batch_size):
+        batch = [chunk.text for chunk in chunked.chunks[start:start + batch_size]]
+        embeddings.extend(await asyncio.to_thread(emb_model.embed_documents, batch))
+
+    points = build_chunk_points(chunked.chunks, embeddings, {
+        "pdf_id": doc["pdf_id"],
+        "associated_user": doc["user_id"],
+        "associated_user_email": doc["email"],
+        "associated_conversation_id": doc["conversation_id"],
+        "tenant_id": partition.tenant_id,
+        "content_hash": content_hash,
+        "ingestion_mode": doc["ingestion_mode"],
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "chunker_version": chunker_version,
+        "indexed_at": datetime.now().timestamp(),
+    })
+    for start in range(0, len(points), batch_size):
+        client.upsert(collection_name=target, points=points[start:start + batch_size], shard_key_selector=partition.shard_key)
+    return len(points)
+
+
+def swap_alias(client, target: str, drop_legacy: bool = False, alias: str = COLLECTION_NAME) -> bool:
+    """
+    Point `alias` at `target`. With an existing alias the delete+create happens in one
+    update_collection_aliases call, so readers never see a missing collection.
+    """
+    current = resolve_alias(client, alias)
+    operations = []
+
+    if current is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    elif client.collection_exists(alias):
+        # Pre-alias layout: a real collection owns the name, so it has to go before the alias can exist
+        if not drop_legacy:
+            print(f"'{alias}' is a concrete collection. Re-run with --drop-legacy to replace it with an alias to '{target}'.")
+            return False
+        client.delete_collection(alias)
+
+    operations.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=target, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    print(f"Alias '{alias}' now points to '{target}'.")
+    return True
+
+
+async def reindex_collection(client, tenancy, collection_name, emb_model, storage, batch_size=REINDEX_BATCH_SIZE, swap=True, drop_legacy=False, restart=False) -> dict:
+    """Rebuild one of the tenancy strategy's collections into its versioned target and swap its alias."""
+    source = resolve_alias(client, collection_name) or collection_name
+    target = target_collection_name(collection_name)
+    if source == target:
+        print(f"'{collection_name}' already points to '{target}'; nothing to do.")
+        return {"source": source, "target": target, "swapped": False}
+
+    checkpoint_path = os.path.join(REINDEX_CHECKPOINT_DIR, f"{target}.json")
+    checkpoint = load_checkpoint(checkpoint_path, source, target, restart=restart)
+    finished = set(checkpoint["done"]) | set(checkpoint["missing"])
+
+    # Same sharding, HNSW settings and tenant indexes as the collection it replaces
+    tenancy.setup_collection(collection_name, target=target)
+
+    # Keep scanning until a pass finds nothing new, so uploads made during the run are picked up too
+    while True:
+        documents = scan_documents(client, source)
+        pending = {key: doc for key, doc in documents.items() if key not in finished}
+        if not pending:
+            break
+
+        print(f"Re-indexing {len(pending)} document(s) from '{source}' into '{target}'.")
+        for doc_key, doc in pending.items():
+            partition = tenancy.route(doc["user_id"], doc["email"])
+            if partition.shard_key is not None:
+                tenancy.ensure_shard_key(partition.shard_key, target)
+
+            # Clear partial output from an interrupted attempt so retries stay idempotent
+            client.delete(
+                collection_name=target,
+                points_selector=models.FilterSelector(filter=document_filter(doc)),
+                shard_key_selector=partition.shard_key,
+            )
+
+            try:
+                if doc["current"]:
+                    checkpoint["copied_points"] += copy_document(client, source, target, doc, partition, batch_size)
+                else:
+                    checkpoint["embedded_points"] += await reembed_document(client, target, doc, partition, storage, emb_model, batch_size)
+                checkpoint["done"].append(doc_key)
+            except FileNotFoundError:
+                print(f"Stored PDF for {doc_key} is missing; skipping.")
+                checkpoint["missing"].append(doc_key)
+
+            finished.add(doc_key)
+            save_checkpoint(checkpoint_path, checkpoint)
+
+    swapped = swap_alias(client, target, drop_legacy=drop_legacy, alias=collection_name) if swap else False
+    return {
+        "source": source,
+        "target": target,
+        "documents": len(checkpoint["done"]),
+        "missing": checkpoint["missing"],
+        "copied_points": checkpoint["copied_points"],
+        "embedded_points": checkpoint["embedded_points"],
+        "swapped": swapped,
+    }
+
+
+async def reindex(client=None, emb_model=None, storage=None, tenancy=None, batch_size=REINDEX_BATCH_SIZE, swap=True, drop_legacy=False, restart=False) -> dict:
+    tenancy = tenancy or get_tenancy()
+    client = client or tenancy.client
+    emb_model = emb_model or get_embedding_model()
+    storage = storage or get_storage()
+
+    summary = {}
+    for collection_name in tenancy.collections():
+        summary[collection_name] = await reindex_collection(
+            client, tenancy, collection_name, emb_model, storage,
+            batch_size=batch_size, swap=swap, drop_legacy=drop_legacy, restart=restart,
+        )
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=REINDEX_BATCH_SIZE)
+    parser.add_argument("--no-swap", action="store_true", help="Build the target collection but leave the alias alone.")
+    parser.add_argument("--drop-legacy", action="store_true", help=f"Allow deleting a concrete '{COLLECTION_NAME}' collection so the alias can take its name.")
+    parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint.")
+    args = parser.parse_args()
+
+    asyncio.run(reindex(batch_size=args.batch_size, swap=not args.no_swap, drop_legacy=args.drop_legacy, restart=args.restart))
+
+
+if __name__ == "__main__":
+    main()
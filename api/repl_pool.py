@@ -0,0 +1,333 @@
+"""
+Pool of sandboxed Python interpreters for the agent's REPL tool.
+
+Each worker is a separate `python -I api/repl_worker.py` process with:
+- numpy/pandas/matplotlib already imported (REPL_WARM_IMPORTS);
+- rlimits on address space, CPU seconds, file size and open files;
+- its own temporary working directory;
+- an environment with no API keys.
+
+REPL_POOL_SIZE idle workers are kept spawned ahead of demand. A session (one user's
+conversation) gets a worker of its own, so variables persist between calls without being visible
+to anyone else. The worker is recycled after REPL_MAX_RUNS_PER_WORKER runs, after
+REPL_SESSION_IDLE_SECONDS without use, or when a call exceeds REPL_TIMEOUT_SECONDS (it is killed).
+A recycled session starts with a fresh namespace and is told so.
+
+Output comes back as a stream of events (see api/repl_worker.py), including matplotlib figures
+as base64 PNGs.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import asyncio
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:  # not available on Windows; workers then run without rlimits
+    resource = None
+
+
+load_dotenv()
+
+REPL_POOL_SIZE = int(os.environ.get("REPL_POOL_SIZE", 2))
+REPL_MAX_SESSIONS = int(os.environ.get("REPL_MAX_SESSIONS", 8))
+REPL_MAX_RUNS_PER_WORKER = int(os.environ.get("REPL_MAX_RUNS_PER_WORKER", 50))
+REPL_SESSION_IDLE_SECONDS = int(os.environ.get("REPL_SESSION_IDLE_SECONDS", 900))
+REPL_TIMEOUT_SECONDS = float(os.environ.get("REPL_TIMEOUT_SECONDS", 30))
+REPL_STARTUP_TIMEOUT_SECONDS = float(os.environ.get("REPL_STARTUP_TIMEOUT_SECONDS", 60))
+REPL_MEMORY_MB = int(os.environ.get("REPL_MEMORY_MB", 1024))
+REPL_CPU_SECONDS = int(os.environ.get("REPL_CPU_SECONDS", 300))  # over the worker's lifetime
+REPL_FILE_MB = int(os.environ.get("REPL_FILE_MB", 50))
+REPL_WARM_IMPORTS = os.environ.get("REPL_WARM_IMPORTS", "numpy,pandas,matplotlib")
+REPL_MAX_OUTPUT_CHARS = int(os.environ.get("REPL_MAX_OUTPUT_CHARS", 20000))
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repl_worker.py")
+
+
+class ReplBusyError(RuntimeError):
+    pass
+
+
+def _limit_resources():
+    # Runs in the child between fork and exec
+    memory = REPL_MEMORY_MB * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_CPU, (REPL_CPU_SECONDS, REPL_CPU_SECONDS))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (REPL_FILE_MB * 1024 * 1024, REPL_FILE_MB * 1024 * 1024))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (256, 256))
+
+
+def _worker_env(workdir: str) -> dict:
+    return {
+        "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+        "HOME": workdir,
+        "TMPDIR": workdir,
+        "MPLBACKEND": "Agg",
+        "MPLCONFIGDIR": workdir,
+        # One BLAS thread per worker keeps the address-space limit meaningful
+        "OPENBLAS_NUM_THREADS": "1",
+        "OMP_NUM_THREADS": "1",
+        "MKL_NUM_THREADS": "1",
+        "REPL_WARM_IMPORTS": REPL_WARM_IMPORTS,
+        "REPL_MAX_OUTPUT_CHARS": str(REPL_MAX_OUTPUT_CHARS),
+    }
+
+
+class ReplWorker:
+    def __init__(self):
+        self.workdir = tempfile.mkdtemp(prefix="aireas-repl-")
+        self.process = subprocess.Popen(
+            [sys.executable, "-I", WORKER_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            cwd=self.workdir, env=_worker_env(self.workdir),
+            preexec_fn=_limit_resources if resource is not None else None,
+            start_new_session=True,
+            text=True, bufsize=1,
+        )
+        self.runs = 0
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read, name=f"repl-reader-{self.process.pid}", daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _next(self, deadline: float) -> Optional[dict]:
+        line = self._lines.get(timeout=max(0.0, deadline - time.monotonic()))
+        return None if line is None else json.loads(line)
+
+    def wait_ready(self, timeout: float = REPL_STARTUP_TIMEOUT_SECONDS) -> dict:
+        try:
+            message = self._next(time.monotonic() + timeout)
+        except queue.Empty:
+            message = None
+        if not message or message.get("type") != "ready":
+            self.close()
+            raise RuntimeError("REPL worker failed to start.")
+        return message
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, code: str, timeout: float = REPL_TIMEOUT_SECONDS) -> Iterator[dict]:
+        """Events for one execution; always ends with a "result" event. Kills the worker on timeout."""
+        self.runs += 1
+        deadline = time.monotonic() + timeout
+        try:
+            self.process.stdin.write(json.dumps({"code": code}) + "\n")
+            self.process.stdin.flush()
+            while True:
+                message = self._next(deadline)
+                if message is None:
+                    # Usually a resource limit: the kernel killed the process
+                    yield {"type": "result", "ok": False, "error": f"The interpreter exited (code {self.process.wait()}); its state was lost."}
+                    return
+                yield message
+                if message["type"] == "result":
+                    return
+        except queue.Empty:
+            self.close()
+            yield {"type": "result", "ok": False, "error": f"Execution timed out after {timeout:g}s; the interpreter was restarted."}
+        except (BrokenPipeError, OSError) as e:
+            self.close()
+            yield {"type": "result", "ok": False, "error": f"The interpreter is not available: {e}"}
+
+    def close(self):
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class _Session:
+    def __init__(self):
+        self.worker: Optional[ReplWorker] = None
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.has_run = False
+
+
+class ReplPool:
+    def __init__(self, size: int = REPL_POOL_SIZE, max_sessions: int = REPL_MAX_SESSIONS, max_runs: int = REPL_MAX_RUNS_PER_WORKER, idle_seconds: int = REPL_SESSION_IDLE_SECONDS):
+        self.size = size
+        self.max_sessions = max_sessions
+        self.max_runs = max_runs
+        self.idle_seconds = idle_seconds
+        self._idle = deque()
+        self._spawning = 0
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"spawned": 0, "runs": 0, "timeouts": 0, "recycled": 0}
+
+    def start(self) -> "ReplPool":
+        self._replenish()
+        return self
+
+    def _replenish(self):
+        with self._lock:
+            missing = self.size - len(self._idle) - self._spawning
+            self._spawning += max(0, missing)
+        for _ in range(max(0, missing)):
+            threading.Thread(target=self._spawn_idle, daemon=True).start()
+
+    def _spawn_idle(self):
+        try:
+            worker = ReplWorker()
+            worker.wait_ready()
+            self.stats["spawned"] += 1
+        except Exception as e:
+            print(f"Could not start a REPL worker: {e}")
+            worker = None
+        with self._lock:
+            self._spawning -= 1
+            if worker is not None and not self._closed:
+                self._idle.append(worker)
+                return
+        if worker is not None:
+            worker.close()
+
+    def _take_worker(self) -> ReplWorker:
+        with self._lock:
+            worker = self._idle.popleft() if self._idle else None
+        self._replenish()
+        if worker is None or not worker.alive:
+            worker = ReplWorker()
+            worker.wait_ready()
+            self.stats["spawned"] += 1
+        return worker
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if now - session.last_used > self.idle_seconds and not session.lock.locked():
+                    expired.append(self._sessions.pop(session_id))
+            while len(self._sessions) >= self.max_sessions:
+                # Evict the least recently used session that is not running
+                victim = next((sid for sid, s in self._sessions.items() if not s.lock.locked()), None)
+                if victim is None:
+                    raise ReplBusyError("All Python interpreters are busy; try again shortly.")
+                expired.append(self._sessions.pop(victim))
+        for session in expired:
+            if session.worker is not None:
+                session.worker.close()
+
+    def _session(self, session_id: str) -> _Session:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+        self._expire_sessions()
+        with self._lock:
+            return self._sessions.setdefault(session_id, _Session())
+
+    def stream(self, session_id: Optional[str], code: str, timeout: float = REPL_TIMEOUT_SECONDS) -> Iterator[dict]:
+        """
+        Run `code` in the session's interpreter and yield its events. `session_id=None` runs in a
+        throwaway interpreter.
+        """
+        if self._closed:
+            raise RuntimeError("The REPL pool is closed.")
+        if session_id is None:
+            worker = self._take_worker()
+            try:
+                self.stats["runs"] += 1
+                yield from worker.run(code, timeout)
+            finally:
+                worker.close()
+            return
+
+        session = self._session(session_id)
+        with session.lock:
+            if session.worker is None or not session.worker.alive:
+                if session.has_run:
+                    yield {"type": "notice", "message": "The Python session was restarted; earlier variables are gone."}
+                session.worker = self._take_worker()
+
+            self.stats["runs"] += 1
+            completed = False
+            try:
+                for event in session.worker.run(code, timeout):
+                    if event["type"] == "result" and not event["ok"] and "timed out" in (event.get("error") or ""):
+                        self.stats["timeouts"] += 1
+                    yield event
+                completed = True
+            finally:
+                if not completed:
+                    # Abandoned mid-run: the rest of its output would be read by the next call
+                    session.worker.close()
+                    session.worker = None
+            session.has_run = True
+            session.last_used = time.monotonic()
+
+            if session.worker.alive and session.worker.runs >= self.max_runs:
+                self.stats["recycled"] += 1
+                session.worker.close()
+            if not session.worker.alive:
+                session.worker = None
+
+    def execute(self, session_id: Optional[str], code: str, timeout: float = REPL_TIMEOUT_SECONDS) -> dict:
+        """The whole run collected: {"ok", "stdout", "images", "error", "notices"}."""
+        output = {"ok": False, "stdout": "", "images": [], "error": None, "notices": []}
+        for event in self.stream(session_id, code, timeout):
+            if event["type"] == "stdout":
+                output["stdout"] += event["data"]
+            elif event["type"] == "image":
+                output["images"].append(event["data"])
+            elif event["type"] == "notice":
+                output["notices"].append(event["message"])
+            elif event["type"] == "result":
+                output["ok"], output["error"] = event["ok"], event.get("error")
+        return output
+
+    async def astream(self, session_id: Optional[str], code: str, timeout: float = REPL_TIMEOUT_SECONDS):
+        """`stream` for async callers: the run happens in a thread and events arrive as they are produced."""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def produce():
+            try:
+                for event in self.stream(session_id, code, timeout):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+            except Exception as e:
+                loop.call_soon_threadsafe(events.put_nowait, {"type": "result", "ok": False, "error": str(e)})
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, None)
+
+        producer = loop.run_in_executor(None, produce)
+        while (event := await events.get()) is not None:
+            yield event
+        await producer
+
+    async def aexecute(self, session_id: Optional[str], code: str, timeout: float = REPL_TIMEOUT_SECONDS) -> dict:
+        return await asyncio.to_thread(self.execute, session_id, code, timeout)
+
+    def release(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None and session.worker is not None:
+            session.worker.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            workers = list(self._idle) + [s.worker for s in self._sessions.values() if s.worker is not None]
+            self._idle.clear()
+            self._sessions.clear()
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,128 @@
+"""
+Subprocess side of api/repl_pool.py. Run with `python -I api/repl_worker.py`; never imported by the app.
+
+Imports REPL_WARM_IMPORTS once, reports {"type": "ready"}, then executes one JSON request per
+stdin line ({"code": "..."}) in a namespace that persists for the life of the process. For each
+request it writes JSON lines to the protocol stream:
+
+    {"type": "stdout", "data": "..."}                  as the code prints, line by line
+    {"type": "image", "format": "png", "data": "..."}  one per open matplotlib figure, base64
+    {"type": "result", "ok": true|false, "error": "..."}  last message of the request
+"""
+import io
+import os
+import ast
+import sys
+import json
+import base64
+import importlib
+import traceback
+import contextlib
+
+
+WARM_IMPORTS = [name.strip() for name in os.environ.get("REPL_WARM_IMPORTS", "numpy,pandas,matplotlib").split(",") if name.strip()]
+MAX_OUTPUT_CHARS = int(os.environ.get("REPL_MAX_OUTPUT_CHARS", 20000))
+
+
+class StreamWriter(io.TextIOBase):
+    """stdout/stderr replacement that forwards complete lines and stops after MAX_OUTPUT_CHARS."""
+
+    def __init__(self, send):
+        self.send = send
+        self.buffer = ""
+        self.written = 0
+        self.truncated = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if self.truncated:
+            return len(text)
+        remaining = MAX_OUTPUT_CHARS - self.written
+        if len(text) > remaining:
+            text, self.truncated = text[:remaining], True
+        self.written += len(text)
+        self.buffer += text
+        if "\n" in self.buffer:
+            lines, self.buffer = self.buffer.rsplit("\n", 1)
+            self.send(type="stdout", data=lines + "\n")
+        if self.truncated:
+            self.flush()
+            self.send(type="stdout", data=f"\n[output truncated at {MAX_OUTPUT_CHARS} characters]\n")
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.send(type="stdout", data=self.buffer)
+            self.buffer = ""
+
+
+def run_code(code, namespace):
+    """Execute `code`; if it ends in an expression, print its repr like the interactive prompt."""
+    tree = ast.parse(code, "<repl>", "exec")
+    last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+    exec(compile(tree, "<repl>", "exec"), namespace)
+    if last is not None:
+        value = eval(compile(ast.Expression(last.value), "<repl>", "eval"), namespace)
+        if value is not None:
+            print(repr(value))
+
+
+def figures():
+    if "matplotlib.pyplot" not in sys.modules:
+        return []
+    import matplotlib.pyplot as plt
+
+    images = []
+    for number in plt.get_fignums():
+        buffer = io.BytesIO()
+        plt.figure(number).savefig(buffer, format="png", bbox_inches="tight")
+        images.append(base64.b64encode(buffer.getvalue()).decode())
+    plt.close("all")
+    return images
+
+
+def main():
+    # The protocol gets its own copy of stdout; fd 1 then points at stderr so output from C
+    # extensions can never interleave with protocol messages
+    protocol = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    def send(**message):
+        protocol.write(json.dumps(message) + "\n")
+        protocol.flush()
+
+    warmed = []
+    for name in WARM_IMPORTS:
+        try:
+            module = importlib.import_module(name)
+            if name == "matplotlib":
+                module.use("Agg")
+                importlib.import_module("matplotlib.pyplot")
+            warmed.append(name)
+        except Exception:
+            pass
+    send(type="ready", warmed=warmed, pid=os.getpid())
+
+    namespace = {"__name__": "__main__"}
+    for line in sys.stdin:
+        request = json.loads(line)
+        writer = StreamWriter(send)
+        ok, error = True, None
+        with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+            try:
+                run_code(request["code"], namespace)
+            except BaseException:
+                ok, error = False, traceback.format_exc(limit=-5)
+        writer.flush()
+        try:
+            for image in figures():
+                send(type="image", format="png", data=image)
+        except Exception as e:
+            send(type="stdout", data=f"[could not render figures: {e}]\n")
+        send(type="result", ok=ok, error=error)
+
+
+if __name__ == "__main__":
+    main()
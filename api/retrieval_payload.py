@@ -0,0 +1,151 @@
+"""
+What retrieval asks Qdrant for, and how a point becomes a search result.
+
+Chunk points carry the chunk text (up to ~2,100 characters) and a `metadata` object with about
+fifteen ingestion fields (see `build_chunk_points`). Search results only need the text and the
+few fields in RETRIEVAL_PAYLOAD_FIELDS, so queries name those fields instead of asking for
+`with_payload=True`, and the rest never leaves Qdrant.
+
+`/api/retrieve` can go further with `text="snippet"` (a window of the chunk around the query
+terms, with match offsets) or `text="none"` (no text requested at all).
+
+Chunks indexed with INGESTION_MODE=grobid carry a per-section `metadata.weight` (abstracts up,
+reference lists down; see TEI_CHUNK_WEIGHTS). When RETRIEVAL_CHUNK_WEIGHTS is on, searches fetch
+RETRIEVAL_WEIGHT_OVERSAMPLE times the requested number of points and `apply_chunk_weights`
+re-ranks them by the weighted score before cutting back to the limit. Chunks without a weight
+count as 1.0.
+"""
+import os
+import re
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from qdrant_client.http import models
+
+
+load_dotenv()
+
+RETRIEVAL_SNIPPET_CHARS = int(os.environ.get("RETRIEVAL_SNIPPET_CHARS", 300))
+RETRIEVAL_CHUNK_WEIGHTS = os.environ.get("RETRIEVAL_CHUNK_WEIGHTS", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_WEIGHT_OVERSAMPLE = int(os.environ.get("RETRIEVAL_WEIGHT_OVERSAMPLE", 2))
+
+METADATA_FIELDS = ["pdf_id", "page_start", "page_end", "section", "chunk_index", "weight"]
+RETRIEVAL_PAYLOAD_FIELDS = ["text"] + [f"metadata.{field}" for field in METADATA_FIELDS]
+TEXT_MODES = ("full", "snippet", "none")
+
+SNIPPET_STOPWORDS = set("a an and are as at be by for from how in into is it of on or that the their this to what which with".split())
+
+
+def payload_fields(text_mode: str = "full") -> List[str]:
+    """Payload keys to request; the text is left out when it is not returned."""
+    return RETRIEVAL_PAYLOAD_FIELDS if text_mode != "none" else RETRIEVAL_PAYLOAD_FIELDS[1:]
+
+
+def search_limit(limit: int) -> int:
+    """How many points to ask Qdrant for so that re-ranking by chunk weight can promote some."""
+    return limit * RETRIEVAL_WEIGHT_OVERSAMPLE if RETRIEVAL_CHUNK_WEIGHTS else limit
+
+
+def weighted_score(score: float, weight) -> float:
+    # Dividing negative scores keeps a weight above 1.0 a boost for every distance metric
+    weight = weight if isinstance(weight, (int, float)) and weight > 0 else 1.0
+    return score * weight if score >= 0 else score / weight
+
+
+def apply_chunk_weights(points: List[models.ScoredPoint], limit: int) -> List[models.ScoredPoint]:
+    """The `limit` best points by weighted score, best first, with `score` set to the weighted score."""
+    if not RETRIEVAL_CHUNK_WEIGHTS:
+        return points[:limit]
+    weighted = [
+        point.model_copy(update={"score": weighted_score(point.score, get_path(point.payload, "metadata.weight"))})
+        for point in points
+    ]
+    return sorted(weighted, key=lambda point: point.score, reverse=True)[:limit]
+
+
+def get_path(payload: Optional[dict], key: str, default=None):
+    value = payload or {}
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return default
+        value = value[part]
+    return value
+
+
+def _set_path(target: dict, key: str, value):
+    *parents, last = key.split(".")
+    for part in parents:
+        target = target.setdefault(part, {})
+    target[last] = value
+
+
+_missing = object()
+
+
+def select_payload(payload: Optional[dict], with_payload):
+    """
+    Apply a `with_payload` argument the way Qdrant does: True, False, a list of keys, or an
+    include/exclude selector. Keys may be nested paths ("metadata.pdf_id").
+    """
+    if with_payload is True:
+        return payload
+    if not with_payload or payload is None:
+        return None
+    if isinstance(with_payload, models.PayloadSelectorExclude):
+        return {key: value for key, value in payload.items() if key not in with_payload.exclude}
+    keys = with_payload.include if isinstance(with_payload, models.PayloadSelectorInclude) else with_payload
+    selected = {}
+    for key in keys:
+        value = get_path(payload, key, default=_missing)
+        if value is not _missing:
+            _set_path(selected, key, value)
+    return selected
+
+
+def query_terms(query: str) -> List[str]:
+    return [term for term in dict.fromkeys(re.findall(r"\w+", query.lower())) if len(term) > 2 and term not in SNIPPET_STOPWORDS]
+
+
+def highlight_snippet(text: str, query: str, max_chars: int = RETRIEVAL_SNIPPET_CHARS) -> dict:
+    """
+    The `max_chars` window of `text` holding the most query-term matches, cut at word boundaries,
+    with the [start, end) offsets of every match inside it.
+    """
+    terms = query_terms(query)
+    pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, terms)) + r")\w*", re.IGNORECASE) if terms else None
+    matches = [(m.start(), m.end()) for m in pattern.finditer(text)] if pattern else []
+
+    if len(text) <= max_chars:
+        start, end = 0, len(text)
+    else:
+        # Window starting at the match that has the most other matches within max_chars after it
+        best = max(range(len(matches)), key=lambda i: sum(1 for s, _ in matches[i:] if s < matches[i][0] + max_chars), default=None)
+        start = 0 if best is None else max(0, matches[best][0] - max_chars // 5)
+        start = min(start, len(text) - max_chars)
+        end = start + max_chars
+        if start > 0:
+            space = text.find(" ", start)
+            start = space + 1 if 0 <= space < start + 30 else start
+        if end < len(text):
+            space = text.rfind(" ", start, end)
+            end = space if space > end - 30 else end
+
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if end < len(text) else ""
+    highlights = [[s - start + len(prefix), e - start + len(prefix)] for s, e in matches if s >= start and e <= end]
+    return {"snippet": f"{prefix}{text[start:end]}{suffix}", "highlights": highlights}
+
+
+def point_to_result(point, query: str = "", text_mode: str = "full") -> dict:
+    """One `/api/retrieve` result. Metadata fields are read from the nested `metadata` object."""
+    result = {
+        "id": point.id,
+        "score": point.score,
+        **{field: get_path(point.payload, f"metadata.{field}") for field in METADATA_FIELDS},
+    }
+    text = get_path(point.payload, "text", "")
+    if text_mode == "full":
+        result["text"] = text
+    elif text_mode == "snippet":
+        result.update(highlight_snippet(text, query))
+    return result
@@ -0,0 +1,311 @@
+"""
+Plan-and-execute (ReWOO) research agent.
+
+One LLM call writes the whole plan in the `Plan: ... #E1 = Tool[input]` format of
+`get_plan_chain` (llm_chains.py) and `research_supervisor_prompt` (team_tools.py). The steps form
+a DAG through their `#E` references: every step whose evidence inputs are ready runs at once, up
+to REWOO_MAX_PARALLEL_STEPS, with the referenced evidence substituted into its input. A last LLM
+call solves the task from the collected evidence.
+
+Compared with the ReAct loop, the model is not consulted between tool calls, so a plan with n
+tool steps costs two LLM round trips instead of n + 1, and independent searches overlap.
+"""
+import os
+import re
+import ast
+import time
+import uuid
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+
+from api.llm_chains import get_plan_chain
+
+
+load_dotenv()
+
+REWOO_MAX_PARALLEL_STEPS = int(os.environ.get("REWOO_MAX_PARALLEL_STEPS", 4))
+REWOO_STEP_TIMEOUT_SECONDS = float(os.environ.get("REWOO_STEP_TIMEOUT_SECONDS", 60))
+REWOO_MAX_STEPS = int(os.environ.get("REWOO_MAX_STEPS", 8))
+# Evidence pasted into a later step's input or into the solve prompt is cut to this many characters
+REWOO_EVIDENCE_MAX_CHARS = int(os.environ.get("REWOO_EVIDENCE_MAX_CHARS", 4000))
+
+STEP_PATTERN = re.compile(r"(#E\d+)\s*=\s*([A-Za-z_][\w ]*?)\s*\[(.*)\]\s*$")
+REFERENCE_PATTERN = re.compile(r"#E\d+")
+
+SOLVE_PROMPT = (
+    "Solve the following task or problem. To solve it, a plan was made and evidence was retrieved for "
+    "each step. The evidence may be long, incomplete or partly irrelevant; use it with care and say so "
+    "when it does not answer the task.\n\n"
+    "{plan}\n\n"
+    "Now solve the task. Answer concisely and cite the evidence (#E) you relied on.\n\n"
+    "Task: {task}\n"
+    "Response:"
+)
+
+
+class PlanError(ValueError):
+    pass
+
+
+@dataclass
+class Step:
+    name: str
+    tool: str
+    input: str
+    plan: str = ""
+    depends_on: List[str] = field(default_factory=list)
+
+
+@dataclass
+class StepResult:
+    name: str
+    tool: str
+    input: str
+    evidence: str
+    seconds: float
+    error: Optional[str] = None
+    # What the tool returned beside its text, e.g. {"images": [...]} from python_repl
+    artifact: Any = None
+
+
+def parse_plan(text: str) -> List[Step]:
+    """
+    Steps from a planner response. Each `#En = Tool[input]` line becomes a step; the `Plan:` text
+    before it is its description. References to steps that are never defined are left as text.
+    """
+    steps, description = [], []
+    for raw_line in text.splitlines():
+        line = raw_line.strip().lstrip("-* ").strip()
+        if not line:
+            continue
+        # Plans usually put the description and the step on one line: "Plan: ... #E1 = Tool[...]"
+        match = STEP_PATTERN.search(line)
+        if match is None:
+            description.append(re.sub(r"^Plan:\s*", "", line, flags=re.IGNORECASE))
+            continue
+        prefix = line[:match.start()].strip()
+        if prefix:
+            description.append(re.sub(r"^Plan:\s*", "", prefix, flags=re.IGNORECASE))
+        name, tool, step_input = match.group(1), match.group(2).strip(), match.group(3).strip().strip("'\"")
+        steps.append(Step(name=name, tool=tool, input=step_input, plan=" ".join(description)))
+        description = []
+
+    if not steps:
+        raise PlanError("The planner did not produce any '#E = Tool[input]' steps.")
+
+    defined = {step.name for step in steps}
+    if len(defined) != len(steps):
+        raise PlanError("The plan defines the same #E more than once.")
+    for step in steps:
+        step.depends_on = sorted({ref for ref in REFERENCE_PATTERN.findall(step.input) if ref in defined and ref != step.name})
+    _check_acyclic(steps)
+    return steps
+
+
+def _check_acyclic(steps: List[Step]):
+    remaining = {step.name: set(step.depends_on) for step in steps}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise PlanError(f"The plan has circular #E references between {', '.join(sorted(remaining))}.")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def substitute(text: str, evidence: Dict[str, str], max_chars: int = REWOO_EVIDENCE_MAX_CHARS) -> str:
+    return REFERENCE_PATTERN.sub(lambda m: evidence[m.group(0)][:max_chars] if m.group(0) in evidence else m.group(0), text)
+
+
+def format_documents(documents) -> str:
+    return "\n\n".join(
+        f"[{doc.metadata.get('pdf_id', '')}] {doc.page_content}" if hasattr(doc, "page_content") else str(doc)
+        for doc in documents
+    ) or "No documents found."
+
+
+def looks_like_code(text: str) -> bool:
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return False
+    # A bare phrase like "Summarize findings" is not valid Python; a lone name or string is not worth running either
+    return any(not isinstance(node, ast.Expr) or isinstance(node.value, ast.Call) for node in tree.body)
+
+
+# A tool takes the (substituted) step input and the run config and returns evidence text, or a
+# ToolMessage whose content is the evidence and whose artifact goes to the client
+Tool = Callable[[str, dict], Awaitable[Union[str, ToolMessage]]]
+
+
+def default_tools(llm) -> Dict[str, Tool]:
+    """
+    The workers the planner prompts name, keyed by lower-case tool name. The agent names of
+    `get_plan_chain` (RagSearcher, Searcher, Coder, ChatBot) and the tool names of
+    `research_supervisor_prompt` both resolve.
+    """
+    from api.team_tools import get_qdrant_retriever, get_tavily_search_tool, get_arxiv_search_tool, web_scraper_tool, repl_tool
+
+    async def rag_search(query, config):
+        retriever = await asyncio.to_thread(get_qdrant_retriever)
+        return format_documents(await retriever.ainvoke(query, config=config))
+
+    async def web_search(query, config):
+        tool = await asyncio.to_thread(get_tavily_search_tool)
+        return str(await tool.ainvoke(query, config=config))
+
+    async def arxiv_search(query, config):
+        tool = await asyncio.to_thread(get_arxiv_search_tool)
+        return str(await tool.ainvoke(query, config=config))
+
+    async def search(query, config):
+        # The planner's generic "Searcher": web and arXiv at the same time
+        results = await asyncio.gather(web_search(query, config), arxiv_search(query, config), return_exceptions=True)
+        return "\n\n".join(
+            f"{source}:\n{result if not isinstance(result, Exception) else f'Error: {result}'}"
+            for source, result in zip(("Web", "arXiv"), results)
+        )
+
+    async def scrape(query, config):
+        urls = re.findall(r"https?://[^\s,'\"\]]+", query)
+        if not urls:
+            return "No URL given to scrape."
+        return str(await web_scraper_tool.ainvoke({"urls": urls}, config=config))
+
+    async def chat(query, config):
+        message = await llm.ainvoke([HumanMessage(content=query)], config=config)
+        return message.content
+
+    async def code(query, config):
+        # Plans often describe the code instead of writing it; those steps go to the LLM instead
+        if looks_like_code(query):
+            # Invoked with a tool call so the figures come back as the message artifact
+            return await repl_tool.ainvoke(
+                {"name": repl_tool.name, "args": {"code": query}, "id": f"rewoo-{uuid.uuid4().hex}", "type": "tool_call"},
+                config=config,
+            )
+        return await chat(query, config)
+
+    return {
+        "ragsearcher": rag_search, "qdrantretriever": rag_search, "qdrant retriever": rag_search,
+        "searcher": search, "tavilysearchtool": web_search, "tavilysearch": web_search, "arxivsearchtool": arxiv_search, "arxivsearch": arxiv_search,
+        "webscrapertool": scrape, "webscraper": scrape,
+        "coder": code, "pythonrepl": code, "pythonrepltool": code,
+        "chatbot": chat, "llm": chat,
+    }
+
+
+class ReWOOAgent:
+    def __init__(self, llm, tools: Dict[str, Tool] = None, planner=None, max_parallel: int = REWOO_MAX_PARALLEL_STEPS, step_timeout: float = REWOO_STEP_TIMEOUT_SECONDS):
+        self.llm = llm
+        self.tools = tools if tools is not None else default_tools(llm)
+        self.planner = planner or get_plan_chain(llm)
+        self.max_parallel = max_parallel
+        self.step_timeout = step_timeout
+
+    async def plan(self, task: str, history: List[BaseMessage] = (), config: dict = None) -> tuple:
+        text = await self.planner.ainvoke({"task": task, "messages": list(history)}, config=config)
+        steps = parse_plan(text)
+        if len(steps) > REWOO_MAX_STEPS:
+            raise PlanError(f"The plan has {len(steps)} steps; at most {REWOO_MAX_STEPS} are allowed.")
+        return text, steps
+
+    async def _run_step(self, step: Step, evidence: Dict[str, str], config: dict) -> StepResult:
+        step_input = substitute(step.input, evidence)
+        tool = self.tools.get(step.tool.lower())
+        started = time.perf_counter()
+        if tool is None:
+            return StepResult(step.name, step.tool, step_input, f"Error: unknown tool '{step.tool}'.", 0.0, error="unknown tool")
+        try:
+            result = await asyncio.wait_for(tool(step_input, config or {}), timeout=self.step_timeout)
+            if isinstance(result, ToolMessage):
+                return StepResult(step.name, step.tool, step_input, str(result.content), time.perf_counter() - started, artifact=result.artifact)
+            return StepResult(step.name, step.tool, step_input, result, time.perf_counter() - started)
+        except Exception as e:
+            # A failed step becomes evidence of the failure; the solver can still use the rest
+            message = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            return StepResult(step.name, step.tool, step_input, f"Error: {message}", time.perf_counter() - started, error=message)
+
+    async def execute(self, steps: List[Step], config: dict = None) -> AsyncIterator[tuple]:
+        """
+        Run the DAG, yielding ("start", Step) when a step is launched and ("done", StepResult)
+        when it finishes. Steps start as soon as every step they reference is done.
+        """
+        evidence: Dict[str, str] = {}
+        pending = {step.name: step for step in steps}
+        running: Dict[asyncio.Task, Step] = {}
+        try:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if len(running) >= self.max_parallel:
+                        break
+                    if all(dep in evidence for dep in step.depends_on):
+                        del pending[name]
+                        running[asyncio.create_task(self._run_step(step, evidence, config))] = step
+                        yield "start", step
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    running.pop(task)
+                    result = task.result()
+                    evidence[result.name] = result.evidence
+                    yield "done", result
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def solve(self, task: str, steps: List[Step], results: Dict[str, StepResult], config: dict = None) -> str:
+        plan = "\n".join(
+            f"Plan: {step.plan}\n{step.name} = {step.tool}[{results[step.name].input}]\n"
+            f"Evidence: {results[step.name].evidence[:REWOO_EVIDENCE_MAX_CHARS]}"
+            for step in steps
+        )
+        message = await self.llm.ainvoke([HumanMessage(content=SOLVE_PROMPT.format(plan=plan, task=task))], config=config)
+        return message.content
+
+    async def answer_directly(self, task: str, history: List[BaseMessage] = (), config: dict = None) -> str:
+        message = await self.llm.ainvoke([*history, HumanMessage(content=task)], config=config)
+        return message.content
+
+    async def astream(self, task: str, history: List[BaseMessage] = (), config: dict = None) -> AsyncIterator[dict]:
+        """
+        Events: plan, step_start, step_done and finally answer (with timings). When the planner
+        returns no usable plan, which is normal for small talk and questions it answers without
+        tools, the only event is an answer straight from the LLM, with the reason as `fallback`.
+        """
+        started = time.perf_counter()
+        try:
+            plan_text, steps = await self.plan(task, history, config)
+        except PlanError as e:
+            answer = await self.answer_directly(task, history, config)
+            yield {"type": "answer", "answer": answer, "seconds": time.perf_counter() - started, "fallback": str(e)}
+            return
+        yield {"type": "plan", "plan": plan_text, "steps": steps}
+
+        results = {}
+        async for kind, item in self.execute(steps, config):
+            if kind == "start":
+                yield {"type": "step_start", "step": item}
+            else:
+                results[item.name] = item
+                yield {"type": "step_done", "result": item}
+
+        answer = await self.solve(task, steps, results, config)
+        yield {"type": "answer", "answer": answer, "seconds": time.perf_counter() - started}
+
+    async def ainvoke(self, task: str, history: List[BaseMessage] = (), config: dict = None) -> dict:
+        output = {"results": []}
+        async for event in self.astream(task, history, config):
+            if event["type"] == "plan":
+                output["plan"] = event["plan"]
+            elif event["type"] == "step_done":
+                output["results"].append(event["result"])
+            elif event["type"] == "answer":
+                output.update(answer=event["answer"], seconds=event["seconds"])
+                if "fallback" in event:
+                    output["fallback"] = event["fallback"]
+        return output
@@ -0,0 +1,106 @@
+"""
+Process-wide registry of the expensive clients the API shares: the Qdrant client, the embedding
+model, the LLMs, the vector store and the ReAct agent.
+
+Modules register a factory at import time, which is cheap, and nothing is built until the
+first `services.get(name)`. Every caller in the worker then gets that same instance. The FastAPI
+lifespan in api/index.py can warm the names in SERVICES_WARMUP in the background, so the first
+request does not pay for them, and closes everything on shutdown.
+"""
+import os
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Comma-separated service names built in the background right after startup, e.g. "qdrant,embedding_model"
+SERVICES_WARMUP = [name.strip() for name in os.environ.get("SERVICES_WARMUP", "qdrant,embedding_model").split(",") if name.strip()]
+
+
+@dataclass
+class _Service:
+    factory: Callable[[], Any]
+    close: Optional[Callable[[Any], Any]] = None
+    instance: Any = None
+    built: bool = False
+    build_seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class ServiceRegistry:
+    def __init__(self):
+        self._services: Dict[str, _Service] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], Any]] = None):
+        """Register (or replace) the factory behind `name`. Nothing is built here."""
+        with self._registry_lock:
+            self._services[name] = _Service(factory=factory, close=close)
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str):
+        """
+        The shared instance of `name`, built on first use. Concurrent first calls build it once;
+        a factory that raises is retried on the next call rather than caching the failure.
+        """
+        service = self._services.get(name)
+        if service is None:
+            raise KeyError(f"Unknown service '{name}' (registered: {', '.join(sorted(self._services))}).")
+        if service.built:
+            return service.instance
+
+        with self._locks[name]:
+            if not service.built:
+                started = time.perf_counter()
+                try:
+                    service.instance = service.factory()
+                except Exception as e:
+                    service.error = f"{type(e).__name__}: {e}"
+                    raise
+                service.build_seconds = round(time.perf_counter() - started, 3)
+                service.error = None
+                service.built = True
+                print(f"Initialized service '{name}' in {service.build_seconds}s.")
+        return service.instance
+
+    def is_initialized(self, name: str) -> bool:
+        service = self._services.get(name)
+        return bool(service and service.built)
+
+    def status(self) -> dict:
+        return {
+            name: {"initialized": service.built, "build_seconds": service.build_seconds, "error": service.error}
+            for name, service in sorted(self._services.items())
+        }
+
+    async def warm(self, names: Iterable[str] = None):
+        """Build `names` (default SERVICES_WARMUP) off the event loop; failures are logged, not raised."""
+        for name in (SERVICES_WARMUP if names is None else names):
+            try:
+                await asyncio.to_thread(self.get, name)
+            except Exception as e:
+                print(f"Warm-up of service '{name}' failed: {e}")
+
+    async def aclose(self):
+        """Close every built service that registered a `close` callable, newest first."""
+        for name, service in reversed(list(self._services.items())):
+            if not service.built:
+                continue
+            try:
+                if service.close is not None:
+                    result = service.close(service.instance)
+                    if asyncio.iscoroutine(result):
+                        await result
+            except Exception as e:
+                print(f"Error closing service '{name}': {e}")
+            service.instance, service.built = None, False
+
+
+services = ServiceRegistry()
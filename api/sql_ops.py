@@ -1,10 +1,12 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, Integer, event, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from passlib.context import CryptContext
 import os
 import uuid
+import asyncio
 from datetime import datetime, timedelta
 from sqlalchemy.future import select
 import re
@@ -28,17 +30,121 @@ class User(Base):
     password = Column(String, nullable=False)
     email = Column(String, unique=True, nullable=False)
 
-DATABASE_URL = "sqlite+aiosqlite:///./users.db"
-engine = create_async_engine(DATABASE_URL, echo=False)
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    applied_at = Column(String, nullable=False)
+
+
+# Defaults to the users.db next to the repo root instead of the process CWD.
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "users.db")
+DATABASE_URL = os.environ.get("DATABASE_URL", f"sqlite+aiosqlite:///{DEFAULT_SQLITE_PATH}")
+
+# Pool tuning for server databases (ignored for SQLite).
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+
+# SQLite tuning
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+
+def build_engine(database_url: str = DATABASE_URL, echo: bool = False):
+    """
+    Create the async engine for `database_url`.
+
+    Postgres URLs (`postgresql://` or `postgres://`) are routed through asyncpg with a
+    pre-pinged, recycled connection pool. SQLite connections are switched to WAL with a
+    busy timeout so concurrent signups queue up instead of failing with "database is locked".
+    """
+    url = make_url(database_url)
+
+    if url.get_backend_name() in ("postgresql", "postgres"):
+        url = url.set(drivername="postgresql+asyncpg")
+        return create_async_engine(
+            url,
+            echo=echo,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+
+    if url.get_backend_name() == "sqlite":
+        if url.database and url.database != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+
+        sqlite_engine = create_async_engine(
+            url,
+            echo=echo,
+            connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        )
+
+        @event.listens_for(sqlite_engine.sync_engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+        return sqlite_engine
+
+    return create_async_engine(url, echo=echo, pool_pre_ping=True)
+
+
+engine = build_engine()
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+
+def _migration_0001_initial_schema(conn):
+    Base.metadata.create_all(conn, tables=[User.__table__])
+
+
+# Ordered schema migrations: (version, name, sync callable receiving a Connection).
+# Append new entries here; applied versions are recorded in `schema_migrations`.
+MIGRATIONS = [
+    (1, "initial_schema", _migration_0001_initial_schema),
+]
+
+
+def _apply_migrations(conn):
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        migrate(conn)
+        conn.execute(
+            SchemaMigration.__table__.insert().values(
+                version=version, name=name, applied_at=datetime.utcnow().isoformat()
+            )
+        )
+        print(f"Applied migration {version:04d}_{name}")
+
+
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_apply_migrations)
+
+
+async def close_db():
+    await engine.dispose()
+
+
+async def ping_db():
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
 
 async def create_user(user_name: str, raw_password: str, email: str):
     async with async_session() as session:
-        hashed_password = pwd_context.hash(raw_password)
+        # bcrypt is CPU bound; keep it off the event loop so signup bursts don't stall other requests
+        hashed_password = await asyncio.to_thread(pwd_context.hash, raw_password)
         new_user = User(user_name=user_name, password=hashed_password, email=email)
         session.add(new_user)
         await session.commit()
@@ -59,6 +165,9 @@ async def get_user_by_id(user_id):
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
+
 def validate_password_strength(password: str) -> bool:
     pattern = r"^(?=.*[A-Z])(?=.*\d)(?=.*[!@#$%^&*])[A-Za-z\d!@#$%^&*]{8,}$"
     return bool(re.match(pattern, password))
@@ -0,0 +1,442 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List
+
+from fastapi import Request
+from fastapi.responses import RedirectResponse, Response
+from dotenv import load_dotenv
+
+from api.pdf_delivery import pdf_response
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # in requirements.txt; only used by STORAGE_BACKEND=s3
+    boto3 = None
+
+
+load_dotenv()
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local").lower()
+USERS_STORAGE_DIR = os.environ.get("USERS_STORAGE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "users_storage"))
+
+S3_BUCKET = os.environ.get("S3_BUCKET")
+S3_PREFIX = os.environ.get("S3_PREFIX", "users_storage").strip("/")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.environ.get("S3_REGION")
+S3_PRESIGNED_READS = os.environ.get("S3_PRESIGNED_READS", "false").lower() in ("1", "true", "yes")
+S3_PRESIGN_EXPIRES = int(os.environ.get("S3_PRESIGN_EXPIRES", 900))
+S3_MULTIPART_CHUNK_MB = int(os.environ.get("S3_MULTIPART_CHUNK_MB", 8))
+
+STORAGE_CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage_cache"))
+STORAGE_CACHE_MAX_MB = int(os.environ.get("STORAGE_CACHE_MAX_MB", 2048))
+
+
+def file_key(user_id: str, conversation_id: str, file_name: str = "") -> str:
+    """
+    Storage key of an uploaded file (or of the conversation "directory" when file_name is empty).
+    """
+    parts = [user_id, conversation_id]
+    if file_name:
+        parts.append(os.path.basename(file_name))
+    return "/".join(parts)
+
+
+class LocalReadThroughCache:
+    """
+    Size-bounded on-disk LRU of objects fetched from remote storage, so extraction and
+    proxied PDF reads hit local disk after the first access.
+
+    Readers pin the entries they use (`get(key, pin=True)` / `unpin(key)`): eviction skips pinned
+    entries, and a pinned entry that is discarded is only unlinked once its last reader is done.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> size in bytes
+        self._total_bytes = 0
+        self._pins = {}  # key -> number of readers
+        self._discarded = set()  # pinned keys to unlink on their last unpin
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_existing()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, *key.split("/"))
+
+    def _load_existing(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".part"):
+                    os.remove(path)
+                    continue
+                stat_result = os.stat(path)
+                key = os.path.relpath(path, self.cache_dir).replace(os.sep, "/")
+                found.append((stat_result.st_atime, key, stat_result.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _remove_file(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        # Oldest first; entries in use stay, even if that leaves the cache over budget for a while
+        for key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if self._pins.get(key):
+                continue
+            self._total_bytes -= self._entries.pop(key)
+            self._remove_file(key)
+
+    def _pin(self, key: str):
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def get(self, key: str, pin: bool = False):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            if not os.path.exists(path):
+                self._total_bytes -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+            if pin:
+                self._pin(key)
+            return path
+
+    def unpin(self, key: str):
+        with self._lock:
+            remaining = self._pins.get(key, 0) - 1
+            if remaining > 0:
+                self._pins[key] = remaining
+                return
+            self._pins.pop(key, None)
+            if key in self._discarded:
+                self._discarded.discard(key)
+                self._remove_file(key)
+            self._evict()
+
+    def staging_path(self, key: str) -> str:
+        path = self._path(key) + ".part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def add(self, key: str, src_path: str, pin: bool = False) -> str:
+        """
+        Move `src_path` into the cache under `key` and return its cached location.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._discarded.discard(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            if pin:
+                self._pin(key)
+            self._evict()
+        return path
+
+    def discard(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            if self._pins.get(key):
+                self._discarded.add(key)
+                return
+        self._remove_file(key)
+
+
+class StorageBackend:
+    """
+    Where uploaded PDFs live. Keys look like "{user_id}/{conversation_id}/{file_name}".
+
+    Uploads are first streamed to `staging_path(key)` on local disk and then published with
+    `put_file`, which returns a local path the ingestion pipeline can read from.
+    """
+
+    def staging_path(self, key: str) -> str:
+        raise NotImplementedError
+
+    async def put_file(self, key: str, staged_path: str) -> str:
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def local_path(self, key: str) -> str:
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def open_local(self, key: str):
+        """Local path of `key` that stays valid until the block exits."""
+        yield await self.local_path(key)
+
+    async def list(self, prefix: str) -> dict:
+        """Return {file_name: {"size_bytes": int, "modified": datetime}} for the files directly under `prefix`."""
+        raise NotImplementedError
+
+    async def list_dirs(self, prefix: str = "") -> List[str]:
+        """Names of the "directories" directly under `prefix` (user ids at the root, conversation ids below a user)."""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> int:
+        """Delete one object and return the number of bytes freed."""
+        raise NotImplementedError
+
+    async def delete_prefix(self, prefix: str) -> int:
+        """Delete every file directly under `prefix` and return the number of bytes freed."""
+        freed = 0
+        for name in await self.list(prefix):
+            freed += await self.delete(f"{prefix}/{name}")
+        return freed
+
+    async def pdf_response(self, request: Request, key: str, file_name: str) -> Response:
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def staging_path(self, key: str) -> str:
+        path = self._path(key) + ".upload"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    async def put_file(self, key: str, staged_path: str) -> str:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged_path, path)
+        return path
+
+    async def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    async def local_path(self, key: str) -> str:
+        path = self._path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(key)
+        return path
+
+    async def list(self, prefix: str) -> dict:
+        def scan():
+            directory = self._path(prefix)
+            if not os.path.isdir(directory):
+                return {}
+            with os.scandir(directory) as entries:
+                return {
+                    entry.name: {
+                        "size_bytes": entry.stat().st_size,
+                        "modified": datetime.fromtimestamp(entry.stat().st_mtime),
+                    }
+                    for entry in entries
+                    if entry.is_file() and not entry.name.endswith((".part", ".upload"))
+                }
+
+        return await asyncio.to_thread(scan)
+
+    async def list_dirs(self, prefix: str = "") -> List[str]:
+        def scan():
+            directory = self._path(prefix) if prefix else self.root
+            if not os.path.isdir(directory):
+                return []
+            with os.scandir(directory) as entries:
+                return [entry.name for entry in entries if entry.is_dir()]
+
+        return await asyncio.to_thread(scan)
+
+    async def delete(self, key: str) -> int:
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    async def delete_prefix(self, prefix: str) -> int:
+        freed = await super().delete_prefix(prefix)
+        # Drop the conversation directory once it is empty; leftovers (e.g. a .part file) keep it
+        try:
+            os.rmdir(self._path(prefix))
+        except OSError:
+            pass
+        return freed
+
+    async def pdf_response(self, request: Request, key: str, file_name: str) -> Response:
+        return await pdf_response(request, self._path(key), file_name)
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-compatible object storage (AWS S3, MinIO, R2, ...). Uploads use multipart transfers,
+    reads are either redirected to a presigned URL (S3 handles Range itself) or proxied
+    through the local read-through cache.
+    """
+
+    def __init__(self, bucket: str, prefix: str, cache: LocalReadThroughCache, endpoint_url=None, region=None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install -r requirements.txt).")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET to be set.")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache = cache
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        chunk_size = S3_MULTIPART_CHUNK_MB * 1024 * 1024
+        self.transfer_config = TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def staging_path(self, key: str) -> str:
+        return self.cache.staging_path(key)
+
+    async def put_file(self, key: str, staged_path: str) -> str:
+        await asyncio.to_thread(
+            self.client.upload_file, staged_path, self.bucket, self._object_key(key),
+            ExtraArgs={"ContentType": "application/pdf"}, Config=self.transfer_config,
+        )
+        # Keep the freshly uploaded bytes around; extraction reads them right away
+        return self.cache.add(key, staged_path)
+
+    async def exists(self, key: str) -> bool:
+        if self.cache.get(key):
+            return True
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def local_path(self, key: str) -> str:
+        """A cached copy of `key`; it may be evicted at any time, readers should use `open_local`."""
+        return await self._fetch(key)
+
+    @asynccontextmanager
+    async def open_local(self, key: str):
+        path = await self._fetch(key, pin=True)
+        try:
+            yield path
+        finally:
+            self.cache.unpin(key)
+
+    async def _fetch(self, key: str, pin: bool = False) -> str:
+        cached = self.cache.get(key, pin=pin)
+        if cached:
+            return cached
+
+        staged_path = self.cache.staging_path(key)
+        try:
+            await asyncio.to_thread(
+                self.client.download_file, self.bucket, self._object_key(key), staged_path, Config=self.transfer_config
+            )
+        except ClientError as e:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(key)
+            raise
+        return self.cache.add(key, staged_path, pin=pin)
+
+    async def list(self, prefix: str) -> dict:
+        def scan():
+            listed = {}
+            object_prefix = self._object_key(prefix).rstrip("/") + "/"
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix, Delimiter="/"):
+                for obj in page.get("Contents", []):
+                    name = obj["Key"][len(object_prefix):]
+                    listed[name] = {"size_bytes": obj["Size"], "modified": obj["LastModified"]}
+            return listed
+
+        return await asyncio.to_thread(scan)
+
+    async def list_dirs(self, prefix: str = "") -> List[str]:
+        def scan():
+            object_prefix = self._object_key(prefix).rstrip("/") + "/" if (prefix or self.prefix) else ""
+            paginator = self.client.get_paginator("list_objects_v2")
+            names = []
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix, Delimiter="/"):
+                for common_prefix in page.get("CommonPrefixes", []):
+                    names.append(common_prefix["Prefix"][len(object_prefix):].rstrip("/"))
+            return names
+
+        return await asyncio.to_thread(scan)
+
+    async def delete(self, key: str) -> int:
+        try:
+            head = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError:
+            self.cache.discard(key)
+            return 0
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._object_key(key))
+        self.cache.discard(key)
+        return head.get("ContentLength", 0)
+
+    async def pdf_response(self, request: Request, key: str, file_name: str) -> Response:
+        if S3_PRESIGNED_READS:
+            url = await asyncio.to_thread(
+                self.client.generate_presigned_url,
+                "get_object",
+                Params={
+                    "Bucket": self.bucket,
+                    "Key": self._object_key(key),
+                    "ResponseContentType": "application/pdf",
+                    "ResponseContentDisposition": f'inline; filename="{file_name}"',
+                },
+                ExpiresIn=S3_PRESIGN_EXPIRES,
+            )
+            return RedirectResponse(url, status_code=307)
+
+        # Pinned until the body has been sent, so eviction can't unlink it under the response
+        path = await self._fetch(key, pin=True)
+        try:
+            return await pdf_response(request, path, file_name, on_close=lambda: self.cache.unpin(key))
+        except BaseException:
+            self.cache.unpin(key)
+            raise
+
+
+_storage = None
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            cache = LocalReadThroughCache(STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_MB * 1024 * 1024)
+            _storage = S3Storage(S3_BUCKET, S3_PREFIX, cache, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION)
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalStorage(USERS_STORAGE_DIR)
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected 'local' or 's3').")
+        print(f"Using {STORAGE_BACKEND} storage backend.")
+    return _storage
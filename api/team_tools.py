@@ -1,104 +1,217 @@
+import asyncio
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from langchain.tools.retriever import create_retriever_tool
-from langchain_community.agent_toolkits.load_tools import load_tools
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_experimental.utilities import PythonREPL
-from langgraph.prebuilt import ToolNode
-from typing import List, Annotated
+from langchain_core.embeddings import Embeddings
+from typing import List, Annotated, Tuple, Union
 from qdrant_client import QdrantClient
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.tools import StructuredTool, ToolException
-from api.qdrant_cloud_ops import connect_to_qdrant
+from langchain_core.runnables import RunnableConfig
+from api.qdrant_cloud_ops import connect_to_qdrant, get_embedding_model, COLLECTION_NAME
+from api.collection_config import search_params
+from api.tenancy import get_tenancy
+from api.flat_index import FlatIndexClient
+from api.vector_cache import search_conversation
+from api.services import services
+from api.retrieval_payload import apply_chunk_weights, payload_fields, point_to_result, search_limit
+from api.web_scraper import WebScraper, web_scraper, format_pages
+from api.arxiv_cache import get_arxiv_search, ingest_arxiv_papers
+from api.telemetry import span
 
-client = connect_to_qdrant()
-COLLECTION_NAME = 'aireas-cloud'
-EMBEDDING_MODEL= GoogleGenerativeAIEmbeddings(model='models/text-embedding-004')
+# The retriever and tools below are built on first use through the service registry, so importing
+# this module neither connects to Qdrant nor loads the langchain_community/experimental packages.
 
 class QdrantRetriever(BaseRetriever):
-    client_: QdrantClient
-    embedding_model_: GoogleGenerativeAIEmbeddings
+    client_: Union[QdrantClient, FlatIndexClient]
+    embedding_model_: Embeddings
     collection_name_: str 
-    with_payload_: bool 
+    with_payload_: Union[bool, List[str]]
     limit_: int  
 
     def _get_relevant_documents(
         self, query: str, *, run_manager: CallbackManagerForRetrieverRun = None
     ) -> List[Document]:
+        # The caller's identity arrives through the run config ({"configurable": {"user_id", "email"}}),
+        # which LangChain mirrors into the run metadata
+        metadata = run_manager.metadata if run_manager else {}
+        if not metadata.get("user_id"):
+            print("QdrantRetriever called without a user_id in the run config; returning no documents.")
+            return []
+        partition = get_tenancy().route(metadata["user_id"], metadata.get("email"))
+
         # Generate query embeddings
-        query_embeddings = self.embedding_model_.embed_query(query)
+        with span("embedding.embed_query"):
+            query_embeddings = self.embedding_model_.embed_query(query)
 
-        # Perform a search in Qdrant using the client
-        search_result = self.client_.query_points(
-            collection_name=self.collection_name_,
-            query=query_embeddings,
-            with_payload=self.with_payload_,
-            limit=self.limit_,
-        )
+        # Within a conversation, search only its documents (served from the vector cache when enabled)
+        with span("qdrant.search", collection=partition.collection_name, limit=self.limit_):
+            if metadata.get("conversation_id"):
+                points = search_conversation(
+                    self.client_, partition, metadata["conversation_id"], query_embeddings,
+                    limit=search_limit(self.limit_), with_payload=self.with_payload_, params=search_params(),
+                )
+            else:
+                points = self.client_.query_points(
+                    **partition.query_kwargs(),
+                    query=query_embeddings,
+                    with_payload=self.with_payload_,
+                    limit=search_limit(self.limit_),
+                    search_params=search_params(),
+                ).points
+            points = apply_chunk_weights(points, self.limit_)
 
         # Extract documents from search results
         documents = []
-        if hasattr(search_result, 'points'):
-            for point in search_result.points:
+        if points:
+            for point in points:
+                result = point_to_result(point)
                 document = Document(
-                    metadata={"pdf_id": point.payload.get("pdf_id", ""), "score": point.score},
-                    page_content=point.payload.get("text", ""),
-                    
+                    metadata={key: value for key, value in result.items() if key not in ("id", "text")},
+                    page_content=result["text"],
                 )
                 documents.append(document)
         return documents
 
 
-# Instantiate QdrantRetriever with required parameters
-Qretriever = QdrantRetriever(
-    client_=client,
-    collection_name_=COLLECTION_NAME,
-    embedding_model_=EMBEDDING_MODEL,
-    limit_=2,
-    with_payload_=True
-)
+def _build_qdrant_retriever():
+    client = connect_to_qdrant()
+    if client is None:
+        raise RuntimeError("Qdrant is not reachable.")
+    return QdrantRetriever(
+        client_=client,
+        collection_name_=COLLECTION_NAME,
+        embedding_model_=get_embedding_model(),
+        limit_=2,
+        with_payload_=payload_fields(),
+    )
+
+
+def _build_arxiv_search_tool():
+    # Answers from the local arXiv index where it can (see api/arxiv_cache.py)
+    search = get_arxiv_search()
+    return StructuredTool.from_function(
+        func=search.run,
+        coroutine=lambda query: asyncio.to_thread(search.run, query),
+        name="arxiv",
+        description=(
+            "A wrapper around Arxiv.org. Useful for when you need to answer questions about Physics, Mathematics, "
+            "Computer Science, Quantitative Biology, Quantitative Finance, Statistics, Electrical Engineering, and "
+            "Economics from scientific articles on arxiv.org. Input should be a search query or arXiv IDs."
+        ),
+    )
+
+
+def _build_tavily_search_tool():
+    from langchain_community.tools.tavily_search import TavilySearchResults
+    return TavilySearchResults(max_results=3)
+
+
+def _build_repl_pool():
+    from api.repl_pool import ReplPool
+    return ReplPool().start()
+
+
+services.register("qdrant_retriever", _build_qdrant_retriever)
+services.register("arxiv_search_tool", _build_arxiv_search_tool)
+services.register("tavily_search_tool", _build_tavily_search_tool)
+services.register("repl_pool", _build_repl_pool, close=lambda pool: pool.close())
+
+
+def get_qdrant_retriever() -> QdrantRetriever:
+    return services.get("qdrant_retriever")
+
 
-# Load other tools
-arxiv_search_tool = load_tools(["arxiv"])[0]
+def get_arxiv_search_tool():
+    return services.get("arxiv_search_tool")
 
 
-tavily_search_tool = TavilySearchResults(max_results=3)
+def get_tavily_search_tool():
+    return services.get("tavily_search_tool")
 
-# Web scraper class
+
+# Web scraper: concurrent fetches, main-content extraction and an on-disk cache (see api/web_scraper.py)
 def scrape_webpages(urls: List[str]) -> str:
-    """Use requests and bs4 to scrape the provided web pages for detailed information."""
-    loader = WebBaseLoader(urls)
-    docs = loader.load()
-    return "\n\n".join(
-        [
-            f'<Document name="{doc.metadata.get("title", "")}">\n{doc.page_content}\n</Document>'
-            for doc in docs
-        ]
-    )
+    """Scrape the provided web pages for detailed information."""
+    async def scrape():
+        # Sync callers run on their own event loop, so they get their own client
+        scraper = WebScraper()
+        try:
+            return await scraper.scrape(urls)
+        finally:
+            await scraper.aclose()
+    return format_pages(asyncio.run(scrape()))
+
+
+async def ascrape_webpages(urls: List[str]) -> str:
+    """Scrape the provided web pages for detailed information."""
+    return format_pages(await web_scraper.scrape(urls))
 
 web_scraper_tool = StructuredTool.from_function(
     func=scrape_webpages,
+    coroutine=ascrape_webpages,
     handle_tool_error=True
 )
 
-# Python REPL tool
-repl = PythonREPL()
+# Python REPL tool: code runs in a sandboxed interpreter per conversation (see api/repl_pool.py)
+def repl_session(config: RunnableConfig):
+    configurable = (config or {}).get("configurable", {})
+    if not configurable.get("user_id"):
+        return None  # throwaway interpreter
+    return f"{configurable['user_id']}:{configurable.get('conversation_id', '')}"
+
+
+def format_repl_result(code: str, result: dict) -> Tuple[str, dict]:
+    notices = "".join(f"{notice}\n" for notice in result["notices"])
+    images = f"\n{len(result['images'])} figure(s) were generated and shown to the user." if result["images"] else ""
+    if not result["ok"]:
+        return f"{notices}Failed to execute. Error: {result['error']}\nStdout: {result['stdout']}", {"images": result["images"]}
+    return f"{notices}Successfully executed:\n```python\n{code}\n```\nStdout: {result['stdout']}{images}", {"images": result["images"]}
+
 
 def python_repl(
     code: Annotated[str, "The python code to execute to generate your chart."],
-):
+    config: RunnableConfig,
+) -> Tuple[str, dict]:
+    """Use this to execute python code. If you want to see the output of a value,
+    you should print it out with `print(...)`. This is visible to the user."""
+    return format_repl_result(code, services.get("repl_pool").execute(repl_session(config), code))
+
+
+async def apython_repl(
+    code: Annotated[str, "The python code to execute to generate your chart."],
+    config: RunnableConfig,
+) -> Tuple[str, dict]:
     """Use this to execute python code. If you want to see the output of a value,
     you should print it out with `print(...)`. This is visible to the user."""
-    try:
-        result = repl.run(code)
-    except BaseException as e:
-        return f"Failed to execute. Error: {repr(e)}"
-    return f"Successfully executed:\n```python\n{code}\n```\nStdout: {result}"
+    pool = await asyncio.to_thread(services.get, "repl_pool")
+    return format_repl_result(code, await pool.aexecute(repl_session(config), code))
 
+# Figures travel as the ToolMessage artifact, so base64 images never enter the model's context
 repl_tool = StructuredTool.from_function(
     func=python_repl,
+    coroutine=apython_repl,
+    response_format="content_and_artifact",
+)
+
+
+# arXiv ingestion: papers go into the conversation's documents, as if the user had uploaded them
+async def add_arxiv_papers(
+    arxiv_ids: Annotated[List[str], "arXiv IDs of the papers to add, e.g. ['1706.03762']."],
+    config: RunnableConfig,
+) -> str:
+    """Download papers from arXiv and add them to this conversation's documents, so
+    qdrant_retriever_tool can search their full text. Use it when the user asks to read or add a paper."""
+    configurable = (config or {}).get("configurable", {})
+    if not configurable.get("user_id") or not configurable.get("conversation_id"):
+        raise ToolException("Papers can only be added inside a conversation.")
+    result = await ingest_arxiv_papers(arxiv_ids, configurable["user_id"], configurable.get("email"), configurable["conversation_id"])
+    added = ", ".join(result["uploaded_files"]) or "none"
+    skipped = f" Skipped (already added or not found): {', '.join(result['skipped'])}." if result["skipped"] else ""
+    return f"Added to the conversation: {added}.{skipped}"
+
+arxiv_ingest_tool = StructuredTool.from_function(
+    coroutine=add_arxiv_papers,
+    handle_tool_error=True,
 )
 
 
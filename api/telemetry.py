@@ -0,0 +1,245 @@
+"""
+Request tracing and per-stage timings.
+
+Hot paths wrap each stage in `span("qdrant.search", collection=...)` (or decorate a function
+with `@traced("redis.fetch_conversation")`). A span is:
+
+- observed in the `aireas_stage_duration_seconds` Prometheus histogram, labeled with the stage
+  name and served at /metrics, while METRICS_ENABLED (the default);
+- an OpenTelemetry span when TRACING_EXPORTER is set and the trace is sampled: "otlp" sends
+  to a collector (the standard OTEL_EXPORTER_OTLP_* variables, http://localhost:4318 by
+  default), "file" appends JSON lines to TRACING_FILE and "console" prints them.
+
+Spans nest through contextvars, so stages run in `asyncio.to_thread` land under the request
+that started them. HTTP requests get their own histogram and a root span (`observe_request`),
+tool calls made by the agents are traced through the `tool_spans` callback handler, and LLM
+calls are traced by the gateway.
+
+With TRACING_SAMPLE_RATIO=0 (or no exporter) nothing is built for OpenTelemetry, and a span is
+two perf_counter calls and a histogram observation; with metrics off too it does nothing.
+Setting METRICS_ENABLED or TRACING_EXPORTER without prometheus_client or opentelemetry-sdk
+installed is a startup error.
+"""
+import os
+import time
+import inspect
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Both are in requirements.txt; a trimmed install without them may only run with metrics and tracing off
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:
+    trace = None
+
+
+load_dotenv()
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Set explicitly (rather than left at the default), metrics must not quietly turn off
+METRICS_REQUIRED = METRICS_ENABLED and "METRICS_ENABLED" in os.environ
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "").lower()  # "" | otlp | file | console
+TRACING_SAMPLE_RATIO = float(os.environ.get("TRACING_SAMPLE_RATIO", 1.0))
+TRACING_FILE = os.environ.get("TRACING_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl"))
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "aireas-api")
+
+# Stages range from sub-millisecond cache hits to LLM calls of tens of seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _build_histograms():
+    if not METRICS_ENABLED:
+        return None, None
+    if prometheus_client is None:
+        if METRICS_REQUIRED:
+            raise RuntimeError("METRICS_ENABLED is set but prometheus_client is not installed (pip install -r requirements.txt).")
+        print("prometheus_client is not installed; /metrics and the stage histograms are off.")
+        return None, None
+    stage = prometheus_client.Histogram(
+        "aireas_stage_duration_seconds", "Duration of one stage of a request.", ["stage"], buckets=DURATION_BUCKETS,
+    )
+    request = prometheus_client.Histogram(
+        "aireas_http_request_duration_seconds", "Duration of HTTP requests.", ["method", "route", "status"], buckets=DURATION_BUCKETS,
+    )
+    return stage, request
+
+
+_trace_file = None
+
+
+def _build_tracer():
+    global _trace_file
+    if not TRACING_EXPORTER or TRACING_SAMPLE_RATIO <= 0:
+        return None, None
+    if trace is None:
+        raise RuntimeError(f"TRACING_EXPORTER={TRACING_EXPORTER} requires opentelemetry-sdk (pip install -r requirements.txt).")
+
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif TRACING_EXPORTER == "file":
+        # Closed by shutdown_telemetry, after the processor has flushed into it
+        _trace_file = open(TRACING_FILE, "a")
+        exporter = ConsoleSpanExporter(out=_trace_file, formatter=lambda span: span.to_json(indent=None) + "\n")
+    elif TRACING_EXPORTER == "console":
+        exporter = ConsoleSpanExporter()
+    else:
+        raise RuntimeError(f"Unknown TRACING_EXPORTER '{TRACING_EXPORTER}' (expected 'otlp', 'file' or 'console').")
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    print(f"Tracing to {TRACING_EXPORTER} (sample ratio {TRACING_SAMPLE_RATIO}).")
+    return provider, provider.get_tracer("aireas")
+
+
+_stage_histogram, _request_histogram = _build_histograms()
+_provider, _tracer = _build_tracer()
+
+
+def enabled() -> bool:
+    return _stage_histogram is not None or _tracer is not None
+
+
+def _attributes(attributes: dict) -> dict:
+    # OpenTelemetry rejects None values
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+_NO_SPAN = nullcontext()
+
+
+def span(name: str, **attributes):
+    """Time a stage. Yields the OpenTelemetry span (None when tracing is off) so callers can add attributes."""
+    if _stage_histogram is None and _tracer is None:
+        return _NO_SPAN
+    return _span(name, attributes)
+
+
+@contextmanager
+def _span(name: str, attributes: dict):
+    started = time.perf_counter()
+    try:
+        if _tracer is not None:
+            with _tracer.start_as_current_span(name, attributes=_attributes(attributes)) as otel_span:
+                yield otel_span
+        else:
+            yield None
+    finally:
+        if _stage_histogram is not None:
+            _stage_histogram.labels(stage=name).observe(time.perf_counter() - started)
+
+
+def traced(name: str):
+    """Decorator form of `span` for sync and async functions."""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def observe_request(request, call_next):
+    """HTTP middleware: a root span per request and the request-duration histogram, by route template."""
+    started = time.perf_counter()
+    status = 500
+    with span("http.request", **{"http.method": request.method, "http.target": request.url.path}) as otel_span:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            if otel_span is not None:
+                otel_span.update_name(f"{request.method} {route}")
+                otel_span.set_attribute("http.route", route)
+                otel_span.set_attribute("http.status_code", status)
+                if status >= 500:
+                    otel_span.set_status(Status(StatusCode.ERROR))
+            if _request_histogram is not None:
+                _request_histogram.labels(method=request.method, route=route, status=str(status)).observe(time.perf_counter() - started)
+
+
+class ToolSpanHandler(BaseCallbackHandler):
+    """Callback handler that records a `tool.<name>` span for every tool call of a run it is attached to."""
+
+    # Called on the run's own thread or loop instead of an executor, so timings are not skewed
+    run_inline = True
+
+    def __init__(self):
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        if not enabled():
+            return
+        name = f"tool.{(serialized or {}).get('name') or kwargs.get('name') or 'unknown'}"
+        otel_span = _tracer.start_span(name) if _tracer is not None else None
+        with self._lock:
+            self._running[run_id] = (name, time.perf_counter(), otel_span)
+
+    def _finish(self, run_id, error: Optional[BaseException] = None):
+        with self._lock:
+            running = self._running.pop(run_id, None)
+        if running is None:
+            return
+        name, started, otel_span = running
+        if otel_span is not None:
+            if error is not None:
+                otel_span.record_exception(error)
+                otel_span.set_status(Status(StatusCode.ERROR, str(error)))
+            otel_span.end()
+        if _stage_histogram is not None:
+            _stage_histogram.labels(stage=name).observe(time.perf_counter() - started)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+
+tool_spans = ToolSpanHandler()
+
+
+def render_metrics():
+    """(body, content type) of the Prometheus exposition, or None when metrics are off."""
+    if _stage_histogram is None:
+        return None
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def shutdown_telemetry():
+    """Flush spans that are still buffered and close the trace file."""
+    global _trace_file
+    if _provider is not None:
+        _provider.shutdown()
+    if _trace_file is not None:
+        _trace_file.close()
+        _trace_file = None
@@ -0,0 +1,261 @@
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from qdrant_client.http import models
+
+from api.collection_config import hnsw_config
+from api.qdrant_cloud_ops import connect_to_qdrant, ensure_collection, COLLECTION_NAME
+
+
+load_dotenv()
+
+# How tenants are kept apart in Qdrant:
+#   "payload"    one shared collection, partitioned by an `is_tenant` index on the user field (default)
+#   "shard_key"  one collection with custom sharding, a shard key per organization
+#   "collection" dedicated collections for the tenants in TENANCY_DEDICATED_TENANTS, payload partitioning for everyone else
+TENANCY_STRATEGY = os.environ.get("TENANCY_STRATEGY", "payload").lower()
+TENANCY_STRATEGIES = ("payload", "shard_key", "collection")
+
+# What identifies an organization: "domain" (the email domain, e.g. a lab's university) or "user"
+TENANT_KEY = os.environ.get("TENANT_KEY", "domain").lower()
+
+TENANCY_DEDICATED_TENANTS = {tenant.strip().lower() for tenant in os.environ.get("TENANCY_DEDICATED_TENANTS", "").split(",") if tenant.strip()}
+TENANCY_SHARDED_COLLECTION = os.environ.get("TENANCY_SHARDED_COLLECTION", f"{COLLECTION_NAME}-sharded")
+TENANCY_SHARD_NUMBER = int(os.environ.get("TENANCY_SHARD_NUMBER", 1))
+
+# Build HNSW links only inside each user's partition (m=0, payload_m) instead of one global graph.
+# Only valid while every search carries a user filter, which all tenancy-routed searches do.
+TENANCY_PER_TENANT_HNSW = os.environ.get("TENANCY_PER_TENANT_HNSW", "false").lower() in ("1", "true", "yes")
+TENANCY_PAYLOAD_M = int(os.environ.get("TENANCY_PAYLOAD_M", 16))
+
+USER_FIELD = "metadata.associated_user"
+TENANT_FIELD = "metadata.tenant_id"
+CONVERSATION_FIELD = "metadata.associated_conversation_id"
+
+
+def tenant_id(user_id: str, email: Optional[str] = None) -> str:
+    if TENANT_KEY == "domain" and email and "@" in email:
+        return email.rsplit("@", 1)[1].lower()
+    return user_id
+
+
+@dataclass
+class Partition:
+    """Where one user's vectors live: the collection, the shard key (if any) and the user filter."""
+    collection_name: str
+    user_id: str
+    tenant_id: str
+    shard_key: Optional[str] = None
+
+    def filter(self, *conditions: models.Condition) -> models.Filter:
+        return models.Filter(must=[
+            models.FieldCondition(key=USER_FIELD, match=models.MatchValue(value=self.user_id)),
+            *conditions,
+        ])
+
+    def query_kwargs(self, *conditions: models.Condition) -> dict:
+        """
+        Arguments that scope a query_points call to this partition. scroll and delete name the
+        filter differently (`scroll_filter`, `points_selector`), so they take `filter()` and
+        `shard_key` directly.
+        """
+        return {
+            "collection_name": self.collection_name,
+            "query_filter": self.filter(*conditions),
+            "shard_key_selector": self.shard_key,
+        }
+
+
+class TenancyStrategy:
+    """
+    Routes a user to the partition their points are written to and searched in.
+
+    `route` is called on every ingestion and search, so implementations provision lazily and
+    remember what they have already created.
+    """
+    name = None
+
+    def __init__(self, client, base_collection: str = COLLECTION_NAME):
+        self.client = client
+        self.base_collection = base_collection
+
+    def prepare(self):
+        """Create the collections and indexes the strategy needs up front."""
+        raise NotImplementedError
+
+    def route(self, user_id: str, email: Optional[str] = None) -> Partition:
+        raise NotImplementedError
+
+    def collections(self) -> List[str]:
+        """Every collection the strategy writes to, for maintenance jobs that sweep all tenants."""
+        return [self.base_collection]
+
+    def collection_params(self, collection_name: str) -> dict:
+        """ensure_collection overrides for one of the strategy's collections (see `collections`)."""
+        return self._shared_collection_overrides()
+
+    def setup_collection(self, collection_name: str, target: Optional[str] = None):
+        """
+        Create `collection_name` with the strategy's params and tenant indexes. With `target`, the
+        same setup is applied to a rebuild of `collection_name` under another name (api/reindex.py).
+        """
+        target = target or collection_name
+        ensure_collection(self.client, target, **self.collection_params(collection_name))
+        self._index_tenant_fields(target)
+
+    def _index_tenant_fields(self, collection_name: str):
+        # Re-creating an existing index is a no-op, so this is safe on every start
+        self.client.create_payload_index(
+            collection_name=collection_name,
+            field_name=USER_FIELD,
+            field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+        )
+        for field_name in (TENANT_FIELD, CONVERSATION_FIELD):
+            self.client.create_payload_index(collection_name=collection_name, field_name=field_name, field_schema=models.PayloadSchemaType.KEYWORD)
+
+    def _shared_collection_overrides(self) -> dict:
+        if TENANCY_PER_TENANT_HNSW:
+            return {"hnsw_config": models.HnswConfigDiff(**{**hnsw_config().model_dump(exclude_none=True), "m": 0, "payload_m": TENANCY_PAYLOAD_M})}
+        return {}
+
+
+class PayloadTenancy(TenancyStrategy):
+    name = "payload"
+
+    def prepare(self):
+        self.setup_collection(self.base_collection)
+
+    def route(self, user_id, email=None):
+        return Partition(collection_name=self.base_collection, user_id=user_id, tenant_id=tenant_id(user_id, email))
+
+
+class ShardKeyTenancy(TenancyStrategy):
+    """
+    Custom sharding: each organization gets its own shard key, created the first time one of its
+    users uploads. Searches only touch that organization's shards and still filter by user.
+    """
+    name = "shard_key"
+
+    def __init__(self, client, base_collection: str = COLLECTION_NAME, collection_name: str = TENANCY_SHARDED_COLLECTION):
+        super().__init__(client, base_collection)
+        self.collection_name = collection_name
+        self._shard_keys = set()
+
+    def collection_params(self, collection_name):
+        # Custom sharding is fixed at creation time, so this cannot reuse a plain collection
+        return {"sharding_method": models.ShardingMethod.CUSTOM, "shard_number": TENANCY_SHARD_NUMBER}
+
+    def prepare(self):
+        self.setup_collection(self.collection_name)
+
+    def ensure_shard_key(self, shard_key: str, collection_name: Optional[str] = None):
+        collection_name = collection_name or self.collection_name
+        if (collection_name, shard_key) in self._shard_keys:
+            return
+        try:
+            self.client.create_shard_key(collection_name, shard_key, shards_number=TENANCY_SHARD_NUMBER)
+            print(f"Created shard key '{shard_key}' in '{collection_name}'.")
+        except Exception as e:
+            if "already exists" not in str(e).lower():
+                raise
+        self._shard_keys.add((collection_name, shard_key))
+
+    def collections(self):
+        return [self.collection_name]
+
+    def route(self, user_id, email=None):
+        tenant = tenant_id(user_id, email)
+        self.ensure_shard_key(tenant)
+        return Partition(collection_name=self.collection_name, user_id=user_id, tenant_id=tenant, shard_key=tenant)
+
+
+class CollectionTenancy(TenancyStrategy):
+    """
+    Large tenants (TENANCY_DEDICATED_TENANTS, or "*" for all) get a collection of their own with
+    the app's usual vector params; everyone else shares the payload-partitioned base collection.
+    """
+    name = "collection"
+
+    def __init__(self, client, base_collection: str = COLLECTION_NAME, dedicated_tenants=TENANCY_DEDICATED_TENANTS):
+        super().__init__(client, base_collection)
+        self.dedicated_tenants = dedicated_tenants
+        self._collections = set()
+
+    def collection_for(self, tenant: str) -> str:
+        slug = re.sub(r"[^a-z0-9]+", "-", tenant.lower()).strip("-")
+        return f"{self.base_collection}--tenant-{slug}"
+
+    def is_dedicated(self, tenant: str) -> bool:
+        return "*" in self.dedicated_tenants or tenant.lower() in self.dedicated_tenants
+
+    def prepare(self):
+        self.setup_collection(self.base_collection)
+
+    def collection_params(self, collection_name):
+        # Dedicated collections hold one tenant, so they keep the global HNSW graph
+        return self._shared_collection_overrides() if collection_name == self.base_collection else {}
+
+    def collections(self):
+        # Dedicated collections may be aliases after a re-index; the versioned collections behind
+        # them ("<dedicated>--<model>--<hash>") are not listed, since slugs never contain "--"
+        dedicated_prefix = self.collection_for("")
+        names = [collection.name for collection in self.client.get_collections().collections]
+        names += [alias.alias_name for alias in self.client.get_aliases().aliases]
+        return [self.base_collection] + sorted({
+            name for name in names
+            if name.startswith(dedicated_prefix) and "--" not in name[len(dedicated_prefix):]
+        })
+
+    def route(self, user_id, email=None):
+        tenant = tenant_id(user_id, email)
+        if not self.is_dedicated(tenant):
+            return Partition(collection_name=self.base_collection, user_id=user_id, tenant_id=tenant)
+
+        collection_name = self.collection_for(tenant)
+        if collection_name not in self._collections:
+            self.setup_collection(collection_name)
+            self._collections.add(collection_name)
+        return Partition(collection_name=collection_name, user_id=user_id, tenant_id=tenant)
+
+
+STRATEGY_CLASSES = {
+    "payload": PayloadTenancy,
+    "shard_key": ShardKeyTenancy,
+    "collection": CollectionTenancy,
+}
+
+_tenancy = None
+_tenancy_lock = threading.Lock()
+
+
+def get_tenancy() -> TenancyStrategy:
+    """
+    The configured strategy, prepared on first use. Preparing talks to Qdrant, so async callers
+    go through `asyncio.to_thread` (see `route_user`).
+    """
+    global _tenancy
+    if _tenancy is not None:
+        return _tenancy
+    with _tenancy_lock:
+        if _tenancy is None:
+            if TENANCY_STRATEGY not in STRATEGY_CLASSES:
+                raise RuntimeError(f"Unknown TENANCY_STRATEGY '{TENANCY_STRATEGY}' (expected one of {', '.join(TENANCY_STRATEGIES)}).")
+            client = connect_to_qdrant()
+            if client is None:
+                raise HTTPException(status_code=503, detail="Vector store unavailable.")
+            # Only keep the strategy once prepare() has succeeded, so a failed start is retried on the next call
+            tenancy = STRATEGY_CLASSES[TENANCY_STRATEGY](client)
+            tenancy.prepare()
+            _tenancy = tenancy
+            print(f"Using {TENANCY_STRATEGY} tenancy strategy.")
+    return _tenancy
+
+
+def route_user(user_id: str, email: Optional[str] = None) -> Partition:
+    """`get_tenancy().route(...)` in one call, for `asyncio.to_thread`."""
+    return get_tenancy().route(user_id, email)
@@ -1,13 +1,19 @@
 from typing_extensions import List
+from functools import lru_cache
 
 import tiktoken
 from langchain_core.messages import BaseMessage, ToolMessage, HumanMessage, AIMessage, SystemMessage
 
 
 
+@lru_cache(maxsize=None)
+def get_encoding():
+    """Shared tokenizer used for every token count in the project."""
+    return tiktoken.get_encoding("o200k_base")
+
+
 def str_token_counter(text: str) -> int:
-    enc = tiktoken.get_encoding("o200k_base")
-    return len(enc.encode(text))
+    return len(get_encoding().encode(text))
 
 
 def tiktoken_counter(messages: List[BaseMessage]) -> int:
@@ -0,0 +1,254 @@
+"""
+Topic labels for new conversations without a 70B round trip for each one.
+
+`topic_assigner.assign(description)` tries, in order:
+
+1. the Redis cache, keyed by the normalized description;
+2. a local nearest-centroid classifier over a keyword vocabulary of research areas (seeded from
+   DEFAULT_TOPIC_VOCABULARY or TOPIC_VOCABULARY_FILE, and extended with every label the model
+   assigns), accepted when it is confident enough;
+3. the small TOPIC_MODEL through the LLM gateway (the `assign_chat_topic` chain).
+
+With TOPIC_ASSIGNMENT_MODE=background the conversation is created straight away, with the
+classifier's label if it is confident or "Untitled" otherwise, and the model's label is written
+to the conversation afterwards.
+"""
+import os
+import re
+import asyncio
+import json
+import math
+import hashlib
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from api.services import services
+from api.llm_gateway import gateway
+from api import redis_ops
+
+
+load_dotenv()
+
+TOPIC_MODEL = os.environ.get("TOPIC_MODEL", "llama-3.1-8b-instant")
+TOPIC_ASSIGNMENT_MODE = os.environ.get("TOPIC_ASSIGNMENT_MODE", "sync").lower()  # sync | background
+TOPIC_MIN_SIMILARITY = float(os.environ.get("TOPIC_MIN_SIMILARITY", 0.3))
+TOPIC_MIN_MARGIN = float(os.environ.get("TOPIC_MIN_MARGIN", 0.08))
+TOPIC_MIN_MATCHES = int(os.environ.get("TOPIC_MIN_MATCHES", 2))
+TOPIC_CACHE_TTL_SECONDS = int(os.environ.get("TOPIC_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+TOPIC_VOCABULARY_FILE = os.environ.get("TOPIC_VOCABULARY_FILE")
+TOPIC_MAX_LEARNED_TOPICS = int(os.environ.get("TOPIC_MAX_LEARNED_TOPICS", 500))
+
+PENDING_TOPIC = "Untitled"
+FALLBACK_TOPIC = "General Research"
+MAX_TOPIC_WORDS = 5
+
+# Weight of a description's terms when the model's label is learned, relative to a seed keyword
+LEARNED_TERM_WEIGHT = 0.5
+
+DEFAULT_TOPIC_VOCABULARY = {
+    "Computer Vision": "image images video vision visual detection segmentation recognition pixel camera object tracking pose convolutional cnn diffusion",
+    "Natural Language Processing": "language text nlp translation sentiment parsing token tokenization corpus summarization question answering dialogue named entity",
+    "Large Language Models": "llm llms gpt transformer prompt prompting instruction tuning rlhf alignment chatbot pretraining fine-tuning in-context",
+    "Reinforcement Learning": "reinforcement reward policy agent environment q-learning bandit markov mdp exploration actor critic",
+    "Generative Models": "generative gan gans vae autoencoder diffusion synthesis sampling latent generation",
+    "Graph Neural Networks": "graph graphs gnn node edge message passing network molecular link prediction",
+    "Robotics": "robot robots robotic manipulation grasping locomotion control motion planning navigation slam",
+    "Speech and Audio": "speech audio acoustic speaker voice asr sound music waveform spectrogram",
+    "Healthcare and Medicine": "medical clinical patient health disease diagnosis healthcare drug radiology ehr biomedical",
+    "Bioinformatics": "protein gene genomic dna rna sequence biology cell molecular bioinformatics",
+    "Optimization and Theory": "optimization convex gradient convergence theorem bound proof stochastic complexity regret",
+    "Security and Privacy": "privacy security adversarial attack attacks differential federated robustness defense",
+    "Recommender Systems": "recommendation recommender collaborative filtering ranking user item click",
+    "Time Series Forecasting": "time series forecasting temporal forecast sequential anomaly sensor",
+    "Quantum Computing": "quantum qubit qubits circuit entanglement annealing",
+    "Physics": "physics particle cosmology galaxy astrophysics quantum field relativity plasma",
+    "Climate and Earth Science": "climate weather earth satellite remote sensing ocean carbon emission",
+    "Economics and Finance": "economics finance financial market markets stock trading pricing",
+}
+
+STOPWORDS = set("""
+a an and are as at be by for from has have i in into is it its my of on or our so that the their this to
+we with want wants study studying research papers paper about using use used how what which on-going
+learn learning ideas work working project conversation focus interested interest look looking into based
+""".split())
+
+
+def normalize_description(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s-]", " ", text.lower())).strip()
+
+
+def _stem(word: str) -> str:
+    # Plurals only; anything more aggressive splits keywords from their own inflections
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(word) for word in normalize_description(text).split() if len(word) > 1 and word not in STOPWORDS]
+
+
+def clean_topic(topic: str) -> str:
+    """Strip the quotes, prefixes and trailing punctuation models like to add; at most MAX_TOPIC_WORDS words."""
+    topic = topic.strip().splitlines()[0] if topic.strip() else ""
+    topic = re.sub(r"^(topic|title)\s*:\s*", "", topic, flags=re.IGNORECASE)
+    topic = topic.strip(" \"'*.`")
+    return " ".join(topic.split()[:MAX_TOPIC_WORDS])
+
+
+class KeywordTopicClassifier:
+    """
+    Nearest-centroid classifier on bag-of-words vectors. Each topic's centroid starts from its
+    seed keywords and absorbs the terms of descriptions the model labels with it, so recurring
+    kinds of conversations stop reaching the model.
+    """
+
+    def __init__(self, vocabulary: Dict[str, str]):
+        self._centroids: Dict[str, Counter] = {}
+        self._norms: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        for topic, keywords in vocabulary.items():
+            self.learn(topic, keywords, weight=1.0)
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self._centroids)
+
+    def learn(self, topic: str, text: str, weight: float = LEARNED_TERM_WEIGHT):
+        terms = set(tokenize(text))
+        if not terms:
+            return
+        with self._lock:
+            if topic not in self._centroids and len(self._centroids) >= len(DEFAULT_TOPIC_VOCABULARY) + TOPIC_MAX_LEARNED_TOPICS:
+                return
+            centroid = self._centroids.setdefault(topic, Counter())
+            for term in terms:
+                centroid[term] = max(centroid[term], weight) if weight >= 1.0 else centroid[term] + weight
+            self._norms[topic] = math.sqrt(sum(value * value for value in centroid.values()))
+
+    def scores(self, text: str) -> List[tuple]:
+        """[(topic, score, matched_terms)] for every topic with at least one match, best first."""
+        terms = Counter(tokenize(text))
+        if not terms:
+            return []
+        text_norm = math.sqrt(sum(count * count for count in terms.values()))
+        results = []
+        with self._lock:
+            for topic, centroid in self._centroids.items():
+                matched = [term for term in terms if term in centroid]
+                if not matched:
+                    continue
+                dot = sum(terms[term] * centroid[term] for term in matched)
+                # Geometric mean of similarity and the share of the description the topic explains
+                cosine = dot / (text_norm * self._norms[topic])
+                coverage = len(matched) / len(terms)
+                results.append((topic, math.sqrt(cosine * coverage), len(matched)))
+        return sorted(results, key=lambda item: -item[1])
+
+    def classify(self, text: str) -> Optional[str]:
+        """The nearest topic if it is a confident match, otherwise None."""
+        ranked = self.scores(text)
+        if not ranked:
+            return None
+        topic, score, matches = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if score >= TOPIC_MIN_SIMILARITY and score - runner_up >= TOPIC_MIN_MARGIN and matches >= TOPIC_MIN_MATCHES:
+            return topic
+        return None
+
+
+def load_vocabulary(path: Optional[str] = TOPIC_VOCABULARY_FILE) -> Dict[str, str]:
+    """DEFAULT_TOPIC_VOCABULARY, extended or overridden by {topic: "keywords ..."} from `path`."""
+    vocabulary = dict(DEFAULT_TOPIC_VOCABULARY)
+    if path:
+        with open(path) as f:
+            for topic, keywords in json.load(f).items():
+                vocabulary[topic] = keywords if isinstance(keywords, str) else " ".join(keywords)
+    return vocabulary
+
+
+def _build_topic_chain():
+    from langchain_groq import ChatGroq
+    from api.llm_chains import assign_chat_topic
+    return assign_chat_topic(llm=gateway.wrap(ChatGroq(model=TOPIC_MODEL, max_tokens=16, temperature=0)))
+
+
+services.register("topic_chain", _build_topic_chain)
+services.register("topic_classifier", lambda: KeywordTopicClassifier(load_vocabulary()))
+
+
+def cache_key(description: str) -> str:
+    return "topic:" + hashlib.sha1(normalize_description(description).encode()).hexdigest()
+
+
+class TopicAssigner:
+    def __init__(self, classifier: KeywordTopicClassifier = None, chain=None):
+        self._classifier = classifier
+        self._chain = chain
+        self.stats = Counter()
+
+    @property
+    def classifier(self) -> KeywordTopicClassifier:
+        return self._classifier or services.get("topic_classifier")
+
+    @property
+    def chain(self):
+        return self._chain or services.get("topic_chain")
+
+    async def cached(self, description: str) -> Optional[str]:
+        try:
+            return await redis_ops.get_cached_topic(cache_key(description))
+        except Exception as e:
+            print(f"Topic cache unavailable: {e}")
+            return None
+
+    async def remember(self, description: str, topic: str):
+        try:
+            await redis_ops.cache_topic(cache_key(description), topic, TOPIC_CACHE_TTL_SECONDS)
+        except Exception as e:
+            print(f"Topic cache unavailable: {e}")
+
+    async def local(self, description: str) -> Optional[str]:
+        """Cache, then classifier; None when only the model can decide."""
+        topic = await self.cached(description)
+        if topic:
+            self.stats["cache"] += 1
+            return topic
+        topic = self.classifier.classify(description)
+        if topic:
+            self.stats["classifier"] += 1
+            await self.remember(description, topic)
+        return topic
+
+    async def from_model(self, description: str) -> str:
+        try:
+            # First use builds the Groq client; keep that off the event loop
+            chain = await asyncio.to_thread(lambda: self.chain)
+            topic = clean_topic(await chain.ainvoke(description))
+        except Exception as e:
+            print(f"Topic model failed: {e}")
+            topic = ""
+        if not topic:
+            self.stats["fallback"] += 1
+            ranked = self.classifier.scores(description)
+            return ranked[0][0] if ranked else FALLBACK_TOPIC
+
+        self.stats["model"] += 1
+        self.classifier.learn(topic, description)
+        await self.remember(description, topic)
+        return topic
+
+    async def assign(self, description: str) -> str:
+        return await self.local(description) or await self.from_model(description)
+
+
+topic_assigner = TopicAssigner()
+
+
+async def assign_topic_later(user_id: str, conversation_id: str, description: str):
+    """Background half of TOPIC_ASSIGNMENT_MODE=background: label with the model and store it."""
+    topic = await topic_assigner.from_model(description)
+    await redis_ops.update_conversation_topic(user_id, conversation_id, topic)
@@ -0,0 +1,205 @@
+"""
+In-process cache of the vectors behind one conversation's documents.
+
+Retrieval inside a conversation almost always targets the few PDFs attached to it, so the
+first conversation-scoped search loads all of that conversation's points into one contiguous
+matrix (float32, or int8 with a per-row scale) and later searches are a single matrix-vector
+product instead of a round trip to Qdrant.
+
+Entries are evicted LRU once VECTOR_CACHE_MAX_MB is exceeded, dropped when the conversation's
+files change (redis_ops calls `invalidate`), and expire after VECTOR_CACHE_TTL_SECONDS so
+workers that did not see the change pick it up too. Conversations with more than
+VECTOR_CACHE_MAX_POINTS points are searched in Qdrant as before.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from qdrant_client.http import models
+
+from api.retrieval_payload import select_payload
+
+
+load_dotenv()
+
+VECTOR_CACHE_ENABLED = os.environ.get("VECTOR_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+VECTOR_CACHE_MAX_MB = int(os.environ.get("VECTOR_CACHE_MAX_MB", 256))
+VECTOR_CACHE_DTYPE = os.environ.get("VECTOR_CACHE_DTYPE", "float32").lower()  # float32 | int8
+VECTOR_CACHE_MAX_POINTS = int(os.environ.get("VECTOR_CACHE_MAX_POINTS", 20_000))
+VECTOR_CACHE_TTL_SECONDS = int(os.environ.get("VECTOR_CACHE_TTL_SECONDS", 300))
+
+CONVERSATION_FIELD = "metadata.associated_conversation_id"
+LOAD_PAGE_SIZE = 512
+
+
+@dataclass
+class CachedConversation:
+    ids: list
+    payloads: list
+    matrix: np.ndarray  # (n, d) unit vectors, float32 or int8
+    scales: Optional[np.ndarray]  # per-row dequantisation scale for int8
+    nbytes: int
+    loaded_at: float
+
+    def search(self, query: np.ndarray, limit: int):
+        """Return (row, score) pairs for the best `limit` rows, best first."""
+        if self.scales is not None:
+            scores = (self.matrix @ query) * self.scales
+        else:
+            scores = self.matrix @ query
+        limit = min(limit, len(scores))
+        if limit == 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+def quantize_int8(vectors: np.ndarray):
+    """Symmetric per-row int8 quantisation; row ≈ q * scale."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+class ConversationVectorCache:
+    def __init__(self, max_bytes: int, dtype: str = "float32", max_points: int = VECTOR_CACHE_MAX_POINTS, ttl_seconds: int = VECTOR_CACHE_TTL_SECONDS):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unknown VECTOR_CACHE_DTYPE '{dtype}' (expected float32 or int8).")
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.max_points = max_points
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._loading = {}  # key -> invalidated while the load was in flight
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "too_large": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.loaded_at > self.ttl_seconds:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry: CachedConversation):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if self._loading.pop(key, False) or entry.nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.total_bytes += entry.nbytes
+            while self.total_bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def invalidate(self, user_id: str, conversation_id: str):
+        key = (user_id, conversation_id)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if key in self._loading:
+                self._loading[key] = True
+
+    def _drop(self, key):
+        self.total_bytes -= self._entries.pop(key).nbytes
+
+    def load(self, client, partition, conversation_id: str) -> Optional[CachedConversation]:
+        """Scroll every point of the conversation with its vector. None if it is too large to cache."""
+        points_filter = partition.filter(models.FieldCondition(key=CONVERSATION_FIELD, match=models.MatchValue(value=conversation_id)))
+        ids, payloads, vectors = [], [], []
+        offset = None
+        while True:
+            points, offset = client.scroll(
+                collection_name=partition.collection_name,
+                scroll_filter=points_filter,
+                limit=LOAD_PAGE_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+                shard_key_selector=partition.shard_key,
+            )
+            for point in points:
+                ids.append(point.id)
+                payloads.append(point.payload)
+                vectors.append(point.vector)
+            if len(ids) > self.max_points:
+                self.stats["too_large"] += 1
+                return None
+            if offset is None:
+                break
+
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+
+        scales = None
+        if self.dtype == "int8":
+            matrix, scales = quantize_int8(matrix)
+
+        text_bytes = sum(len((payload or {}).get("text", "")) for payload in payloads)
+        nbytes = matrix.nbytes + (scales.nbytes if scales is not None else 0) + text_bytes
+        return CachedConversation(ids, payloads, matrix, scales, nbytes, time.monotonic())
+
+    def search(self, client, partition, conversation_id: str, query_vector, limit: int, with_payload=True) -> Optional[List[models.ScoredPoint]]:
+        """
+        Conversation-scoped search served from memory. Returns None when the conversation is too
+        large to cache, in which case the caller queries Qdrant.
+        """
+        key = (partition.user_id, conversation_id)
+        entry = self.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            with self._lock:
+                self._loading[key] = False
+            entry = self.load(client, partition, conversation_id)
+            if entry is None:
+                with self._lock:
+                    self._loading.pop(key, None)
+                return None
+            self.put(key, entry)
+        else:
+            self.stats["hits"] += 1
+
+        query = np.array(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        return [
+            models.ScoredPoint(id=entry.ids[row], version=0, score=score, payload=select_payload(entry.payloads[row], with_payload))
+            for row, score in entry.search(query, limit)
+        ]
+
+
+vector_cache = ConversationVectorCache(VECTOR_CACHE_MAX_MB * 1024 * 1024, VECTOR_CACHE_DTYPE)
+
+
+def search_conversation(client, partition, conversation_id: str, query_vector, limit: int, with_payload=True, params=None) -> List[models.ScoredPoint]:
+    """
+    Top `limit` points of one conversation: from the in-process cache when VECTOR_CACHE_ENABLED,
+    otherwise (or if the conversation is too large) with a filtered Qdrant query.
+    """
+    if VECTOR_CACHE_ENABLED:
+        points = vector_cache.search(client, partition, conversation_id, query_vector, limit, with_payload)
+        if points is not None:
+            return points
+
+    result = client.query_points(
+        **partition.query_kwargs(models.FieldCondition(key=CONVERSATION_FIELD, match=models.MatchValue(value=conversation_id))),
+        query=query_vector,
+        with_payload=with_payload,
+        limit=limit,
+        search_params=params,
+    )
+    return result.points
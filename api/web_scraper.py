@@ -0,0 +1,230 @@
+"""
+Async web page fetching for the `web_scraper_tool`.
+
+`web_scraper.scrape(urls)` fetches every URL at once over one pooled httpx client. There are at
+most SCRAPER_PER_HOST_CONCURRENCY requests per host. Each response is read only up to
+SCRAPER_MAX_BYTES. Then:
+
+- the main content (<article>, <main>, or the densest block of paragraphs) is extracted from the HTML;
+- each page's text is cut so all pages together fit SCRAPER_MAX_TOKENS, counted with
+  api.token_counter.
+
+Extracted pages are cached on disk in SCRAPER_CACHE_DIR together with their ETag and
+Last-Modified validators. Within SCRAPER_CACHE_FRESH_SECONDS a page is served from the cache
+directly. After that it is revalidated with a conditional request, and a 304 reuses the cached
+text.
+
+Point the tool at api/extras/web_stub.py to try it without the network.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+from collections import Counter
+from dataclasses import dataclass, asdict, replace
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+
+from api.token_counter import get_encoding
+
+
+load_dotenv()
+
+SCRAPER_MAX_CONNECTIONS = int(os.environ.get("SCRAPER_MAX_CONNECTIONS", 20))
+SCRAPER_PER_HOST_CONCURRENCY = int(os.environ.get("SCRAPER_PER_HOST_CONCURRENCY", 2))
+SCRAPER_TIMEOUT_SECONDS = float(os.environ.get("SCRAPER_TIMEOUT_SECONDS", 15))
+SCRAPER_MAX_BYTES = int(os.environ.get("SCRAPER_MAX_BYTES", 2 * 1024 * 1024))
+# Token budget for the text of one tool call, split evenly between its pages
+SCRAPER_MAX_TOKENS = int(os.environ.get("SCRAPER_MAX_TOKENS", 6000))
+SCRAPER_CACHE_DIR = os.environ.get("SCRAPER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraper_cache"))
+SCRAPER_CACHE_FRESH_SECONDS = float(os.environ.get("SCRAPER_CACHE_FRESH_SECONDS", 300))
+SCRAPER_USER_AGENT = os.environ.get("SCRAPER_USER_AGENT", "aireas-research-assistant/1.0 (+https://github.com/aditya-ladawa/aireas)")
+
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain", "text/xml", "application/xml")
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "canvas", "iframe", "form", "button", "nav", "header", "footer", "aside"]
+BLOCK_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "pre", "blockquote", "td", "th", "dt", "dd", "figcaption"]
+
+
+@dataclass
+class Page:
+    url: str
+    title: str = ""
+    text: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: float = 0.0
+    truncated: bool = False  # the body was cut at SCRAPER_MAX_BYTES
+    error: Optional[str] = None
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    tokens = get_encoding().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_encoding().decode(tokens[:max_tokens]).rstrip() + "\n[... truncated]"
+
+
+def extract_main_content(html: str) -> tuple:
+    """(title, text) of the page's main content, one block element per line."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text(" ", strip=True) if soup.title else ""
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+
+    root = soup.find("article") or soup.find("main") or soup.find(attrs={"role": "main"})
+    if root is None:
+        # The element holding the most paragraph text, counting only its own <p> children
+        candidates = [p.parent for p in soup.find_all("p") if p.parent is not None]
+        root = max(
+            set(candidates),
+            key=lambda node: sum(len(p.get_text(strip=True)) for p in node.find_all("p", recursive=False)),
+            default=soup.body or soup,
+        )
+
+    blocks = [element.get_text(" ", strip=True) for element in root.find_all(BLOCK_TAGS) if not element.find(BLOCK_TAGS)]
+    text = "\n".join(block for block in blocks if block) or root.get_text("\n", strip=True)
+    return title, re.sub(r"\n{3,}", "\n\n", text)
+
+
+class PageCache:
+    """Extracted pages and their validators, one JSON file per URL."""
+
+    def __init__(self, directory: str = SCRAPER_CACHE_DIR):
+        self.directory = directory
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def get(self, url: str) -> Optional[Page]:
+        try:
+            with open(self.path(url)) as f:
+                return Page(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def put(self, page: Page):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(page.url)
+        with open(f"{path}.part", "w") as f:
+            json.dump(asdict(page), f)
+        os.replace(f"{path}.part", path)
+
+
+class WebScraper:
+    def __init__(self, cache: PageCache = None, per_host: int = SCRAPER_PER_HOST_CONCURRENCY, max_bytes: int = SCRAPER_MAX_BYTES, fresh_seconds: float = SCRAPER_CACHE_FRESH_SECONDS):
+        self.cache = cache or PageCache()
+        self.per_host = per_host
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self._client = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.stats = Counter()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=SCRAPER_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=SCRAPER_MAX_CONNECTIONS, max_keepalive_connections=SCRAPER_MAX_CONNECTIONS),
+                follow_redirects=True,
+                max_redirects=5,
+                headers={"User-Agent": SCRAPER_USER_AGENT, "Accept": "text/html,application/xhtml+xml,text/plain;q=0.9,*/*;q=0.1"},
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._host_semaphores.clear()
+
+    def _semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        return self._host_semaphores.setdefault(host, asyncio.Semaphore(self.per_host))
+
+    async def _read_limited(self, response: httpx.Response) -> tuple:
+        """The body up to max_bytes, and whether it was cut."""
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_bytes:
+                return b"".join(chunks)[:self.max_bytes], True
+        return b"".join(chunks), False
+
+    async def fetch(self, url: str) -> Page:
+        cached = await asyncio.to_thread(self.cache.get, url)
+        if cached is not None and time.time() - cached.fetched_at < self.fresh_seconds:
+            self.stats["fresh"] += 1
+            return cached
+
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        try:
+            async with self._semaphore(url):
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and cached is not None:
+                        self.stats["revalidated"] += 1
+                        cached.fetched_at = time.time()
+                        await asyncio.to_thread(self.cache.put, cached)
+                        return cached
+                    response.raise_for_status()
+
+                    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                    if content_type and content_type not in TEXT_CONTENT_TYPES:
+                        raise ValueError(f"unsupported content type '{content_type}'")
+                    body, truncated = await self._read_limited(response)
+                    self.stats["fetched"] += 1
+                    self.stats["bytes"] += len(body)
+                    self.stats["truncated"] += truncated
+                    html = body.decode(response.encoding or "utf-8", errors="replace")
+        except Exception as e:
+            self.stats["errors"] += 1
+            return Page(url=url, error=f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+
+        if content_type == "text/plain":
+            title, text = "", html
+        else:
+            title, text = await asyncio.to_thread(extract_main_content, html)
+        page = Page(
+            url=url, title=title, text=text,
+            etag=response.headers.get("etag"), last_modified=response.headers.get("last-modified"),
+            fetched_at=time.time(), truncated=truncated,
+        )
+        await asyncio.to_thread(self.cache.put, page)
+        return page
+
+    async def scrape(self, urls: List[str], max_tokens: int = SCRAPER_MAX_TOKENS) -> List[Page]:
+        """Fetch every URL concurrently; page texts are cut to an equal share of `max_tokens`."""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return []
+        pages = await asyncio.gather(*(self.fetch(url) for url in urls))
+        per_page = max(1, max_tokens // len(pages))
+        return [replace(page, text=truncate_to_tokens(page.text, per_page)) for page in pages]
+
+
+def format_pages(pages: List[Page]) -> str:
+    return "\n\n".join(
+        f'<Document name="{page.title}" url="{page.url}" error="{page.error}"></Document>' if page.error
+        else f'<Document name="{page.title}" url="{page.url}">\n{page.text}\n</Document>'
+        for page in pages
+    )
+
+
+web_scraper = WebScraper()
+
+
+async def close_web_scraper():
+    await web_scraper.aclose()